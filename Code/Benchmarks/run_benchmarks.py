@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+
+from Code.Benchmarks.synthetic_yelp import generate_synthetic_yelp
+from Code.create_yelp_nt_files import create_nt_file, create_checkin_nt_file, create_tip_nt_file
+from Code.create_schema_nt_files import create_schema_hierarchy_file, create_schema_mappings_file, create_inferred_types_file
+from Code.KnowledgeGraphEnrichment.location_index import build_location_index
+from Code.UtilityFunctions.metrics_functions import StageMetrics
+
+baselines_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+yelp_stages = {
+    "business": lambda read_dir, write_dir: create_nt_file("yelp_academic_dataset_business.json", read_dir, write_dir),
+    "user": lambda read_dir, write_dir: create_nt_file("yelp_academic_dataset_user.json", read_dir, write_dir),
+    "review": lambda read_dir, write_dir: create_nt_file("yelp_academic_dataset_review.json", read_dir, write_dir),
+    "checkin": lambda read_dir, write_dir: create_checkin_nt_file(read_dir, write_dir),
+    "tip": lambda read_dir, write_dir: create_tip_nt_file(read_dir, write_dir),
+    "schema_hierarchy": lambda read_dir, write_dir: create_schema_hierarchy_file(read_dir, write_dir),
+    "schema_mappings": lambda read_dir, write_dir: create_schema_mappings_file(read_dir, write_dir),
+    "inferred_types": lambda read_dir, write_dir: create_inferred_types_file(read_dir, write_dir),
+}
+
+
+def location_index_path(read_dir: str) -> str:
+    return os.path.join(read_dir, "wikidata_locations.sqlite")
+
+
+def location_stage(read_dir: str, write_dir: str):
+    # Imported here, as the location stage needs the packages of the Wikidata enrichment.
+    from Code.KnowledgeGraphEnrichment.location_from_wikidata import create_locations_nt
+    create_locations_nt(read_dir, write_dir, location_index=location_index_path(read_dir))
+
+
+def run_stage(name: str, stage, read_dir: str, write_dir: str, repeat: int) -> dict:
+    """
+    Runs a stage repeat times on empty output directories.
+    :return: The metrics of the fastest run, see StageMetrics, or None if the stage failed.
+    """
+    runs = []
+    for _ in range(repeat):
+        shutil.rmtree(write_dir, ignore_errors=True)
+        os.makedirs(write_dir)
+        try:
+            with StageMetrics(name) as metrics:
+                stage(read_dir, write_dir)
+        except Exception as e:
+            print(f"{name} failed: {type(e).__name__}: {e}")
+            return None
+        runs.append(metrics.as_dict())
+    return min(runs, key=lambda run: run["seconds"])
+
+
+def compare(results: dict, baselines: dict, tolerance: float) -> list:
+    """
+    Compares the results of a benchmark to the baselines of the same scale.
+    :return: One row per stage with the records/s, the seconds and the peak memory next to the baselines, and whether
+    the stage regressed: slower, or using more memory, by more than the tolerance.
+    """
+    rows = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        row = {"stage": name, "result": result, "baseline": baseline, "regressed": False}
+        if result is None:
+            row["regressed"] = baseline is not None  # Failing where it used to work counts as a regression.
+        elif baseline:
+            row["regressed"] = (result["seconds"] > baseline["seconds"] * (1 + tolerance)
+                                or (result["peak_rss_bytes"] or 0) > (baseline["peak_rss_bytes"] or float("inf")) * (1 + tolerance))
+        rows.append(row)
+    return rows
+
+
+def print_comparison(rows: list):
+    print(f"{'stage':<18}{'records/s':>12}{'baseline':>12}{'seconds':>10}{'baseline':>10}{'peak MB':>10}{'baseline':>10}")
+    for row in rows:
+        if row["result"] is None:
+            print(f"{row['stage']:<18}{'FAILED':>12}{'  REGRESSED' if row['regressed'] else ''}")
+            continue
+        result, baseline = row["result"], row["baseline"] or {}
+
+        def number(metrics, key, scale=1, digits=0):
+            return "-" if metrics.get(key) is None else f"{metrics[key] / scale:,.{digits}f}"
+
+        print(f"{row['stage']:<18}"
+              f"{number(result, 'records_per_second'):>12}{number(baseline, 'records_per_second'):>12}"
+              f"{number(result, 'seconds', digits=2):>10}{number(baseline, 'seconds', digits=2):>10}"
+              f"{number(result, 'peak_rss_bytes', 1e6):>10}{number(baseline, 'peak_rss_bytes', 1e6):>10}"
+              f"{'  REGRESSED' if row['regressed'] else ''}")
+
+
+def run_benchmarks(work_dir: str, businesses: int = 1000, seed: int = 0, repeat: int = 3, update_baselines: bool = False,
+                   tolerance: float = 0.25) -> bool:
+    """
+    Times every converter, the Schema stages and the location stage on a synthetic Yelp dataset, and compares the
+    records/s, seconds and peak memory to the baselines stored in baselines.json for the same scale. The location stage
+    resolves the cities with a location index built from the synthetic Wikidata dump, so it needs no access to Wikidata.
+    :param work_dir: The directory to write the synthetic dataset and the triple files to.
+    :param businesses: The scale of the synthetic dataset, see generate_synthetic_yelp.
+    :param seed: The seed of the synthetic dataset.
+    :param repeat: The number of runs per stage, the fastest one counts.
+    :param update_baselines: Whether to store the results as the new baselines of this scale.
+    :param tolerance: The fraction by which a stage may be slower or use more memory than its baseline.
+    :return: Whether any stage regressed.
+    """
+    read_dir = os.path.join(work_dir, f"yelp_{businesses}_{seed}")
+    write_dir = os.path.join(work_dir, "output")
+
+    if not os.path.isfile(os.path.join(read_dir, "wikidata_locations.json")):  # The last file written.
+        generate_synthetic_yelp(read_dir, businesses=businesses, seed=seed)
+    if not os.path.isfile(location_index_path(read_dir)):
+        build_location_index(os.path.join(read_dir, "wikidata_locations.json"), location_index_path(read_dir))
+
+    stages = {**yelp_stages, "locations": location_stage}
+    results = {name: run_stage(name, stage, read_dir, write_dir, repeat) for name, stage in stages.items()}
+
+    baselines = dict()
+    if os.path.isfile(baselines_path):
+        with open(baselines_path, mode="rt") as file:
+            baselines = json.load(file)
+
+    rows = compare(results, baselines.get(str(businesses), {}), tolerance)
+    print_comparison(rows)
+
+    if update_baselines:
+        baselines[str(businesses)] = {name: {key: result[key] for key in ("seconds", "records", "triples", "records_per_second",
+                                                                          "triples_per_second", "peak_rss_bytes")}
+                                      for name, result in results.items() if result is not None}
+        with open(baselines_path, mode="wt") as file:
+            json.dump(baselines, file, indent=2)
+        print(f"Stored the results as the baselines for {businesses} businesses")
+
+    return any(row["regressed"] for row in rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the YCKG stages on a synthetic Yelp dataset.")
+    parser.add_argument('--work_dir', type=str, help='The directory to write the synthetic dataset and the triple files to')
+    parser.add_argument('--businesses', type=int, default=1000, help='The number of businesses of the synthetic dataset')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the synthetic dataset')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of runs per stage, the fastest one counts')
+    parser.add_argument('--update_baselines', type=bool, help='Whether to store the results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='The fraction by which a stage may be slower or use more memory than its baseline')
+    args = parser.parse_args()
+
+    regressed = run_benchmarks(work_dir=args.work_dir, businesses=args.businesses, seed=args.seed, repeat=args.repeat,
+                               update_baselines=args.update_baselines, tolerance=args.tolerance)
+    sys.exit(1 if regressed else 0)
@@ -0,0 +1,139 @@
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from Code.UtilityFunctions.wikidata_functions import EntitySearchClient, set_wikidata_options
+
+
+class MockWikidataServer:
+    """
+    Local stand-in for the wbsearchentities action of the MediaWiki API, with a fixed latency per request and a fraction
+    of 429 and 503 responses, to measure the entity search client without calling Wikidata.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.05, error_rate: float = 0.0, seed: int = 0):
+        """
+        :param port: The port to listen on, a free one if 0.
+        :param latency: The seconds every response is delayed.
+        :param error_rate: The fraction of requests answered with 429 (with a Retry-After of 0 seconds) or 503.
+        :param seed: The seed of the errors.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_endpoint(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/w/api.php"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keeps the connections alive, as Wikidata does.
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                with server._lock:
+                    server.requests += 1
+                    status = server._random.choice([429, 503]) if server._random.random() < server.error_rate else 200
+                    server.errors += status != 200
+
+                search = parse_qs(urlparse(self.path).query).get("search", [""])[0]
+                # A few made up results per search, the same for the same search.
+                results = random.Random(zlib.crc32(search.encode())).sample(range(1, 10 ** 6), k=len(search) % 4)
+                body = json.dumps({"search": [{"id": f"Q{qid}"} for qid in results]} if status == 200 else {}).encode()
+
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def benchmark_search(searches: int = 500, distinct: int = 300, workers: int = 8, requests_per_second: float = 50.0,
+                     latency: float = 0.05, error_rate: float = 0.05, seed: int = 0) -> dict:
+    """
+    Runs searches against a MockWikidataServer, once one after the other and once with search_many, without a cache.
+    :param searches: The number of searches, of which only distinct are different, like the city names of Yelp.
+    :param distinct: The number of different searches.
+    :param workers: The number of threads of the concurrent run.
+    :param requests_per_second: The rate limit of both runs.
+    :param latency: The seconds the mock server takes per response.
+    :param error_rate: The fraction of responses that are a 429 or 503, which are retried.
+    :param seed: The seed of the searches and the errors.
+    :return: The seconds, searches per second and client statistics of both runs.
+    """
+    rng = random.Random(seed)
+    names = [f"City{number}%2C%20State{number % 50}" for number in range(distinct)]
+    search_strings = [rng.choice(names) for _ in range(searches)]
+
+    set_wikidata_options(cache_path="")  # Measures the client, not the cache.
+    results = dict()
+    with MockWikidataServer(latency=latency, error_rate=error_rate, seed=seed) as server:
+        for name, run_workers in (("sequential", 1), ("concurrent", workers)):
+            client = EntitySearchClient(server.api_endpoint, requests_per_second=requests_per_second, workers=run_workers,
+                                        backoff=0.05)
+            start = time.perf_counter()
+            if run_workers == 1:
+                for search_string in search_strings:
+                    client.search(search_string)
+            else:
+                client.search_many(search_strings)
+            seconds = time.perf_counter() - start
+            client.close()
+            results[name] = {"seconds": round(seconds, 3), "searches_per_second": round(searches / seconds, 1),
+                             **client.statistics()}
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measures the Wikidata entity search client against a local mock API.")
+    parser.add_argument('--searches', type=int, default=500, help='The number of searches')
+    parser.add_argument('--distinct', type=int, default=300, help='The number of different searches')
+    parser.add_argument('--workers', type=int, default=8, help='The number of threads of the concurrent run')
+    parser.add_argument('--requests_per_second', type=float, default=50.0, help='The rate limit of the client')
+    parser.add_argument('--latency', type=float, default=0.05, help='The seconds the mock API takes per response')
+    parser.add_argument('--error_rate', type=float, default=0.05, help='The fraction of 429 and 503 responses')
+    args = parser.parse_args()
+
+    results = benchmark_search(searches=args.searches, distinct=args.distinct, workers=args.workers,
+                               requests_per_second=args.requests_per_second, latency=args.latency,
+                               error_rate=args.error_rate)
+    print(json.dumps(results, indent=2))
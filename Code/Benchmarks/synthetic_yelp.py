@@ -0,0 +1,302 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import string
+
+import pandas as pd
+
+from Code.KnowledgeGraphEnrichment.location_dicts import states, q_codes
+
+# Number of objects per business in the Yelp Open Dataset: 150,346 businesses, 1,987,897 users, 6,990,280 reviews,
+# 908,915 tips and 131,930 checkins.
+ratios = {"user": 13.2, "review": 46.5, "tip": 6.05, "checkin": 0.88}
+
+# Metro areas of the Yelp Open Dataset, with a few of the spelling variants found in the real file.
+cities = [
+    (["Philadelphia", "philadelphia", "Philadelphia "], "PA", 39.95, -75.16),
+    (["Tampa", "Tampa Bay"], "FL", 27.95, -82.46),
+    (["Indianapolis"], "IN", 39.77, -86.16),
+    (["Nashville"], "TN", 36.16, -86.78),
+    (["Tucson"], "AZ", 32.22, -110.97),
+    (["New Orleans"], "LA", 29.95, -90.07),
+    (["Edmonton"], "AB", 53.55, -113.49),
+    (["Saint Louis", "St. Louis", "St Louis"], "MO", 38.63, -90.20),
+    (["Reno"], "NV", 39.53, -119.81),
+    (["Boise"], "ID", 43.62, -116.20),
+    (["Santa Barbara"], "CA", 34.42, -119.70),
+    (["Clearwater"], "FL", 27.97, -82.80),
+    (["Wilmington"], "DE", 39.74, -75.55),
+    (["Cherry Hill"], "NJ", 39.93, -75.03),
+]
+
+weekdays = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# The nested attributes, stored by Yelp as the Python representation of a dictionary.
+nested_attributes = {
+    "BusinessParking": ["garage", "street", "validated", "lot", "valet"],
+    "Ambience": ["romantic", "intimate", "touristy", "hipster", "divey", "classy", "trendy", "upscale", "casual"],
+    "GoodForMeal": ["dessert", "latenight", "lunch", "dinner", "brunch", "breakfast"],
+    "Music": ["dj", "background_music", "no_music", "jukebox", "live", "video", "karaoke"],
+    "BestNights": ["monday", "tuesday", "friday", "wednesday", "thursday", "sunday", "saturday"],
+    "HairSpecializesIn": ["straightperms", "coloring", "extensions", "africanamerican", "curly", "kids", "perms", "asian"],
+    "DietaryRestrictions": ["dairy-free", "gluten-free", "vegan", "kosher", "halal", "soy-free", "vegetarian"],
+}
+
+boolean_attributes = ["BikeParking", "BusinessAcceptsCreditCards", "RestaurantsTakeOut", "RestaurantsDelivery", "Caters",
+                      "WheelchairAccessible", "HappyHour", "OutdoorSeating", "HasTV", "RestaurantsReservations",
+                      "DogsAllowed", "ByAppointmentOnly", "GoodForKids", "RestaurantsGoodForGroups", "CoatCheck"]
+
+# Attributes with a string value, written as u'...' or '...' like in the real file.
+string_attributes = {
+    "WiFi": ["no", "free", "paid"],
+    "Alcohol": ["none", "full_bar", "beer_and_wine"],
+    "NoiseLevel": ["quiet", "average", "loud", "very_loud"],
+    "RestaurantsAttire": ["casual", "dressy", "formal"],
+}
+
+compliments = ["hot", "more", "profile", "cute", "list", "note", "plain", "cool", "funny", "writer", "photos"]
+
+words = ("the food was great and service friendly but we waited a long time for our table so next time "
+         "I will order take out pizza burger coffee staff amazing place definitely recommend again price "
+         "value atmosphere parking clean \"best\" it's").split()
+
+_id_characters = string.ascii_letters + string.digits + "-_"
+
+
+def random_id(rng: random.Random) -> str:
+    return "".join(rng.choices(_id_characters, k=22))
+
+
+def random_datetime(rng: random.Random, first_year: int = 2005, last_year: int = 2022) -> str:
+    start = datetime.datetime(first_year, 1, 1)
+    seconds = rng.randrange(int((datetime.datetime(last_year, 1, 1) - start).total_seconds()))
+    return (start + datetime.timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def random_text(rng: random.Random, mean_words: int) -> str:
+    text = " ".join(rng.choices(words, k=max(1, int(rng.expovariate(1 / mean_words)))))
+    return text.replace(" next ", ".\n\nNext ")  # Reviews contain paragraphs.
+
+
+def python_literal(value) -> str:
+    """Writes a value the way the Yelp attributes are written, e.g. u'free' or {'garage': False, 'lot': True}."""
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"'{key}': {python_literal(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, str):
+        return repr(value)
+    return str(value)
+
+
+def business_attributes(rng: random.Random):
+    if rng.random() < 0.09:
+        return None
+
+    attributes = dict()
+    for name in rng.sample(boolean_attributes, rng.randint(1, 8)):
+        attributes[name] = rng.choice(["True", "False", "True", "None"])
+    if rng.random() < 0.6:
+        attributes["RestaurantsPriceRange2"] = rng.choice(["1", "2", "2", "3", "4", "None"])
+    for name, values in string_attributes.items():
+        if rng.random() < 0.4:
+            value = rng.choice(values)
+            attributes[name] = rng.choice([f"u'{value}'", f"'{value}'", "None"])
+    for name, keys in nested_attributes.items():
+        if rng.random() < (0.6 if name in ("BusinessParking", "Ambience", "GoodForMeal") else 0.05):
+            if rng.random() < 0.05:
+                attributes[name] = "None"
+            else:
+                # Like in the real file, a few combinations make up most of the values.
+                value = {key: False for key in (keys if rng.random() < 0.8 else keys[:2])}
+                if rng.random() < 0.7:
+                    value[rng.choice(list(value))] = True
+                if rng.random() < 0.1:
+                    value[rng.choice(list(value))] = None
+                attributes[name] = python_literal(value)
+    return attributes
+
+
+def business_hours(rng: random.Random):
+    if rng.random() < 0.15:
+        return None
+    opening, closing = rng.choice([(7, 15), (8, 22), (11, 23), (17, 2), (0, 0)])
+    return {day: f"{opening}:0-{closing}:0" for day in weekdays if rng.random() < 0.85}
+
+
+def generate_businesses(rng: random.Random, n: int, categories: list) -> list:
+    business_ids = [random_id(rng) for _ in range(n)]
+    records = []
+    for business_id in business_ids:
+        names, state, latitude, longitude = rng.choice(cities)
+        records.append({"business_id": business_id,
+                        "name": rng.choice(["Abby Rappoport, LAC, CMQ", "Joe's \"Famous\" Pizza", "Café Tollan",
+                                            "The UPS Store", "St Honore Pastries", "Sonic Drive-In"]),
+                        "address": f"{rng.randint(1, 9999)} {rng.choice(['Chapala St', 'Walnut St', 'Main St, Ste 2'])}",
+                        "city": rng.choice(names),
+                        "state": state,
+                        "postal_code": f"{rng.randint(10000, 99999)}",
+                        "latitude": round(latitude + rng.uniform(-0.3, 0.3), 7),
+                        "longitude": round(longitude + rng.uniform(-0.3, 0.3), 7),
+                        "stars": rng.choice([1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]),
+                        "review_count": int(rng.paretovariate(1.2)) + 4,
+                        "is_open": rng.choice([0, 1, 1, 1]),
+                        "attributes": business_attributes(rng),
+                        "categories": ", ".join(rng.sample(categories, rng.randint(1, 6))) if rng.random() > 0.01 else None,
+                        "hours": business_hours(rng)})
+    return records
+
+
+def generate_users(rng: random.Random, n: int) -> list:
+    user_ids = [random_id(rng) for _ in range(n)]
+    records = []
+    for user_id in user_ids:
+        n_friends = min(int(rng.paretovariate(0.9)) - 1, n - 1, 5000)
+        record = {"user_id": user_id,
+                  "name": rng.choice(["Walter", "Daniel", "Steph", "Gwen", "Karen"]),
+                  "review_count": int(rng.paretovariate(1.1)),
+                  "yelping_since": random_datetime(rng),
+                  "useful": int(rng.paretovariate(0.8)) - 1,
+                  "funny": int(rng.paretovariate(0.8)) - 1,
+                  "cool": int(rng.paretovariate(0.8)) - 1,
+                  # Elite years are comma-joined, and 2020 is written as "20,20" in the real file.
+                  "elite": "" if rng.random() < 0.95 else ",".join(sorted(rng.sample(["2012", "2015", "2017", "2018", "2019", "20,20", "2021"], rng.randint(1, 4)))),
+                  "friends": ", ".join(rng.sample(user_ids, n_friends)) if n_friends > 0 else "None",
+                  "fans": int(rng.paretovariate(1.5)) - 1,
+                  "average_stars": round(rng.uniform(1, 5), 2)}
+        for compliment in compliments:
+            record[f"compliment_{compliment}"] = int(rng.paretovariate(1.2)) - 1
+        records.append(record)
+    return records
+
+
+def wikidata_entity(qid: str, label: str, classes: list = (), subclass_of: list = (), located_in: list = (),
+                    aliases: list = (), coordinates: tuple = None, population: int = None) -> dict:
+    """An entity in the JSON format of the Wikidata dumps, with only the claims the location index reads."""
+    def claim(value: dict, **rest) -> dict:
+        return {"mainsnak": {"snaktype": "value", "datavalue": {"value": value}}, "rank": "normal", **rest}
+
+    claims = {"P31": [claim({"id": cls}) for cls in classes], "P279": [claim({"id": cls}) for cls in subclass_of]}
+    if located_in:
+        claims["P131"] = [claim({"id": area}) for area in located_in]
+    if coordinates:
+        claims["P625"] = [claim({"latitude": coordinates[0], "longitude": coordinates[1]})]
+    if population:
+        claims["P1082"] = [claim({"amount": f"+{population}"}, qualifiers={"P585": [
+            {"snaktype": "value", "datavalue": {"value": {"time": "+2020-01-01T00:00:00Z"}}}]})]
+    return {"id": qid, "labels": {"en": {"value": label}}, "aliases": {"en": [{"value": alias} for alias in aliases]},
+            "claims": claims, "sitelinks": {}}
+
+
+def generate_synthetic_wikidata(write_path: str) -> int:
+    """
+    Writes a subset of a Wikidata JSON dump with the places of the synthetic businesses, from which build_location_index
+    builds an index for the location stage: every city of cities, with its spelling variants as aliases, in a county,
+    state and country. "Tampa Bay" is not an alias, so one spelling is not found, like in the real data.
+    :param write_path: The file to write the entities to, one per line.
+    :return: The number of entities written.
+    """
+    big_city, us_state = "Q1549591", "Q35657"
+    entities = [wikidata_entity(big_city, "big city", subclass_of=["Q486972"]),
+                wikidata_entity(us_state, "state of the United States", subclass_of=[q_codes["state"]]),
+                wikidata_entity("Q30", "United States", [q_codes["country"]], aliases=["USA"]),
+                wikidata_entity("Q16", "Canada", [q_codes["country"]])]
+
+    areas = dict()
+    for number, (names, state, latitude, longitude) in enumerate(cities):
+        country = "Q16" if state == "AB" else "Q30"
+        if state not in areas:
+            areas[state] = f"Q{1_000_000 + len(areas)}"
+            entities.append(wikidata_entity(areas[state], states[state], [q_codes["province"] if country == "Q16" else us_state],
+                                            located_in=[country]))
+        located_in = [areas[state]]
+        if country == "Q30":
+            county = f"Q{2_000_000 + number}"
+            entities.append(wikidata_entity(county, f"{names[0]} County", [q_codes["county"]], located_in=[areas[state]]))
+            located_in = [county]
+
+        population = 100_000 * (len(cities) - number)
+        entities.append(wikidata_entity(f"Q{3_000_000 + number}", names[0],
+                                        [big_city if population >= 500_000 else "Q486972"], located_in=located_in,
+                                        aliases=[name.strip() for name in names[1:] if name != "Tampa Bay"],
+                                        coordinates=(latitude, longitude), population=population))
+
+    with open(write_path, mode="wt", encoding="utf-8") as file:
+        for entity in entities:
+            file.write(json.dumps(entity) + "\n")
+    return len(entities)
+
+
+def generate_synthetic_yelp(write_dir: str, businesses: int = 1000, seed: int = 0, utility_dir: str = "UtilityData"):
+    """
+    Writes synthetic yelp_academic_dataset_{business,user,review,tip,checkin}.json files with the shapes of the Yelp Open
+    Dataset: stringified attribute dictionaries, u'...' strings, comma-joined categories and friends, "20,20" elite years,
+    and long checkin date lists. The number of users, reviews, tips and checkins follows the ratios of the real dataset.
+    The same seed always gives the same files.
+    :param write_dir: The directory to write the files to.
+    :param businesses: The number of businesses, which sets the scale of the other files.
+    :param seed: The seed of the random generator.
+    :param utility_dir: The directory with the CSV files of the Schema stages, which are copied to write_dir and whose
+    categories are used for the businesses.
+    Also writes wikidata_locations.json, a Wikidata dump of the places of the businesses, see generate_synthetic_wikidata.
+    :return: The number of objects written per file.
+    """
+    if not os.path.exists(write_dir): os.makedirs(write_dir)
+    rng = random.Random(seed)
+
+    for csv_file in ("yelp_category_schema_mappings.csv", "manually_split_categories.csv", "schemaorg-current-https-types.csv"):
+        shutil.copyfile(os.path.join(utility_dir, csv_file), os.path.join(write_dir, csv_file))
+    categories = pd.read_csv(os.path.join(utility_dir, "yelp_category_schema_mappings.csv"))["YelpCategory"].tolist()
+    categories += ["Restaurants", "Food", "Shopping", "Nightlife", "Bars", "Beauty & Spas", "Home Services"] * 10
+
+    counts = {"business": businesses, **{entity: max(1, round(businesses * ratio)) for entity, ratio in ratios.items()}}
+
+    business_records = generate_businesses(rng, counts["business"], categories)
+    business_ids = [record["business_id"] for record in business_records]
+    user_records = generate_users(rng, counts["user"])
+    user_ids = [record["user_id"] for record in user_records]
+
+    def write(entity, records):
+        with open(os.path.join(write_dir, f"yelp_academic_dataset_{entity}.json"), mode="wt", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    write("business", business_records)
+    write("user", user_records)
+    del business_records, user_records
+
+    write("review", ({"review_id": random_id(rng),
+                      "user_id": rng.choice(user_ids),
+                      "business_id": rng.choice(business_ids),
+                      "stars": rng.choice([1.0, 2.0, 3.0, 4.0, 5.0, 5.0]),
+                      "useful": int(rng.paretovariate(1.5)) - 1,
+                      "funny": int(rng.paretovariate(2)) - 1,
+                      "cool": int(rng.paretovariate(2)) - 1,
+                      "text": random_text(rng, 100),
+                      "date": random_datetime(rng)} for _ in range(counts["review"])))
+
+    write("tip", ({"user_id": rng.choice(user_ids),
+                   "business_id": rng.choice(business_ids),
+                   "text": random_text(rng, 10),
+                   "date": random_datetime(rng),
+                   "compliment_count": int(rng.paretovariate(3)) - 1} for _ in range(counts["tip"])))
+
+    # Checkins are long lists of dates, with repeated dates, and a heavy tail of businesses with thousands of them.
+    write("checkin", ({"business_id": business_id,
+                       "date": ", ".join(sorted(random_datetime(rng, 2010) for _ in range(min(int(rng.paretovariate(0.7)), 20000))))}
+                      for business_id in rng.sample(business_ids, min(counts["checkin"], len(business_ids)))))
+
+    generate_synthetic_wikidata(os.path.join(write_dir, "wikidata_locations.json"))
+
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Writes a synthetic Yelp Open Dataset.")
+    parser.add_argument('--write_dir', type=str, help='The directory to write the synthetic Yelp files to')
+    parser.add_argument('--businesses', type=int, default=1000, help='The number of businesses, the other files are scaled to it')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the random generator')
+    args = parser.parse_args()
+
+    print(generate_synthetic_yelp(write_dir=args.write_dir, businesses=args.businesses, seed=args.seed))
@@ -2,17 +2,42 @@ import sys
 sys.path.append(sys.path[0][:sys.path[0].find('YelpOpenDatasetKnowledgeGraph') + len('YelpOpenDatasetKnowledgeGraph')])
 
 import os
-import gzip
 
 import pandas as pd
-from rdflib import Graph, URIRef, Literal, XSD, RDFS, Namespace
+from rdflib import XSD, RDFS, Namespace
 
-from Code.UtilityFunctions.wikidata_functions import wikidata_query, category_query
+from Code.UtilityFunctions.wikidata_functions import batched_wikidata_query, cached_call, category_batch_query
+from Code.UtilityFunctions.output_functions import open_triple_file, output_path
+from Code.UtilityFunctions.ntriples_functions import get_emitter, render_iris
 
 skos = Namespace("https://www.w3.org/2004/02/skos/core#")
 yelpcat = Namespace("https://purl.archive.org/purl/yckg/categories#")
 yelpvoc = Namespace("https://purl.archive.org/purl/yckg/vocabulary#")
 
+def schema_wikidata_items(schema_iris: list) -> pd.DataFrame:
+    """Finds the Wikidata items with a P1709 (equivalent class) relation to each of the Schema types, with batched queries.
+
+    The whole result is cached under the list of Schema types as well, so an unchanged mapping file is resolved without
+    calling Wikidata, even if the batches it was queried in had to be split.
+
+    Args:
+        schema_iris (list): The IRIs of the Schema types
+
+    Returns:
+        pd.DataFrame: The columns `SchemaType`, `QID` and `Label`, one row per Schema type and item
+    """
+    schema_iris = sorted(set(schema_iris))
+
+    def fetch():
+        results = batched_wikidata_query(category_batch_query, schema_iris)
+        if results.empty:
+            return []
+        return results[["schemaType.value", "item.value", "itemLabel.value"]].values.tolist()
+
+    rows = cached_call("schema_mapping", "\n".join(schema_iris), fetch)
+    return pd.DataFrame(rows, columns=['SchemaType', 'QID', 'Label'], dtype=object).drop_duplicates(ignore_index=True)
+
+
 def create_yelp_wiki_mapping(read_dir: str, write_dir: str) -> None:
     """This function creates a GZIP-compressed .nt file with the Yelp-Wikidata mappings.
 
@@ -28,57 +53,29 @@ def create_yelp_wiki_mapping(read_dir: str, write_dir: str) -> None:
     schema_mapping = schema_mapping.explode('SchemaType')
     schema_mapping['SchemaType'] = schema_mapping['SchemaType'].apply(lambda x: "https://schema.org/" + x)  # Add IRI
 
-    # Initialise empty DataFrame with columns `SchemaType`, `QID`, and `Label` and populate it with Schema-Wikidata mappings
-    wikidata_mapping = pd.DataFrame(columns=['SchemaType', 'QID', 'Label'])
-    for _type in schema_mapping['SchemaType']:
-        wikidata_cat_query = wikidata_query(category_query(schema_iri=_type))  # Query Wikidata for any items with a SameAs relation to the specifid Schema Type `_type`
+    # Query Wikidata once for the items with a SameAs relation to any of the distinct Schema Types
+    wikidata_mapping = schema_wikidata_items(schema_mapping['SchemaType'].tolist())
 
-        if not wikidata_cat_query.empty:  # If the query finds no results, we skip the _type
-            to_concat = {'SchemaType': _type,
-                        'QID': list(wikidata_cat_query['item.value']),
-                        'Label': list(wikidata_cat_query['itemLabel.value'])}
-            
-            wikidata_mapping = wikidata_mapping.append(to_concat, ignore_index=True)
+    mapping_dataframe = pd.merge(left=wikidata_mapping, right=schema_mapping, how='left', on='SchemaType')  # Merge the Schema-Wikidata mappings with the Schema-Yelp mappings
 
-    # Clean the resulting DataFrame containing the mappings. Any list results are exploded into new rows, duplicates are dropped, and the index is reset.
-    wikidata_mapping = wikidata_mapping.explode("QID")
-    wikidata_mapping = wikidata_mapping.explode("Label")
-    wikidata_mapping = wikidata_mapping.drop_duplicates()
-    wikidata_mapping = wikidata_mapping.reset_index(drop=True)
+    # Render the terms of all rows at once. The labels are few, so they are rendered once each.
+    emitter = get_emitter()
+    categories = render_iris(str(yelpcat) + mapping_dataframe["YelpCategory"].str.replace(' ', '_', regex=False)
+                             .str.replace("&", "_", regex=False).str.replace("/", "_", regex=False))
+    items = render_iris(mapping_dataframe["QID"])
+    labels = {label: emitter.literal(label, XSD.string) for label in mapping_dataframe["Label"].unique()}
 
-    mapping_dataframe = pd.merge(left=wikidata_mapping, right=schema_mapping, how='left', on='SchemaType')  # Merge the Schema-Wikidata mappings with the Schema-Yelp mappings
+    lines = pd.concat([
+        categories + f" {emitter.term(skos + 'relatedMatch')} " + items + " .\n",  # The mapping
+        items + f" {emitter.term(RDFS.label)} " + mapping_dataframe["Label"].map(labels) + " .\n",  # The Wikidata label
+        f"{emitter.term(yelpvoc + 'WikidataCategory')} {emitter.term(skos + 'Member')} " + items + " .\n"  # The class of the QID as stemming from Wikidata
+    ]).drop_duplicates()
 
     # Create RDF file
-    triple_file = os.path.join(write_dir, "yelp_wiki_mappings.nt.gz")  # Compress into .gz format to save space on disk
+    triple_file = output_path(os.path.join(write_dir, "yelp_wiki_mappings.nt.gz"))  # Compressed with the chosen codec to save space on disk
 
     if os.path.isfile(triple_file):  # Remove file if it already exists
         os.remove(triple_file)
 
-    triple_file = gzip.open(filename=triple_file, mode="at", encoding="utf-8")
-
-    # Initialise empty graph and populate with Yelp-Wikidata mappings
-    G = Graph()
-    for idx, row in mapping_dataframe.iterrows():
-        # Add (spo) with mapping
-        G.add(triple=(
-            URIRef(yelpcat + row.YelpCategory.replace(' ', '_').replace("&", "_").replace("/", "_")), # Subject
-            URIRef(skos + "relatedMatch"),          # Predicate
-            URIRef(row.QID)                         # Object
-        ))
-
-        # Add (spo) with Wikidata label
-        G.add(triple=(
-            URIRef(row.QID),
-            RDFS.label,
-            Literal(row.Label, datatype=XSD.string)
-        ))
-
-        # Add (spo) specifying the class of the QID as stemming from Wikidata
-        G.add(triple=(
-            URIRef(yelpvoc + "WikidataCategory"),
-            URIRef(skos + "Member"),
-            URIRef(row.QID)
-        ))
-
-    triple_file.write(G.serialize(format='nt'))
-    triple_file.close()
+    with open_triple_file(triple_file, mode="at") as file:
+        file.write("".join(lines))
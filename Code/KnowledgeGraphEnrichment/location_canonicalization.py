@@ -0,0 +1,112 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from Code.UtilityFunctions.spatial_functions import haversine
+
+# Abbreviations that are spelled out in the keys of city names, so "St. Louis" and "Saint Louis" share a key.
+abbreviations = {"st": "saint", "ste": "sainte", "ft": "fort", "mt": "mount", "pt": "point"}
+
+# Two spellings of a city are only merged if the mean locations of their businesses are this close.
+max_cluster_km = 25.0
+
+
+def city_key(name: str) -> str:
+    """
+    The normalized key of a city name: without accents, case, punctuation and repeated whitespace, and with the usual
+    abbreviations spelled out. "Philadelphia ", "philadelphia" and "PHILADELPHIA" share the key "philadelphia".
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char)).casefold()
+    words = re.sub(r"[^\w\s]|_", " ", name.replace("'", "")).split()
+    return " ".join(abbreviations.get(word, word) for word in words)
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """The Levenshtein distance between two strings, or limit + 1 as soon as it is known to be above the limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def typo_limit(word: str) -> int:
+    """
+    The number of typos tolerated between two spellings of a word: none below eight letters, where one letter often makes
+    another town, like "Newtown" and "Newton" or "Media" and "Medina".
+    """
+    return 0 if len(word) < 8 else 1 if len(word) < 12 else 2
+
+
+def is_typo(key: str, other: str) -> bool:
+    """
+    Whether two city keys are spellings of the same name: they have the same words, except for long words that are within
+    the typo limit of each other. "pittsburg" is a typo of "pittsburgh", "newtown square" is not one of "newton square".
+    """
+    words, other_words = key.split(), other.split()
+    if len(words) != len(other_words):
+        return False
+    for word, other_word in zip(words, other_words):
+        if word == other_word:
+            continue
+        limit = min(typo_limit(word), typo_limit(other_word))
+        if not limit or edit_distance(word, other_word, limit) > limit:
+            return False
+    return True
+
+
+def canonical_cities(biz: pd.DataFrame, max_km: float = max_cluster_km) -> pd.Series:
+    """
+    Clusters the spellings of the city names within every state, so each city is looked up once. Spellings with the same
+    city_key are one cluster. Two clusters are merged when their keys are typos of each other, see is_typo, and the mean
+    locations of their businesses are within max_km, so "Pittsburg" is merged with "Pittsburgh" but "Newtown" is not
+    merged with "Newton". Every cluster is named after the spelling used by most businesses.
+    :param biz: The businesses, with the columns city, state, latitude and longitude.
+    :param max_km: The largest distance between the mean locations of two clusters that are merged.
+    :return: The canonical city name of every business, with the index of biz.
+    """
+    spellings = (biz.groupby(["state", "city"])
+                 .agg(businesses=("latitude", "size"), latitude=("latitude", "mean"), longitude=("longitude", "mean"))
+                 .reset_index())
+    spellings["key"] = spellings["city"].map(city_key)
+
+    canonical = {}
+    for state, group in spellings.groupby("state"):
+        # The clusters of identical keys, with the mean location of all their businesses.
+        keys = (group.assign(lat_sum=group["latitude"] * group["businesses"], lon_sum=group["longitude"] * group["businesses"])
+                .groupby("key")[["businesses", "lat_sum", "lon_sum"]].sum())
+        names = list(keys.index)
+        latitudes = (keys["lat_sum"] / keys["businesses"]).to_numpy()
+        longitudes = (keys["lon_sum"] / keys["businesses"]).to_numpy()
+
+        parents = list(range(len(names)))
+
+        def root(number):
+            while parents[number] != number:
+                parents[number] = parents[parents[number]]
+                number = parents[number]
+            return number
+
+        for i in range(len(names)):
+            distances = haversine(latitudes[i], longitudes[i], latitudes[i + 1:], longitudes[i + 1:])
+            for j in np.flatnonzero(distances <= max_km) + i + 1:
+                if is_typo(names[i], names[j]):
+                    parents[root(j)] = root(i)
+
+        clusters = {key: names[root(number)] for number, key in enumerate(names)}
+        group = group.assign(cluster=group["key"].map(clusters)).sort_values(["businesses", "city"], ascending=[False, True])
+        # The first spelling of every cluster is the one used by most businesses.
+        names_of_clusters = group.drop_duplicates("cluster").set_index("cluster")["city"]
+        for city, cluster in zip(group["city"], group["cluster"]):
+            canonical[(state, city)] = names_of_clusters[cluster]
+
+    return pd.Series([canonical[key] for key in zip(biz["state"], biz["city"])], index=biz.index, dtype=object)
@@ -1,14 +1,21 @@
-import json
-import requests
-import gzip
 import pandas as pd
 import os
 
-from rdflib import Graph, URIRef, Literal, XSD
+from types import SimpleNamespace
+
+from rdflib import XSD
 from rdflib.namespace import RDFS
 
-from Code.UtilityFunctions.wikidata_functions import wikidata_query
+from Code.UtilityFunctions.wikidata_functions import wikidata_query, wikidata_search, wikidata_search_many, batched_wikidata_query, \
+    CacheMiss
+from Code.UtilityFunctions.output_functions import open_triple_file, output_path
+from Code.UtilityFunctions.columnar_functions import load_columns
+from Code.UtilityFunctions.ntriples_functions import get_emitter, render_iris
+from Code.UtilityFunctions.metrics_functions import StageMetrics
+from Code.UtilityFunctions.checkpoint_functions import StageCheckpoint
 from Code.KnowledgeGraphEnrichment.location_dicts import states, q_codes
+from Code.KnowledgeGraphEnrichment.location_index import LocationIndex, closest_cities, point_coordinates
+from Code.KnowledgeGraphEnrichment.location_canonicalization import canonical_cities
 from Code.KnowledgeGraphEnrichment.location_namespaces import schema, wd, yelpent, population_predicate, instance_of_predicate,location_predicate
 
 
@@ -23,18 +30,12 @@ def return_city_q_ids(search_string: str):
         str: A string with the q_ids of the cities matching the search string, separated by spaces
     """
 
-    url = f"https://www.wikidata.org/w/api.php?action=wbsearchentities&format=json&language=en&type=item&continue=0&search={search_string}"
-
-    response = requests.get(url)
-    data = json.loads(response.text)
+    data = wikidata_search(search_string)
 
     q_ids = [Q["id"] for Q in data["search"]]
 
     if not q_ids:  # Empty – no result given
-        url = f"https://www.wikidata.org/w/api.php?action=wbsearchentities&format=json&language=en&type=item&continue=0&search={search_string.partition(',')[0]}"
-
-        response = requests.get(url)
-        data = json.loads(response.text)
+        data = wikidata_search(search_string.partition(',')[0])
 
         q_ids = [Q["id"] for Q in data["search"]]
 
@@ -52,10 +53,7 @@ def return_state_q_ids(search_string: str):
         str: A string with the q_ids of the state matching the search string, separated by spaces.
     """
 
-    url = f"https://www.wikidata.org/w/api.php?action=wbsearchentities&format=json&language=en&type=item&continue=0&search={search_string}"
-
-    response = requests.get(url)
-    data = json.loads(response.text)
+    data = wikidata_search(search_string)
 
     q_ids = [Q["id"] for Q in data["search"]]
 
@@ -64,6 +62,43 @@ def return_state_q_ids(search_string: str):
     return str_q_ids
 
 
+def _search_q_ids(data: dict):
+    return " ".join(["wd:" + Q["id"] for Q in data["search"]])
+
+
+def return_city_q_ids_batch(search_strings: list):
+    """Searches the q_ids of all cities concurrently, see return_city_q_ids.
+
+    Args:
+        search_strings (list): The strings to search for
+
+    Returns:
+        dict: The q_ids of the cities matching every search string, separated by spaces
+    """
+
+    found = {string: _search_q_ids(data) for string, data in wikidata_search_many(search_strings).items()}
+
+    # The searches with no result are retried with just the city name.
+    fallbacks = {string: string.partition(',')[0] for string, q_ids in found.items() if not q_ids}
+    fallback_data = wikidata_search_many(list(fallbacks.values()))
+    found.update({string: _search_q_ids(fallback_data[city]) for string, city in fallbacks.items()})
+
+    return found
+
+
+def return_state_q_ids_batch(search_strings: list):
+    """Searches the q_ids of all states concurrently, see return_state_q_ids.
+
+    Args:
+        search_strings (list): The strings to search for
+
+    Returns:
+        dict: The q_ids of the states matching every search string, separated by spaces
+    """
+
+    return {string: _search_q_ids(data) for string, data in wikidata_search_many(search_strings).items()}
+
+
 def city_query(q_ids: str, location: str):
     """A query function to find the closest city to a given location within 100 km.
 
@@ -281,58 +316,368 @@ def city_population_query(city_qid: str):
         
         a = wikidata_query(query)
         return int(a['population.value'][0])
+    except CacheMiss:  # In offline mode a missing response must not pass for a city without a population.
+        raise
     except:
         return None
 
 
-def create_locations_csv(read_dir: str, write_dir: str) -> None:
-    """_summary_
+# ## BATCHED QUERIES
+# The functions below resolve many rows with one query, by putting the rows into a VALUES block, and return the results
+# keyed by their input. Per row they give the same result as the functions above.
+
+entity_prefix = "http://www.wikidata.org/entity/"
+
+
+def _first_per_key(results: pd.DataFrame, key: str, columns: list) -> dict:
+    """Returns the values of the columns in the first result of every key, with the q_ids stripped of their prefix."""
+    if results.empty:
+        return dict()
+    results = results.drop_duplicates(subset=[f"{key}.value"])
+    values = [results[f"{column}.value"].str.removeprefix(entity_prefix) for column in columns]
+    return dict(zip(results[f"{key}.value"].str.removeprefix(entity_prefix), zip(*values)))
+
+
+def _q_id_values(q_ids: list):
+    return " ".join("wd:" + qid for qid in q_ids)
+
+
+def settlement_batch_query(q_ids: list):
+    """A query function to find the human settlements among the q_ids, with their coordinates.
 
     Args:
-        read_dir (str): _description_
-        write_dir (str): _description_
+        q_ids (list): The q_ids to check
     """
 
-    biz = pd.read_json(path_or_buf=os.path.join(read_dir, "yelp_academic_dataset_business.json"),
-                       lines=True)
+    query = f"""
+    SELECT DISTINCT ?qid ?qidLabel ?location
+    WHERE {{
+        VALUES ?qid {{{_q_id_values(q_ids)}}}
+        {{?qid wdt:P31/wdt:P279* wd:Q486972.}} # Human Settlement
+        ?qid wdt:P625 ?location .
 
-    biz["city_og"] = biz["city"]
-    biz["state_og"] = biz["state"]
-    biz["city"] = biz["city"].apply(lambda x: x.partition(",")[0])
-    biz["state"] = biz["state"].apply(lambda x: states[x])
+        SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en" }}
+    }}"""
 
-    city_state_keys = biz[["city", "state", "city_og", "state_og"]].drop_duplicates()
+    return query
 
-    df = biz.groupby(["city", "state"])[["latitude", "longitude"]].mean().reset_index()
-    df["location"] = df["longitude"].round(decimals=2).astype(str) + "," + df["latitude"].round(decimals=2).astype(str)
 
-    df["search_string"] = df.apply(lambda x: x[0] + ", " + x[1], axis=1).str.replace(" ", "%20")
+def qid_city_batch(rows: list):
+    """Finds the closest city to the location of every row within 100 km, see qid_city. Fetches the coordinates of all
+    candidate settlements once, and finds the closest ones locally with a spatial index.
 
-    df["city_q_ids"] = df["search_string"].apply(return_city_q_ids)
+    Args:
+        rows (list): Tuples of the q_ids of the cities to search for and the lat-long coordinates to search around
 
-    df["state_q_ids"] = df["state"].apply(return_state_q_ids)
+    Returns:
+        dict: The found q_id and its label per tuple, or None and None.
+    """
 
-    df[["city_qid", "city_label"]] = df.apply(lambda x: qid_city(x["city_q_ids"], x["location"]), result_type='expand',
-                                              axis=1)
+    q_ids = list(dict.fromkeys(qid[3:] for q_ids, _ in rows for qid in q_ids.split()))
+    results = batched_wikidata_query(settlement_batch_query, q_ids)
 
-    df[["state_qid", "state_label"]] = df.apply(qid_state, result_type='expand', axis=1)
+    coordinates, labels = dict(), dict()
+    if not results.empty:
+        for qid, label, location in zip(results["qid.value"].str.removeprefix(entity_prefix), results["qidLabel.value"],
+                                        results["location.value"]):
+            point = point_coordinates(location)
+            if point is not None:
+                coordinates.setdefault(qid, []).append(point)
+                labels[qid] = label
 
-    unique_cities = pd.Series(df["city_qid"].unique())
+    return closest_cities(rows, coordinates, labels)
 
-    county_qids, county_labels = zip(*unique_cities.apply(qid_return_county))
 
-    df = df.merge(pd.DataFrame(data={"city_qid": unique_cities, "county_qid": county_qids, "county_label": county_labels}),
-                  how="left",
-                  on="city_qid")
+def state_batch_query(q_ids: list):
+    """A query function to find the states/provinces of every q_id, see state_query.
 
-    unique_states = pd.Series(df["state_qid"].unique())
-    country_qids, country_labels = zip(*unique_states.apply(qid_return_country))
+    Args:
+        q_ids (list): The q_ids to find states for
+    """
+
+    query = f"""
+    SELECT ?Q ?qid ?qidLabel
+    WHERE {{
+        VALUES ?Q {{{_q_id_values(q_ids)}}}
+        ?Q wdt:P131* ?qid .
+
+        {{?qid wdt:P31/wdt:P279* wd:{q_codes["state"]}.}}
+        UNION
+        {{?qid wdt:P31/wdt:P279* wd:{q_codes["province"]}.}}
+
+        FILTER NOT EXISTS {{
+            ?qid wdt:P31/wdt:P279* wd:{q_codes["country"]}.
+            }}
+
+            SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en" }}
+    }}"""
+
+    return query
+
+
+def qid_state_batch(state_q_ids: list):
+    """Finds the state/province for every string of q_ids, see qid_state.
+
+    Args:
+        state_q_ids (list): Strings of the q_ids found by searching for a state, separated by spaces
+
+    Returns:
+        dict: The first q_id of every string, in search order, that is a state or province, and its label, or None and None.
+    """
+
+    q_ids = list(dict.fromkeys(qid[3:] for string in state_q_ids for qid in string.split()))
+    results = batched_wikidata_query(state_batch_query, q_ids)
+
+    # The states of a q_id are the q_id itself and the regions it lies in, as far as they are states.
+    states_of, labels = dict(), dict()
+    if not results.empty:
+        for q, qid, label in zip(results["Q.value"].str.removeprefix(entity_prefix),
+                                 results["qid.value"].str.removeprefix(entity_prefix), results["qidLabel.value"]):
+            states_of.setdefault(q, set()).add(qid)
+            labels.setdefault(qid, label)
+
+    found = dict()
+    for string in dict.fromkeys(state_q_ids):
+        q_ids_list = [x[3:] for x in string.split(" ")]
+        returned_qids = set().union(*(states_of.get(qid, set()) for qid in q_ids_list))
+        first_common_qid = next((qid for qid in q_ids_list if qid in returned_qids), None)
+        found[string] = (first_common_qid, labels.get(first_common_qid))
+
+    return found
 
-    df = df.merge(pd.DataFrame(data={"state_qid": unique_states, "country_qid": country_qids, "country_label": country_labels}),
-                  how="left",
-                  on="state_qid")
 
-    df["population"] = df["city_qid"].apply(city_population_query)
+def county_batch_query(q_ids: list):
+    """A query function to find the counties of every q_id, see county_query.
+
+    Args:
+        q_ids (list): The q_ids to find counties for
+    """
+
+    query = f"""
+    SELECT ?key ?qid ?qidLabel
+    WHERE{{
+        VALUES ?key {{{_q_id_values(q_ids)}}}
+        ?key wdt:P131* ?qid .
+        ?qid wdt:P31/wdt:P279* wd:{q_codes["county"]}.
+
+        FILTER NOT EXISTS {{
+            ?qid wdt:P31/wdt:P279* wd:{q_codes["state"]}.
+            }}
+        FILTER NOT EXISTS {{
+            ?qid wdt:P31/wdt:P279* wd:{q_codes["country"]}.
+            }}
+        FILTER NOT EXISTS {{
+        ?qid wdt:P31/wdt:P279* wd:Q3301053. # consolidated city-county
+        }}
+
+        SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en" }}
+    }}"""
+
+    return query
+
+
+def country_batch_query(q_ids: list):
+    """A query function to find the countries of every q_id, see country_query.
+
+    Args:
+        q_ids (list): The q_ids to find countries for
+    """
+
+    query = f"""
+    SELECT ?key ?qid ?qidLabel
+    WHERE{{
+        VALUES ?key {{{_q_id_values(q_ids)}}}
+        ?key wdt:P131* ?qid .
+        ?qid wdt:P31/wdt:P279* wd:{q_codes["country"]}.
+        SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en" }}
+    }}"""
+
+    return query
+
+
+def _valid_q_ids(q_ids: list):
+    """The distinct q_ids, without the None and NaN values of rows for which nothing was found."""
+    return list(dict.fromkeys(qid for qid in q_ids if isinstance(qid, str) and qid))
+
+
+def qid_return_county_batch(q_ids: list):
+    """Finds the county of every q_id, see qid_return_county.
+
+    Returns:
+        dict: The q_id of the county and its label per q_id, or None and None.
+    """
+
+    found = _first_per_key(batched_wikidata_query(county_batch_query, _valid_q_ids(q_ids)), "key", ["qid", "qidLabel"])
+    return {qid: found.get(qid, (None, None)) for qid in q_ids}
+
+
+def qid_return_country_batch(q_ids: list):
+    """Finds the country of every q_id, see qid_return_country.
+
+    Returns:
+        dict: The q_id of the country and its label per q_id, or None and None.
+    """
+
+    found = _first_per_key(batched_wikidata_query(country_batch_query, _valid_q_ids(q_ids)), "key", ["qid", "qidLabel"])
+    return {qid: found.get(qid, (None, None)) for qid in q_ids}
+
+
+def city_population_batch_query(city_qids: list):
+    """A query function to find the latest population of every city, see city_population_query.
+
+    Args:
+        city_qids (list): The q_ids of the cities
+    """
+
+    query = f"""
+    SELECT DISTINCT ?city ?population
+    WHERE {{
+        ?city p:P1082 ?statement .
+        VALUES ?city {{{_q_id_values(city_qids)}}}
+        ?statement ps:P1082 ?population .
+        ?statement pq:P585 ?date .
+        FILTER NOT EXISTS {{
+            ?city p:P1082/pq:P585 ?date2 .
+            FILTER(?date2 > ?date) }}
+    }}"""
+
+    return query
+
+
+def city_population_batch(city_qids: list):
+    """Finds the latest population of every city, see city_population_query.
+
+    Returns:
+        dict: The population per q_id, or None.
+    """
+
+    # Like the query of a single city, a city whose query fails gets no population.
+    results = batched_wikidata_query(city_population_batch_query, _valid_q_ids(city_qids), skip_failed=True)
+
+    found = dict()
+    for qid, (population,) in _first_per_key(results, "city", ["population"]).items():
+        try:
+            found[qid] = int(population)
+        except ValueError:
+            found[qid] = None
+
+    return {qid: found.get(qid) for qid in city_qids}
+
+
+# The lookups of create_locations_csv through the Wikidata APIs. A LocationIndex has the same ones.
+live_lookups = SimpleNamespace(return_city_q_ids_batch=return_city_q_ids_batch,
+                               return_state_q_ids_batch=return_state_q_ids_batch,
+                               qid_city_batch=qid_city_batch,
+                               qid_state_batch=qid_state_batch,
+                               qid_return_county_batch=qid_return_county_batch,
+                               qid_return_country_batch=qid_return_country_batch,
+                               city_population_batch=city_population_batch)
+
+
+def city_search_strings(cities: pd.Series, states: pd.Series) -> pd.Series:
+    """The Wikidata search string of every city, "City, State" with the spaces encoded."""
+    return (cities + ", " + states).str.replace(" ", "%20")
+
+
+def locations_checkpoint_path(write_dir: str) -> str:
+    return os.path.join(write_dir, "wikidata_locations.checkpoint.pkl")
+
+
+def create_locations_csv(read_dir: str, write_dir: str, resume: bool = False, location_index: str = None,
+                         remove_checkpoint: bool = True) -> None:
+    """_summary_
+
+    Args:
+        read_dir (str): _description_
+        write_dir (str): _description_
+        resume (bool): Whether to skip the Wikidata lookups finished by an earlier, interrupted, run. The result of every
+            lookup step is checkpointed to write_dir/wikidata_locations.checkpoint.pkl.
+        location_index (str): If given, the locations are resolved with this index, built by build_location_index from a
+            Wikidata dump, instead of with the Wikidata APIs.
+        remove_checkpoint (bool): Whether to remove the checkpoint once all steps are done. create_locations_nt keeps it
+            until the triples are written, so an interrupted write does not repeat the lookups.
+    """
+
+    biz = load_columns("yelp_academic_dataset_business.json", read_dir, ["city", "state", "latitude", "longitude"])
+
+    biz["city_og"] = biz["city"]
+    biz["state_og"] = biz["state"]
+    biz["city"] = biz["city"].apply(lambda x: x.partition(",")[0])
+    biz["state"] = biz["state"].apply(lambda x: states[x.strip().upper()])
+
+    # The spellings of a city, like "Philadelphia" and "philadelphia ", are looked up once, under the most common one.
+    variant_searches = city_search_strings(biz["city"], biz["state"]).nunique()
+    biz["city"] = canonical_cities(biz)
+
+    city_state_keys = biz[["city", "state", "city_og", "state_og"]].drop_duplicates()
+
+    df = biz.groupby(["city", "state"])[["latitude", "longitude"]].mean().reset_index()
+    df["location"] = df["longitude"].round(decimals=2).astype(str) + "," + df["latitude"].round(decimals=2).astype(str)
+
+    df["search_string"] = city_search_strings(df["city"], df["state"])
+    cluster_searches = df["search_string"].nunique()
+    print(f"Merged {variant_searches:,} spellings of city names into {cluster_searches:,} cities, so "
+          f"{variant_searches - cluster_searches:,} fewer cities are searched for and queried")
+
+    # Every step below queries Wikidata, with concurrent searches or batched queries, so the result of each step is
+    # checkpointed.
+    checkpoint = StageCheckpoint(locations_checkpoint_path(write_dir), resume=resume)
+    lookups = LocationIndex(location_index) if location_index else live_lookups
+    if checkpoint.frame is not None:
+        df = checkpoint.frame
+
+    if not checkpoint.done("city_q_ids"):
+        city_q_ids = lookups.return_city_q_ids_batch(df["search_string"].tolist())
+        df["city_q_ids"] = df["search_string"].map(city_q_ids)
+        checkpoint.save("city_q_ids", df)
+
+    if not checkpoint.done("state_q_ids"):
+        state_q_ids = lookups.return_state_q_ids_batch(df["state"].tolist())
+        df["state_q_ids"] = df["state"].map(state_q_ids)
+        checkpoint.save("state_q_ids", df)
+
+    if not checkpoint.done("city_qid"):
+        rows = list(zip(df["city_q_ids"], df["location"]))
+        cities = lookups.qid_city_batch(rows)
+        df[["city_qid", "city_label"]] = pd.DataFrame([cities[row] for row in rows], index=df.index, dtype=object)
+        checkpoint.save("city_qid", df)
+
+    if not checkpoint.done("state_qid"):
+        states_found = lookups.qid_state_batch(df["state_q_ids"].tolist())
+        df[["state_qid", "state_label"]] = pd.DataFrame([states_found[x] for x in df["state_q_ids"]], index=df.index,
+                                                        dtype=object)
+        checkpoint.save("state_qid", df)
+
+    if not checkpoint.done("county_qid"):
+        unique_cities = pd.Series(df["city_qid"].unique())
+
+        counties = lookups.qid_return_county_batch(unique_cities.tolist())
+        county_qids, county_labels = zip(*(counties.get(qid, (None, None)) for qid in unique_cities))
+
+        df = df.merge(pd.DataFrame(data={"city_qid": unique_cities, "county_qid": county_qids, "county_label": county_labels}),
+                      how="left",
+                      on="city_qid")
+        checkpoint.save("county_qid", df)
+
+    if not checkpoint.done("country_qid"):
+        unique_states = pd.Series(df["state_qid"].unique())
+        countries = lookups.qid_return_country_batch(unique_states.tolist())
+        country_qids, country_labels = zip(*(countries.get(qid, (None, None)) for qid in unique_states))
+
+        df = df.merge(pd.DataFrame(data={"state_qid": unique_states, "country_qid": country_qids, "country_label": country_labels}),
+                      how="left",
+                      on="state_qid")
+        checkpoint.save("country_qid", df)
+
+    if not checkpoint.done("population"):
+        populations = lookups.city_population_batch(df["city_qid"].tolist())
+        df["population"] = [populations.get(qid) for qid in df["city_qid"]]
+        checkpoint.save("population", df)
+
+    if remove_checkpoint:
+        checkpoint.remove()
+    if location_index:
+        lookups.close()
 
     df = city_state_keys.merge(df, how="left", on=["city", "state"])
 
@@ -347,112 +692,106 @@ def create_locations_csv(read_dir: str, write_dir: str) -> None:
 
 # ## CREATE NT
 
-def add_to_graph(row, lower_level, higher_level, higher_instance):
-    """_summary_
+# The levels of the location hierarchy from the bottom up, with the class the places of each level are an instance of.
+location_levels = [("city", "Q486972"), ("county", "Q28575"), ("state", "Q7275"), ("country", "Q6256")]
 
-    Args:
-        row (_type_): _description_
-        lower_level (_type_): _description_
-        higher_level (_type_): _description_
-        higher_instance (_type_): _description_
 
-    Returns:
-        _type_: _description_
-    """
+def found(value) -> bool:
+    """Whether a value of the locations table was found, rather than being None, NaN or empty."""
+    return not pd.isna(value) and value != ""
 
-    graph = Graph()
 
-    graph.add(triple=(
-        URIRef(wd + eval(f"row.{lower_level}_qid")),
-        URIRef(location_predicate),
-        URIRef(wd + eval(f"row.{higher_level}_qid"))
-        ))
-    
-    graph.add(triple=(
-        URIRef(wd + eval(f"row.{higher_level}_qid")),
-        RDFS.label,
-        Literal(eval(f"row.{higher_level}_label"), datatype=XSD.string)
-        ))
-    
-    graph.add(triple=(
-        URIRef(wd + eval(f"row.{higher_level}_qid")),
-        URIRef(instance_of_predicate),
-        URIRef(wd + higher_instance)
-        ))
+def location_hierarchy_triples(df: pd.DataFrame, emitter) -> None:
+    """Adds the triples describing the places of the locations table to the emitter, each one once.
 
-    return graph
+    Every row of the table gives a chain of places: its city, or its state if no city was found, followed by the
+    county, state and country above it that were found. Every place in the chain gets its label and type, the city its
+    population, and every place is located in the next one. Many rows share a county, state or country, so the
+    triples already added for an earlier row are skipped.
 
+    Args:
+        df (pd.DataFrame): The locations table returned by create_locations_csv
+        emitter: The emitter to add the triples to, see get_emitter
+    """
 
-def create_locations_nt(read_dir: str, write_dir: str) -> None:
-    """_summary_
+    added = set()
+
+    def add(triple):
+        if triple not in added:
+            added.add(triple)
+            emitter.add(triple)
+
+    label_predicate = emitter.term(RDFS.label)
+    instance_predicate = emitter.term(instance_of_predicate)
+    located_predicate = emitter.term(location_predicate)
+    population_term = emitter.term(population_predicate)
+
+    columns = [f"{level}_{column}" for level, _ in location_levels for column in ("qid", "label")] + ["population"]
+    for row in df[columns].drop_duplicates().to_dict("records"):
+        # The county is found through the city, so without a city the chain starts at the state.
+        levels = location_levels if found(row["city_qid"]) else location_levels[2:]
+        if not found(row[f"{levels[0][0]}_qid"]):
+            continue
+
+        lower = None
+        for level, instance in levels:
+            if not found(row[f"{level}_qid"]):
+                continue
+            place = emitter.uri(wd + row[f"{level}_qid"])
+            add((place, label_predicate, emitter.literal(row[f"{level}_label"], XSD.string)))
+            add((place, instance_predicate, emitter.term(wd + instance)))
+            if level == "city" and found(row["population"]):
+                add((place, population_term, emitter.literal(int(row["population"]), XSD.integer)))
+            if lower is not None:
+                add((lower, located_predicate, place))
+            lower = place
+
+
+def create_locations_nt(read_dir: str, write_dir: str, resume: bool = False, location_index: str = None,
+                        chunk_size: int = 50_000) -> None:
+    """Links the Yelp businesses to the Wikidata places they are located in, and writes the places with their labels,
+    types, populations and containment to write_dir/wikidata_location_mappings.nt.gz.
+
+    The places are written once from the deduplicated locations table, then the business triples are written in chunks
+    of businesses from the cached business columns, each chunk joined to the places and written at once.
 
     Args:
-        read_dir (str): _description_
-        write_dir (str): _description_
+        read_dir (str): The directory with the Yelp business file
+        write_dir (str): The directory to write the triples to
+        resume (bool): Whether to skip the Wikidata lookups finished by an earlier, interrupted, run.
+        location_index (str): If given, the locations are resolved with this index instead of with the Wikidata APIs.
+        chunk_size (int): The number of businesses joined and written at once.
     """
 
-    df = create_locations_csv(read_dir=read_dir, write_dir=write_dir)
-    biz = pd.read_json(path_or_buf=os.path.join(read_dir, "yelp_academic_dataset_business.json"),
-                       lines=True)
-
-    data = biz.merge(df, how="left", on=["city", "state"])
-
-    G = Graph()
-    for row in data.itertuples():
-        if row.city_qid:
-            G.add(triple=(
-                URIRef(yelpent + "business_id/" + row.business_id),
-                URIRef(schema + 'location'),
-                URIRef(wd + row.city_qid)
-                ))
-            
-            G.add(triple=(
-                URIRef(wd + row.city_qid),
-                RDFS.label,
-                Literal(row.city_label, datatype=XSD.string)
-                ))
-            
-            G.add(triple=(
-                URIRef(wd + row.city_qid),
-                URIRef(instance_of_predicate),
-                URIRef(wd + "Q486972")
-                ))
-
-            if row.population:
-                G.add(triple=(
-                    URIRef(wd + row.city_qid),
-                    URIRef(population_predicate),
-                    Literal(row.population, datatype=XSD.integer)
-                    ))
-
-            if row.county_qid:
-                G += add_to_graph(row, "city", "county", "Q28575")
-                if row.state_qid:
-                    G += add_to_graph(row, "county", "state", "Q7275")
-                    if row.country_qid:
-                        G += add_to_graph(row, "state", "country", "Q6256")  # to state
-                elif row.country_qid:
-                    G += add_to_graph(row, "county", "country", "Q6256")  # to county
-            elif row.state_qid:
-                G += add_to_graph(row, "city", "state", "Q7275")  # to city
-                if row.country_qid:
-                    G += add_to_graph(row, "state", "country", "Q6256")  # to state
-            elif row.country_qid:
-                G += add_to_graph(row, "city", "country", "Q6256")  # to city
-        elif row.state_qid:
-            G.add(triple=(
-                URIRef(yelpent + 'business_id/' + row.business_id),
-                URIRef(schema + 'location'),
-                URIRef(wd + row.state_qid)
-                ))
-            G.add(triple=(
-                URIRef(wd + row.state_qid), 
-                RDFS.label,
-                Literal(row.state_label, datatype=XSD.string)
-                ))
-            if row.country_qid:
-                G += add_to_graph(row, "state", "country", "Q6256")  # to state
-
-    with gzip.open(filename=os.path.join(write_dir, "wikidata_location_mappings.nt.gz"),
-                   mode="at") as file:
-        file.write(G.serialize(format="nt"))
+    df = create_locations_csv(read_dir=read_dir, write_dir=write_dir, resume=resume, location_index=location_index,
+                              remove_checkpoint=False)
+
+    metrics = StageMetrics("location_triples").start()
+    emitter = get_emitter()
+    location_hierarchy_triples(df, emitter)
+
+    # A business is located in its city, or in its state if no city was found.
+    places = df[["city", "state"]].assign(place=df["city_qid"].where(df["city_qid"].map(found), df["state_qid"]))
+    places = places[places["place"].map(found)].drop_duplicates(subset=["city", "state"])
+    places["place"] = render_iris(str(wd) + places["place"].astype(str))
+    location_term = emitter.term(schema + "location")
+
+    biz = load_columns("yelp_academic_dataset_business.json", read_dir, ["business_id", "city", "state"])
+
+    # Written to a temporary file first, so an interrupted run never leaves a half-written file behind.
+    linked = 0
+    with open_triple_file(os.path.join(write_dir, "wikidata_location_mappings.tmp.nt.gz"), mode="wt") as file:
+        file.write(emitter.serialize())
+
+        for start in range(0, len(biz), chunk_size):
+            chunk = biz.iloc[start:start + chunk_size].merge(places, how="inner", on=["city", "state"])
+            subjects = render_iris(str(yelpent) + "business_id/" + chunk["business_id"].astype(str))
+            file.write("".join(subjects + f" {location_term} " + chunk["place"] + " .\n"))
+            linked += len(chunk)
+    os.replace(file.path, output_path(os.path.join(write_dir, "wikidata_location_mappings.nt.gz"), file.codec))
+
+    # The lookups are only needed again if the triples were not written.
+    StageCheckpoint(locations_checkpoint_path(write_dir)).remove()
+
+    metrics.records, metrics.triples = len(biz), emitter.triples + linked
+    metrics.finish()
@@ -0,0 +1,320 @@
+import argparse
+import bz2
+import gzip
+import json
+import os
+import re
+import sqlite3
+import time
+
+from urllib.parse import unquote
+
+from Code.KnowledgeGraphEnrichment.location_dicts import q_codes
+from Code.UtilityFunctions.spatial_functions import SpatialIndex, nearest_candidates
+
+# The classes the location enrichment looks for, as bits of the classes column of the index.
+class_bits = {
+    "Q486972": 1,  # human settlement
+    q_codes["county"]: 2,
+    q_codes["state"]: 4,
+    q_codes["province"]: 8,
+    q_codes["country"]: 16,
+    "Q3301053": 32,  # consolidated city-county
+    "Q56061": 64,  # administrative territorial entity, kept so the P131 chains through other areas stay intact
+}
+SETTLEMENT, COUNTY, STATE, PROVINCE, COUNTRY, CITY_COUNTY = 1, 2, 4, 8, 16, 32
+
+# The number of results of a search, like wbsearchentities.
+search_limit = 7
+
+
+def open_dump(dump_path: str):
+    """Opens a Wikidata JSON dump, or a subset of it, compressed with gzip or bzip2 or not at all."""
+    if dump_path.endswith(".gz"):
+        return gzip.open(dump_path, mode="rt", encoding="utf-8")
+    if dump_path.endswith(".bz2"):
+        return bz2.open(dump_path, mode="rt", encoding="utf-8")
+    return open(dump_path, mode="rt", encoding="utf-8")
+
+
+def dump_entities(dump_path: str, marker: str = None):
+    """
+    Streams the entities of a Wikidata JSON dump: a JSON array with one entity per line, or one entity per line without
+    the array, as written by most tools that take a subset of the dump.
+    :param marker: If given, only the lines containing it are parsed, e.g. '"P279"', which skips most of the dump cheaply.
+    """
+    with open_dump(dump_path) as dump:
+        for line in dump:
+            if marker is not None and marker not in line:
+                continue
+            line = line.rstrip().rstrip(",")
+            if line in ("[", "]", ""):
+                continue
+            yield json.loads(line)
+
+
+def truthy_claims(entity: dict, prop: str) -> list:
+    """The statements of a property that wdt: returns: the preferred ones, or else the normal ones."""
+    claims = [claim for claim in entity.get("claims", {}).get(prop, [])
+              if claim["mainsnak"].get("snaktype") == "value" and claim.get("rank") != "deprecated"]
+    preferred = [claim for claim in claims if claim.get("rank") == "preferred"]
+    return preferred or claims
+
+
+def claim_ids(entity: dict, prop: str) -> list:
+    return [claim["mainsnak"]["datavalue"]["value"]["id"] for claim in truthy_claims(entity, prop)]
+
+
+def latest_population(entity: dict):
+    """The population of the statement with the latest point in time (P585), as the population query selects it."""
+    latest, population = None, None
+    for claim in entity.get("claims", {}).get("P1082", []):
+        dates = [qualifier["datavalue"]["value"]["time"] for qualifier in claim.get("qualifiers", {}).get("P585", [])
+                 if qualifier.get("snaktype") == "value"]
+        if claim["mainsnak"].get("snaktype") != "value" or not dates:
+            continue
+        date = max(dates)
+        if latest is None or date > latest:
+            latest, population = date, claim["mainsnak"]["datavalue"]["value"]["amount"].lstrip("+")
+    try:
+        return int(population) if population is not None else None
+    except ValueError:
+        return None
+
+
+def subclass_closure(dump_path: str) -> dict:
+    """
+    First pass over the dump: the subclass (P279) hierarchy below the classes of class_bits.
+    :return: The bits of class_bits per class, for every class that is one of them or a subclass of them.
+    """
+    parents = dict()
+    for entity in dump_entities(dump_path, marker='"P279"'):
+        parents[entity["id"]] = claim_ids(entity, "P279")
+
+    children = dict()
+    for child, child_parents in parents.items():
+        for parent in child_parents:
+            children.setdefault(parent, []).append(child)
+
+    bits = dict()
+    for root, bit in class_bits.items():
+        stack = [root]
+        seen = {root}
+        while stack:
+            cls = stack.pop()
+            bits[cls] = bits.get(cls, 0) | bit
+            for child in children.get(cls, []):
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+    return bits
+
+
+def build_location_index(dump_path: str, index_path: str, max_depth: int = 20) -> dict:
+    """
+    Builds the index of LocationIndex from a Wikidata JSON dump, in two passes over it. It holds the human settlements and
+    administrative areas with their English label and aliases, coordinates (P625), latest population (P1082), classes
+    (P31/P279*) and chains of the areas they are located in (P131*).
+    :param dump_path: The dump, e.g. latest-all.json.gz, or a subset of it with at least the settlements, the
+    administrative areas and the classes.
+    :param index_path: The SQLite file to write the index to. It is replaced.
+    :param max_depth: The maximum length of a P131 chain.
+    :return: The number of entities, names and ancestors in the index.
+    """
+    start = time.perf_counter()
+    bits = subclass_closure(dump_path)
+    print(f"Found {len(bits):,} classes of settlements and administrative areas in {time.perf_counter() - start:.0f} s")
+
+    temporary_path = index_path + ".tmp"
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    connection = sqlite3.connect(temporary_path)
+    connection.executescript("""
+        CREATE TABLE entities (qid INTEGER PRIMARY KEY, label TEXT, latitude REAL, longitude REAL, population INTEGER,
+                               classes INTEGER, sitelinks INTEGER);
+        CREATE TABLE names (name TEXT, qid INTEGER);
+        CREATE TABLE ancestors (qid INTEGER, ancestor INTEGER, depth INTEGER);""")
+
+    located_in = dict()
+    entities = 0
+    for entity in dump_entities(dump_path, marker='"P31"'):
+        classes = 0
+        for cls in claim_ids(entity, "P31"):
+            classes |= bits.get(cls, 0)
+        if not classes:
+            continue
+
+        qid = int(entity["id"][1:])
+        coordinates = truthy_claims(entity, "P625")
+        latitude, longitude = (coordinates[0]["mainsnak"]["datavalue"]["value"]["latitude"],
+                               coordinates[0]["mainsnak"]["datavalue"]["value"]["longitude"]) if coordinates else (None, None)
+        label = entity.get("labels", {}).get("en", {}).get("value")
+        connection.execute("INSERT INTO entities VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (qid, label, latitude, longitude, latest_population(entity), classes,
+                            len(entity.get("sitelinks", {}))))
+
+        names = {label} | {alias["value"] for alias in entity.get("aliases", {}).get("en", [])}
+        connection.executemany("INSERT INTO names VALUES (?, ?)", [(name.casefold(), qid) for name in names if name])
+        located_in[qid] = [int(area[1:]) for area in claim_ids(entity, "P131")]
+        entities += 1
+    print(f"Found {entities:,} settlements and administrative areas in {time.perf_counter() - start:.0f} s")
+
+    # The P131* chains, including the entity itself at depth 0, like wdt:P131* in the queries.
+    ancestors = 0
+    for qid in located_in:
+        depths = {qid: 0}
+        level = [qid]
+        for depth in range(1, max_depth + 1):
+            level = [area for entity in level for area in located_in.get(entity, []) if area not in depths]
+            if not level:
+                break
+            for area in level:
+                depths[area] = depth
+        chain = [(qid, area, depth) for area, depth in depths.items() if area in located_in]
+        connection.executemany("INSERT INTO ancestors VALUES (?, ?, ?)", chain)
+        ancestors += len(chain)
+
+    connection.executescript("""
+        CREATE INDEX names_name ON names (name);
+        CREATE INDEX ancestors_qid ON ancestors (qid, depth);""")
+    names = connection.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+    connection.commit()
+    connection.close()
+    os.replace(temporary_path, index_path)
+
+    print(f"Wrote the location index to {index_path} in {time.perf_counter() - start:.0f} s")
+    return {"entities": entities, "names": names, "ancestors": ancestors}
+
+
+def point_coordinates(wkt: str):
+    """The latitude and longitude of a WKT point on the earth, like the values of P625 in query results, or None."""
+    match = re.fullmatch(r"Point\(([-+.\dEe]+) ([-+.\dEe]+)\)", wkt.strip())
+    return (float(match.group(2)), float(match.group(1))) if match else None
+
+
+def closest_cities(rows: list, coordinates: dict, labels: dict, radius_km: float = 100.0) -> dict:
+    """
+    Finds the closest settlement to the location of every row within the radius, among the q_ids of the row.
+    :param rows: Tuples of the q_ids to choose from, as "wd:Q1 wd:Q2", and the location, as "longitude,latitude".
+    :param coordinates: The coordinates of the settlements among the q_ids, as lists of (latitude, longitude).
+    :param labels: The labels of the settlements.
+    :param radius_km: The radius.
+    :return: The q_id and label of the closest settlement per row, or None and None.
+    """
+    rows = list(dict.fromkeys(rows))
+    locations = [tuple(map(float, location.split(","))) for _, location in rows]
+    closest = nearest_candidates([latitude for _, latitude in locations], [longitude for longitude, _ in locations],
+                                 [[qid[3:] for qid in q_ids.split()] for q_ids, _ in rows], coordinates, radius_km)
+    return {row: (qid, labels[qid]) if qid else (None, None) for row, qid in zip(rows, closest)}
+
+
+class LocationIndex:
+    """
+    Resolves Yelp locations with an index built by build_location_index, without network access. Has the same lookups as
+    location_from_wikidata, returning the same kind of results, so create_locations_csv can use either.
+    Searches match the English label or an alias exactly, ignoring case, and rank the matches by their number of sitelinks.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        self._settlements = None
+
+    def search(self, search_string: str) -> list:
+        """The q_ids whose label or alias is the search string, which may be URL-encoded."""
+        rows = self.connection.execute("""
+            SELECT DISTINCT entities.qid FROM names JOIN entities ON names.qid = entities.qid
+            WHERE names.name = ? ORDER BY entities.sitelinks DESC, entities.qid LIMIT ?""",
+                                       (unquote(search_string).strip().casefold(), search_limit))
+        return [f"Q{qid}" for qid, in rows]
+
+    def entity(self, qid: str):
+        return self.connection.execute("SELECT label, latitude, longitude, population, classes FROM entities WHERE qid = ?",
+                                       (int(qid[1:]),)).fetchone()
+
+    def ancestors(self, qid: str) -> list:
+        """The entity and the areas it is located in, nearest first, with their label and classes."""
+        return [(f"Q{ancestor}", label, classes) for ancestor, label, classes in self.connection.execute("""
+            SELECT ancestors.ancestor, entities.label, entities.classes FROM ancestors
+            JOIN entities ON ancestors.ancestor = entities.qid
+            WHERE ancestors.qid = ? ORDER BY ancestors.depth, ancestors.ancestor""", (int(qid[1:]),))]
+
+    def return_city_q_ids_batch(self, search_strings: list):
+        found = dict()
+        for string in dict.fromkeys(search_strings):
+            q_ids = self.search(string) or self.search(string.partition(',')[0])
+            found[string] = " ".join("wd:" + qid for qid in q_ids)
+        return found
+
+    def return_state_q_ids_batch(self, search_strings: list):
+        return {string: " ".join("wd:" + qid for qid in self.search(string)) for string in dict.fromkeys(search_strings)}
+
+    def qid_city_batch(self, rows: list):
+        coordinates, labels = dict(), dict()
+        for qid in dict.fromkeys(qid[3:] for q_ids, _ in rows for qid in q_ids.split()):
+            entity = self.entity(qid)
+            if entity is not None and entity[4] & SETTLEMENT and entity[1] is not None:
+                coordinates[qid] = [(entity[1], entity[2])]
+                labels[qid] = entity[0]
+        return closest_cities(rows, coordinates, labels)
+
+    def nearest_settlements(self, latitudes, longitudes, radius_km: float = 100.0) -> list:
+        """
+        Finds the nearest settlement of the index within the radius of every point, e.g. of every business by its own
+        coordinates. The spatial index of all settlements is built on the first call.
+        :return: The q_id and label of the nearest settlement per point, or None and None.
+        """
+        if self._settlements is None or self._settlements[0].radius_km != radius_km:
+            rows = self.connection.execute("SELECT qid, label, latitude, longitude FROM entities "
+                                           "WHERE classes & ? AND latitude IS NOT NULL", (SETTLEMENT,)).fetchall()
+            self._settlements = (SpatialIndex([row[2] for row in rows], [row[3] for row in rows], radius_km),
+                                 [(f"Q{row[0]}", row[1]) for row in rows])
+        index, settlements = self._settlements
+        nearest, _ = index.nearest(latitudes, longitudes)
+        return [settlements[number] if number >= 0 else (None, None) for number in nearest]
+
+    def qid_state_batch(self, state_q_ids: list):
+        found = dict()
+        for string in dict.fromkeys(state_q_ids):
+            q_ids_list = [x[3:] for x in string.split(" ")]
+            states = {qid: label for q in q_ids_list if q for qid, label, classes in self.ancestors(q)
+                      if classes & (STATE | PROVINCE) and not classes & COUNTRY}
+            first_common_qid = next((qid for qid in q_ids_list if qid in states), None)
+            found[string] = (first_common_qid, states.get(first_common_qid))
+        return found
+
+    def _first_ancestor(self, q_ids: list, include: int, exclude: int = 0):
+        found = dict()
+        for qid in q_ids:
+            if not isinstance(qid, str) or not qid:
+                found[qid] = (None, None)
+                continue
+            found[qid] = next(((ancestor, label) for ancestor, label, classes in self.ancestors(qid)
+                               if classes & include and not classes & exclude), (None, None))
+        return found
+
+    def qid_return_county_batch(self, q_ids: list):
+        return self._first_ancestor(q_ids, COUNTY, exclude=STATE | COUNTRY | CITY_COUNTY)
+
+    def qid_return_country_batch(self, q_ids: list):
+        return self._first_ancestor(q_ids, COUNTRY)
+
+    def city_population_batch(self, city_qids: list):
+        found = dict()
+        for qid in city_qids:
+            entity = self.entity(qid) if isinstance(qid, str) and qid else None
+            found[qid] = entity[3] if entity else None
+        return found
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds the location index for resolving Yelp locations without network "
+                                                 "access from a Wikidata JSON dump.")
+    parser.add_argument('--dump', type=str, help='The Wikidata JSON dump, or a subset of it, .json, .json.gz or .json.bz2')
+    parser.add_argument('--index', type=str, help='The SQLite file to write the index to')
+    args = parser.parse_args()
+
+    print(build_location_index(args.dump, args.index))
@@ -0,0 +1,67 @@
+import ast
+import json
+
+from functools import lru_cache
+from rdflib import Namespace
+
+yelpvoc = Namespace("https://purl.archive.org/purl/yckg/vocabulary#")
+
+
+def parse_attribute(value: str) -> dict:
+    """
+    Parses a nested Yelp attribute, such as BusinessParking or Ambience. Yelp stores these as the Python representation of
+    a dictionary, e.g. "{'garage': False, 'street': True, 'lot': None}", sometimes with u'...' strings.
+    :param value: The attribute value as found in the business file.
+    :return: The attribute as a dictionary.
+    """
+    try:
+        attribute = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        # Not a Python literal, try the JSON-like rewrite the attributes used to be parsed with.
+        attribute = json.loads(value.replace("'", '"').replace("None", "null").replace('u"', '"').replace("True", "true").replace("False", "false"))
+
+    if not isinstance(attribute, dict):
+        raise ValueError(f"{value} is not a nested attribute.")
+
+    return attribute
+
+
+class AttributeParser:
+    """
+    Turns nested Yelp attributes into the (predicate, object) pairs of their blank node, rendered by an emitter.
+    Only a few hundred distinct values occur among the hundreds of thousands of nested attributes in the business file, so
+    the pairs are kept in an LRU cache keyed on the raw string.
+    """
+
+    def __init__(self, emitter, maxsize: int = 4096):
+        """
+        :param emitter: The emitter the pairs are rendered with, see get_emitter.
+        :param maxsize: The number of distinct attribute values to keep in the cache.
+        """
+        self.emitter = emitter
+        self._cached_pairs = lru_cache(maxsize=maxsize)(self._render_string)
+
+    def pairs(self, value) -> tuple:
+        """
+        :param value: A nested attribute, either as the raw string or as an already parsed dictionary (like hours).
+        :return: A tuple of (predicate, object) pairs, rendered by the emitter.
+        """
+        if isinstance(value, str):
+            return self._cached_pairs(value)
+        return self._render(value)
+
+    def _render_string(self, value: str) -> tuple:
+        return self._render(parse_attribute(value))
+
+    def _render(self, attribute: dict) -> tuple:
+        return tuple((self.emitter.term(yelpvoc + "has" + sub_predicate), self.emitter.literal(sub_object))
+                     for sub_predicate, sub_object in attribute.items())
+
+    def statistics(self) -> dict:
+        """The hits, misses and hit rate of the cache, and the number of values in it."""
+        info = self._cached_pairs.cache_info()
+        lookups = info.hits + info.misses
+        return {"hits": info.hits,
+                "misses": info.misses,
+                "hit_rate": info.hits / lookups if lookups else 0.0,
+                "size": info.currsize}
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+def file_signature(file_path: str) -> dict:
+    """Path, size and modification time of a file, used to check that something derived from it is still up to date."""
+    stat = os.stat(file_path)
+    return {"input_file": os.path.abspath(file_path), "input_size": stat.st_size, "input_mtime": stat.st_mtime}
+
+
+def cache_path(read_dir: str, name: str) -> str:
+    """
+    Returns the path of a file in the cache directory, a folder .yckg_cache in the directory the Yelp files are read from.
+    Everything in it can be deleted safely, it is rebuilt when needed.
+    :param read_dir: The directory the Yelp files are read from.
+    :param name: The name of the cached file.
+    :return: The path of the cached file. The cache directory is created if it does not exist.
+    """
+    directory = os.path.join(read_dir, ".yckg_cache")
+    if not os.path.exists(directory): os.makedirs(directory)
+    return os.path.join(directory, name)
+
+
+def normalize_request(request: str) -> str:
+    """Collapses all whitespace, so requests that only differ in their indentation share a cache entry."""
+    return " ".join(request.split())
+
+
+class ResponseCache:
+    """
+    Persistent cache of the responses of remote services, stored in an SQLite database. Responses are stored as compressed
+    JSON under a hash of the kind of request and the normalized request. Entries older than the TTL are not served, and when
+    the database grows above max_bytes the least recently used entries are evicted. Safe to share between threads.
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600, max_bytes: int = 1024 ** 3):
+        """
+        :param path: The SQLite database file. Created if it does not exist.
+        :param ttl: The number of seconds a response is served from the cache.
+        :param max_bytes: The maximum total size of the stored responses.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                        key TEXT PRIMARY KEY,
+                                        kind TEXT,
+                                        request TEXT,
+                                        response BLOB,
+                                        size INTEGER,
+                                        created REAL,
+                                        accessed REAL)""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._connection.commit()
+        self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(kind: str, request: str) -> str:
+        return hashlib.sha256(f"{kind}\n{normalize_request(request)}".encode("utf-8")).hexdigest()
+
+    def get(self, kind: str, request: str, ignore_ttl: bool = False):
+        """
+        :param kind: The kind of request, e.g. "sparql" or "search".
+        :param request: The request, e.g. a SPARQL query or a URL.
+        :param ignore_ttl: Whether to also serve expired responses, as in offline mode.
+        :return: The cached response, or None if there is none.
+        """
+        key = self.key(kind, request)
+        with self._lock:
+            row = self._connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (not ignore_ttl and time.time() - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, kind: str, request: str, response):
+        """Stores a JSON-serializable response, and evicts the least recently used responses if the cache is full."""
+        key = self.key(kind, request)
+        data = zlib.compress(json.dumps(response).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (key, kind, normalize_request(request), data, len(data), now, now))
+            self._size += len(data) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._connection.commit()
+
+    def _evict(self, target_bytes: int):
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._size <= target_bytes:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def statistics(self) -> dict:
+        """The hits and misses since the cache was opened, and the number and total size of the stored responses."""
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": self._size}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,12 +1,68 @@
+import json
 import os
 import pandas as pd
 import numpy as np
 
+from collections import Counter
+
 from Code.UtilityFunctions.string_functions import turn_words_singular, space_words_lower
-from sentence_transformers import SentenceTransformer
+from Code.UtilityFunctions.cache_functions import cache_path, file_signature
+from Code.UtilityFunctions.embedding_functions import EmbeddingStore, default_model, top_k_similar
 
 pd.options.mode.chained_assignment = None
 
+_categories_key = b'"categories":'
+_json_decoder = json.JSONDecoder()
+
+
+def line_categories(line: bytes):
+    """Reads the categories of one line of the business file, decoding only that value when the key is found as is."""
+
+    start = line.find(_categories_key)
+    if start < 0 or line[start - 1:start] == b"\\":
+        return json.loads(line).get("categories")
+    value, _ = _json_decoder.raw_decode(line[start + len(_categories_key):].decode("utf-8").lstrip())
+    return value
+
+
+def count_yelp_categories(read_dir: str) -> Counter:
+    """Counts how many businesses have every Yelp category, scanning the business file line by line. The counts are saved
+    to the cache directory and only counted again when the business file changes.
+
+    Args:
+        read_dir (str): the path to read the data from
+
+    Returns:
+        Counter: The number of businesses of every category, most common first
+    """
+
+    file_path = os.path.join(read_dir, "yelp_academic_dataset_business.json")
+    vocabulary_path = cache_path(read_dir, "category_vocabulary.json")
+    signature = file_signature(file_path)
+
+    if os.path.isfile(vocabulary_path):
+        with open(vocabulary_path, mode="rt") as file:
+            saved = json.load(file)
+        if saved["signature"] == signature:
+            return Counter(saved["categories"])
+
+    counts = Counter()
+    with open(file_path, mode="rb") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            categories = line_categories(line)
+            if categories is not None:
+                counts.update(categories.split(', '))
+    counts = Counter(dict(counts.most_common()))
+
+    with open(vocabulary_path + ".tmp", mode="wt") as file:
+        json.dump({"signature": signature, "categories": counts}, file, indent=1)
+    os.replace(vocabulary_path + ".tmp", vocabulary_path)
+
+    return counts
+
+
 def clean_yelp_categories(read_dir: str):
     """
     Args:
@@ -17,9 +73,7 @@ def clean_yelp_categories(read_dir: str):
         dict: A dictionary with the original categories as keys and the singularized, and split, categories as values
     """
 
-    biz = pd.read_json(path_or_buf=os.path.join(read_dir, "yelp_academic_dataset_business.json"), lines=True)
-
-    categories_unique = list(set(biz["categories"].str.cat(sep=', ').split(sep=', ')))
+    categories_unique = list(count_yelp_categories(read_dir))
     categories_dict = {categories_unique[i]: [categories_unique[i]] for i in range(len(categories_unique))}
 
     cat_string_manually_handled_df = pd.read_csv(filepath_or_buffer=os.path.join(read_dir, "manually_split_categories.csv"), delimiter=";", header=0)
@@ -62,43 +116,74 @@ def cos_sim_2d(x, y):
     return np.matmul(norm_x, norm_y.T)
 
 
-def category_mappings(threshold: float, read_dir: str):
-    """Cleans the categories from Yelp and the Schema types. Then calculates the cosine similarity between the two, '
-    and finds mappings above a threshold.
+def category_similarities(read_dir: str, k: int = 1, model_name: str = default_model) -> pd.DataFrame:
+    """Cleans the categories from Yelp and the Schema types. Then finds the k Schema types with the highest cosine
+    similarity to every Yelp category. The embeddings are kept in the embedding store in the cache directory, so only new
+    categories and types are encoded.
 
     Args:
-        threshold (float): The threshold for the cosine similarity
         read_dir (str): the path to read the data from
+        k (int): The number of Schema types per Yelp category
+        model_name (str): The SentenceTransformer model to embed the categories and types with
 
     Returns:
-        dict: A dictionary containing the Yelp category as key and the mapped Schema types as values.
+        pd.DataFrame: The columns yelp_category, mapped_schema, similarity and rank, with the k rows of every cleaned Yelp
+        category, sorted by similarity
     """
 
-    model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-
     yelp_categories, yelp_categories_dict = clean_yelp_categories(read_dir)
     schema_categories, schema_categories_dict = clean_schema_categories(read_dir)
 
     swapped_yelp_categories = {sub_value: key for key, value in yelp_categories_dict.items() for sub_value in value}
 
-    yelp_embeddings = model.encode(yelp_categories)
-    schema_embeddings = model.encode(schema_categories)
-
-    co_sim_matrix = pd.DataFrame(data=cos_sim_2d(yelp_embeddings, schema_embeddings),
-                                 index=yelp_categories,
-                                 columns=schema_categories
-                                 ).apply(pd.to_numeric)
+    store = EmbeddingStore(cache_path(read_dir, "embeddings.sqlite"), model_name)
+    yelp_embeddings = store.encode(yelp_categories)
+    schema_embeddings = store.encode(schema_categories)
+    store.close()
 
-    mappings = pd.DataFrame(data={"mapped_schema": co_sim_matrix.idxmax(axis=1), "similarity": co_sim_matrix.max(axis=1)}, index=co_sim_matrix.index).sort_values(by="similarity", ascending=False).reset_index(names="yelp_category")
+    indices, scores = top_k_similar(yelp_embeddings, schema_embeddings, k)
 
     # Getting correct names
-    mappings["mapped_schema"] = mappings["mapped_schema"].apply(lambda x: schema_categories_dict.get(x))
-    mappings["yelp_category"] = mappings["yelp_category"].apply(lambda x: swapped_yelp_categories.get(x))
+    schema_names = np.array([schema_categories_dict.get(category) for category in schema_categories], dtype=object)
+    yelp_names = np.array([swapped_yelp_categories.get(category) for category in yelp_categories], dtype=object)
+
+    similarities = pd.DataFrame(data={"yelp_category": np.repeat(yelp_names, indices.shape[1]),
+                                      "mapped_schema": schema_names[indices.ravel()],
+                                      "similarity": scores.ravel(),
+                                      "rank": np.tile(np.arange(indices.shape[1]), len(yelp_names))})
+
+    return similarities.sort_values(by="similarity", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def mappings_above_threshold(similarities: pd.DataFrame, threshold: float) -> dict:
+    """Finds the mappings above a threshold in the result of category_similarities. Cheap, so thresholds can be compared
+    without computing the similarities again.
+
+    Args:
+        similarities (pd.DataFrame): The result of category_similarities
+        threshold (float): The threshold for the cosine similarity
+
+    Returns:
+        dict: A dictionary containing the Yelp category as key and the mapped Schema types as values.
+    """
+
+    mappings = similarities[similarities['similarity'] >= threshold]
+    mappings = mappings[mappings['mapped_schema'].notna() & (mappings['mapped_schema'] != "None")]
+
+    return mappings.groupby('yelp_category', sort=True)['mapped_schema'].agg(list).to_dict()
 
-    mappings = mappings[mappings['similarity'] >= threshold]
-    mappings['mapped_schema'][mappings['mapped_schema'] == "None"] = None
 
-    mapping_dictionary = mappings[["yelp_category", "mapped_schema"]].set_index('yelp_category').stack().groupby(level=0).agg(list).to_dict()
+def category_mappings(threshold: float, read_dir: str, k: int = 1):
+    """Cleans the categories from Yelp and the Schema types. Then calculates the cosine similarity between the two, '
+    and finds mappings above a threshold.
+
+    Args:
+        threshold (float): The threshold for the cosine similarity
+        read_dir (str): the path to read the data from
+        k (int): The number of best Schema types per cleaned Yelp category to consider
 
-    return mapping_dictionary
+    Returns:
+        dict: A dictionary containing the Yelp category as key and the mapped Schema types as values.
+    """
 
+    return mappings_above_threshold(category_similarities(read_dir, k=k), threshold)
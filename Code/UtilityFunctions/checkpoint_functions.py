@@ -0,0 +1,135 @@
+import json
+import os
+
+import pandas as pd
+
+from Code.UtilityFunctions.cache_functions import file_signature
+
+
+def checkpoint_path(output_file: str) -> str:
+    return output_file + ".checkpoint.json"
+
+
+class ConversionCheckpoint:
+    """
+    Periodically records how far the conversion of a JSON-lines file has come: the byte offset of the next line to read, the
+    number of records done, and the size of the output file at that point. The output file is flushed to a gzip member (or
+    frame) boundary before every checkpoint, so on resume the output is truncated to that size and the conversion continues
+    at the recorded input offset, without duplicating or losing any triples.
+    When the conversion is done a final checkpoint marks it as complete, so a resumed run can skip it altogether.
+    """
+
+    def __init__(self, output_file: str, input_file: str, resume: bool = False, every: int = 100_000):
+        """
+        :param output_file: The path of the triple file written by the conversion, as returned by output_path.
+        :param input_file: The JSON-lines file being converted.
+        :param resume: Whether to continue from an existing checkpoint. If False, any existing checkpoint is discarded.
+        :param every: The number of records between two checkpoints.
+        """
+        self.output_file = output_file
+        self.path = checkpoint_path(output_file)
+        self.every = every
+        self.signature = file_signature(input_file)  # Checks that the checkpoint belongs to the same input.
+        self.state = None
+
+        if os.path.isfile(self.path):
+            with open(self.path, mode="rt") as file:
+                state = json.load(file)
+
+            if not resume:
+                if not state.get("complete"):
+                    print(f"Ignoring checkpoint {self.path}, use --resume to continue from it.")
+            elif {key: state.get(key) for key in self.signature} != self.signature:
+                print(f"Ignoring checkpoint {self.path}, as the input file has changed since it was written.")
+            else:
+                self.state = state
+
+    @property
+    def resumed(self) -> bool:
+        return self.state is not None
+
+    @property
+    def input_offset(self) -> int:
+        return self.state["input_offset"] if self.resumed else None
+
+    @property
+    def complete(self) -> bool:
+        return self.resumed and self.state.get("complete", False)
+
+    @property
+    def records(self) -> int:
+        return self.state["records"] if self.resumed else 0
+
+    @property
+    def extra(self) -> dict:
+        """Any state stored by the conversion itself, e.g. the categories already typed."""
+        return self.state["extra"] if self.resumed else {}
+
+    def prepare_output(self):
+        """Truncates the output file to the size recorded in the checkpoint, dropping anything written after it."""
+        if self.resumed and os.path.isfile(self.output_file):
+            os.truncate(self.output_file, self.state["output_bytes"])
+
+    def due(self, records: int) -> bool:
+        """Whether a checkpoint should be saved after this many records."""
+        return records % self.every == 0
+
+    def save(self, triple_file, input_offset: int, records: int, extra: dict = None, complete: bool = False):
+        """
+        :param triple_file: The TripleSink the conversion writes to.
+        :param input_offset: The byte offset of the next line of the input file.
+        :param records: The number of records done, including the ones done before resuming.
+        :param extra: JSON-serializable state the conversion needs to resume.
+        :param complete: Whether the conversion is done.
+        """
+        state = {**self.signature,
+                 "input_offset": input_offset,
+                 "records": records,
+                 "output_bytes": triple_file.sync(),
+                 "extra": extra or {},
+                 "complete": complete}
+
+        # Written to a temporary file first, so a crash while writing never leaves a broken checkpoint behind.
+        with open(self.path + ".tmp", mode="wt") as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self.state = state
+
+    def remove(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+class StageCheckpoint:
+    """
+    Checkpoint for stages made of a few expensive steps on a DataFrame, like the Wikidata location stage. After every step
+    the DataFrame is pickled together with the name of the step, and on resume the finished steps are skipped.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        """
+        :param path: The pickle file to store the checkpoint in.
+        :param resume: Whether to continue from an existing checkpoint.
+        """
+        self.path = path
+        self.steps = []
+        self.frame = None
+
+        if resume and os.path.isfile(path):
+            checkpoint = pd.read_pickle(path)
+            self.steps, self.frame = checkpoint["steps"], checkpoint["frame"]
+
+    def done(self, step: str) -> bool:
+        return step in self.steps
+
+    def save(self, step: str, frame: pd.DataFrame):
+        self.steps.append(step)
+        self.frame = frame
+        pd.to_pickle({"steps": self.steps, "frame": frame}, self.path + ".tmp")
+        os.replace(self.path + ".tmp", self.path)
+
+    def remove(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,307 @@
+import argparse
+import itertools
+import json
+import math
+import mmap
+import os
+import shutil
+
+from array import array
+
+import numpy as np
+import pandas as pd
+
+from Code.UtilityFunctions.cache_functions import cache_path, file_signature
+from Code.UtilityFunctions.metrics_functions import Progress
+
+yelp_files = ["yelp_academic_dataset_business.json",
+              "yelp_academic_dataset_user.json",
+              "yelp_academic_dataset_review.json",
+              "yelp_academic_dataset_checkin.json",
+              "yelp_academic_dataset_tip.json"]
+
+# The kinds of column, from the narrowest to the widest. A column takes the narrowest kind that holds all its values:
+# numbers are stored as NumPy arrays, everything else as UTF-8 text in a heap file with the offsets of every value.
+numeric_kinds = {"bool": ("b", np.bool_), "int": ("q", np.int64), "float": ("d", np.float64)}
+text_kinds = ("string", "json")
+
+cache_version = 1
+
+
+def value_kind(value) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int" if -2 ** 63 <= value < 2 ** 63 else "string"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, str):
+        return "string"
+    return "json"  # Nested objects and lists, like the attributes and hours of a business.
+
+
+def wider_kind(kind: str, other: str) -> str:
+    if kind is None or kind == other:
+        return other
+    if {kind, other} == {"int", "float"}:
+        return "float"
+    if "json" in (kind, other):
+        return "json"
+    return "string"  # Booleans mixed with numbers, or numbers mixed with strings.
+
+
+def value_text(value, kind: str) -> str:
+    """The text a value is stored as in a column of strings or of JSON."""
+    if kind == "string" and isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+class ColumnWriter:
+    """
+    Collects the values of one key of a JSON lines file, row by row. Rows without the key, or with null, are null. The
+    numbers are kept in memory, the text is appended to the heap file as it comes in.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The path of the column files, without their extensions.
+        """
+        self.path = path
+        self.kind = None  # None as long as all values are null.
+        self.rows = 0
+        self.nulls = bytearray()
+        self.values = None  # The numbers, for the numeric kinds.
+        self.offsets = None  # The offset of every value in the heap, and the end of the heap, for the text kinds.
+        self.heap = None
+
+    def append(self, row: int, value):
+        if row > self.rows:
+            self.pad(row)
+        if value is None:
+            self.pad(row + 1)
+            return
+
+        kind = value_kind(value)
+        if kind != self.kind:
+            self.widen(wider_kind(self.kind, kind))
+        if self.kind in numeric_kinds:
+            self.values.append(value)
+        else:
+            self._write(value_text(value, self.kind))
+        self.nulls.append(0)
+        self.rows += 1
+
+    def pad(self, rows: int):
+        """Appends nulls up to the given number of rows."""
+        missing = rows - self.rows
+        if missing <= 0:
+            return
+        self.nulls.extend(b"\x01" * missing)
+        if self.kind in numeric_kinds:
+            self.values.extend([math.nan if self.kind == "float" else 0] * missing)
+        elif self.kind in text_kinds:
+            self.offsets.extend([self.offsets[-1]] * missing)
+        self.rows = rows
+
+    def widen(self, kind: str):
+        """Converts the values collected so far to a wider kind."""
+        if kind == self.kind:
+            return
+        nulls = [bool(null) for null in self.nulls]
+
+        if kind in numeric_kinds:
+            code = numeric_kinds[kind][0]
+            if self.values is None:
+                self.values = array(code, [math.nan if kind == "float" else 0] * self.rows)
+            else:  # From integers to floats.
+                self.values = array(code, [math.nan if null else value for value, null in zip(self.values, nulls)])
+        elif self.kind in numeric_kinds:
+            values = [None if null else (bool(value) if self.kind == "bool" else value)
+                      for value, null in zip(self.values, nulls)]
+            self.values = None
+            self._rewrite(values, kind)
+        elif self.kind in text_kinds:  # From strings to JSON, every string is read back and encoded.
+            self._rewrite(self._read_back(nulls), kind)
+        else:
+            self._rewrite([None] * self.rows, kind)
+        self.kind = kind
+
+    def _rewrite(self, values: list, kind: str):
+        if self.heap is not None:
+            self.heap.close()
+        self.heap = open(self.path + ".heap", mode="wb")
+        self.offsets = array("q", [0])
+        for value in values:
+            if value is None:
+                self.offsets.append(self.offsets[-1])
+            else:
+                self._write(value_text(value, kind))
+
+    def _read_back(self, nulls: list) -> list:
+        self.heap.flush()
+        with open(self.path + ".heap", mode="rb") as file:
+            heap = file.read()
+        return [None if null else heap[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+                for row, null in enumerate(nulls)]
+
+    def _write(self, text: str):
+        data = text.encode("utf-8")
+        self.heap.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def finish(self, rows: int) -> dict:
+        """
+        Pads the column to the number of rows of the file and saves it.
+        :return: The description of the column stored in the metadata of the cache.
+        """
+        self.pad(rows)
+        if self.kind in numeric_kinds:
+            code, dtype = numeric_kinds[self.kind]
+            np.save(self.path + ".npy", np.frombuffer(self.values, dtype=np.int8 if code == "b" else dtype).astype(dtype))
+        elif self.kind in text_kinds:
+            self.heap.close()
+            np.save(self.path + ".offsets.npy", np.frombuffer(self.offsets, dtype=np.int64))
+
+        has_nulls = any(self.nulls)
+        if has_nulls:
+            np.save(self.path + ".nulls.npy", np.frombuffer(bytes(self.nulls), dtype=np.bool_))
+        return {"file": os.path.basename(self.path), "kind": self.kind or "null", "nulls": has_nulls}
+
+
+def columns_directory(file_name: str, read_dir: str) -> str:
+    return cache_path(read_dir, file_name.replace(".json", ".columns"))
+
+
+def cached_columns(file_name: str, read_dir: str):
+    """
+    :return: The metadata of the columnar cache of a Yelp JSON file, or None if there is none or the file changed since.
+    """
+    meta_path = os.path.join(columns_directory(file_name, read_dir), "meta.json")
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path, mode="rt") as file:
+        meta = json.load(file)
+    if meta["version"] != cache_version or meta["signature"] != file_signature(os.path.join(read_dir, file_name)):
+        return None
+    return meta
+
+
+def ingest_json_file(file_name: str, read_dir: str, force: bool = False) -> dict:
+    """
+    Converts a Yelp JSON file into a columnar cache in the cache directory, one set of files per top-level key: a NumPy
+    array for keys whose values are all booleans, all integers or all numbers, and otherwise a UTF-8 heap with the offset
+    of every value. Nested objects and lists are stored as JSON text. The cache is keyed on the size and modification
+    time of the file, and only built again when those change.
+    :param file_name: The Yelp JSON file.
+    :param read_dir: The directory the Yelp files are read from, which holds the cache directory.
+    :param force: Whether to build the cache even if it is up to date.
+    :return: The metadata of the cache: the signature of the file, the number of rows and the columns.
+    """
+    meta = None if force else cached_columns(file_name, read_dir)
+    if meta is not None:
+        return meta
+
+    file_path = os.path.join(read_dir, file_name)
+    directory = columns_directory(file_name, read_dir)
+    # Built next to the cache and moved in place at the end, so an interrupted ingest never leaves a half-written cache.
+    building = directory + ".tmp"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    signature = file_signature(file_path)
+    progress = Progress(f"ingest {file_name}", 0, signature["input_size"])
+    writers = dict()
+    rows = offset = 0
+    with open(file_path, mode="rb") as file:
+        for line in file:
+            offset += len(line)
+            if not line.strip():
+                continue
+            for key, value in json.loads(line).items():
+                writer = writers.get(key)
+                if writer is None:
+                    writer = writers[key] = ColumnWriter(os.path.join(building, f"{len(writers):03d}"))
+                writer.append(rows, value)
+            rows += 1
+            if rows % 10000 == 0:
+                progress.update(offset, rows)
+
+    meta = {"version": cache_version,
+            "signature": signature,
+            "rows": rows,
+            "columns": {key: writer.finish(rows) for key, writer in writers.items()}}
+    with open(os.path.join(building, "meta.json"), mode="wt") as file:
+        json.dump(meta, file, indent=1)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(building, directory)
+    return meta
+
+
+def read_column(directory: str, column: dict, rows: int):
+    """
+    Reads one column of a columnar cache. Numeric columns without nulls are memory-mapped rather than read. Integers with
+    nulls become floats with NaN, like pd.read_json gives them.
+    """
+    path = os.path.join(directory, column["file"])
+    kind = column["kind"]
+    nulls = np.load(path + ".nulls.npy", mmap_mode="r") if column["nulls"] else None
+
+    if kind == "null":
+        return np.full(rows, None, dtype=object)
+
+    if kind in numeric_kinds:
+        values = np.load(path + ".npy", mmap_mode="r")
+        if nulls is None or kind == "float":  # Floats hold NaN at their nulls already.
+            return values
+        if kind == "int":
+            values = values.astype(np.float64)
+            values[nulls] = np.nan
+            return values
+        values = values.astype(object)
+        values[nulls] = None
+        return values
+
+    offsets = np.load(path + ".offsets.npy").tolist()
+    null_rows = nulls.tolist() if nulls is not None else itertools.repeat(False)
+    decode = json.loads if kind == "json" else bytes.decode
+    with open(path + ".heap", mode="rb") as file:
+        heap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] else b""  # An empty file cannot be mapped.
+        values = [None if null else decode(heap[start:end]) for start, end, null in zip(offsets, offsets[1:], null_rows)]
+        if offsets[-1]:
+            heap.close()
+    return values
+
+
+def load_columns(file_name: str, read_dir: str, columns: list = None) -> pd.DataFrame:
+    """
+    Loads columns of a Yelp JSON file from its columnar cache, which is built first if it is missing or out of date. Only
+    the requested columns are read.
+    :param file_name: The Yelp JSON file.
+    :param read_dir: The directory the Yelp files are read from.
+    :param columns: The top-level keys to load. All of them if None.
+    :return: A DataFrame with one row per object in the file, in the order of the file.
+    """
+    meta = ingest_json_file(file_name, read_dir)
+    directory = columns_directory(file_name, read_dir)
+    columns = list(meta["columns"]) if columns is None else columns
+
+    missing = [column for column in columns if column not in meta["columns"]]
+    if missing:
+        raise KeyError(f"{file_name} has no key {', '.join(missing)}")
+
+    return pd.DataFrame({column: read_column(directory, meta["columns"][column], meta["rows"]) for column in columns},
+                        index=pd.RangeIndex(meta["rows"]), copy=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds the columnar cache of the Yelp JSON files.")
+    parser.add_argument('--read_dir', type=str, help='The directory with the Yelp JSON files')
+    parser.add_argument('--force', type=bool, help='Whether to rebuild caches that are up to date')
+    args = parser.parse_args()
+
+    for yelp_file in yelp_files:
+        if os.path.isfile(os.path.join(args.read_dir, yelp_file)):
+            ingest_json_file(yelp_file, args.read_dir, force=args.force)
+            print(f"Ingested {yelp_file}")
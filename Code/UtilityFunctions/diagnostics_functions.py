@@ -0,0 +1,153 @@
+import gzip
+import json
+import os
+import time
+
+from collections import Counter
+
+# The folder the diagnostics of the converters are written to.
+errors_dir = os.path.join("Code", "Errors")
+
+
+class _GzipLines:
+    """
+    Buffered, append-only gzip text file. Every flush writes one complete gzip member, so the file can be truncated to the
+    size returned by sync() and appended to again.
+    """
+
+    def __init__(self, path: str, mode: str = "wt", buffer_size: int = 1024 * 1024, size: int = None):
+        """
+        :param path: The file to write to.
+        :param mode: "at" to append to the file, "wt" to overwrite it.
+        :param buffer_size: The number of characters buffered before they are compressed and written.
+        :param size: If given, the file is truncated to this size before appending to it.
+        """
+        if size is not None and os.path.isfile(path):
+            os.truncate(path, size)
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+        self._raw = open(path, mode="ab" if mode.startswith("a") else "wb")
+
+    def write(self, text: str):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._raw.write(gzip.compress("".join(self._buffer).encode("utf-8"), compresslevel=6, mtime=0))
+            self._buffer = []
+            self._buffered = 0
+        self._raw.flush()
+
+    def sync(self) -> int:
+        self.flush()
+        os.fsync(self._raw.fileno())
+        return self._raw.tell()
+
+    def close(self):
+        self.flush()
+        self._raw.close()
+
+
+class DiagnosticsSink:
+    """
+    Collects what a converter could not turn into triples, without holding it in memory:
+        - none_list_<name>.txt.gz, the values skipped because they are empty or None.
+        - error_list_<name>.txt.gz, the values of a type the converter does not handle.
+        - <name>.summary.json, written by close(), with the counts of both per predicate, the counts of the exceptions
+          per type and a sample of the exceptions.
+    Exceptions are printed at most once per print_interval seconds, so a malformed file does not flood the output.
+    """
+
+    def __init__(self, name: str, mode: str = "wt", state: dict = None, directory: str = errors_dir,
+                 max_samples: int = 20, print_interval: float = 1.0):
+        """
+        :param name: The name of the converted file, e.g. "business" or "business_part001".
+        :param mode: "at" to append to the files of an earlier run, "wt" to overwrite them.
+        :param state: The state returned by state(), as stored in a checkpoint. The files are truncated to it and the
+        counts continue from it.
+        :param directory: The folder to write the files to.
+        :param max_samples: The number of exceptions kept in the summary.
+        :param print_interval: The minimum number of seconds between two printed exceptions.
+        """
+        if not os.path.exists(directory): os.makedirs(directory)
+        state = state or {}
+
+        self.name = name
+        self.summary_path = os.path.join(directory, f"{name}.summary.json")
+        self.max_samples = max_samples
+        self.print_interval = print_interval
+
+        self.none_values = Counter(state.get("none_values", {}))
+        self.unhandled_values = Counter(state.get("unhandled_values", {}))
+        self.exceptions = Counter(state.get("exceptions", {}))
+        self.samples = state.get("samples", [])
+
+        self._none_file = _GzipLines(os.path.join(directory, f"none_list_{name}.txt.gz"), mode, size=state.get("none_bytes"))
+        self._error_file = _GzipLines(os.path.join(directory, f"error_list_{name}.txt.gz"), mode, size=state.get("error_bytes"))
+        self._last_print = 0.0
+        self._suppressed = 0
+
+    def none_value(self, subject: str, predicate: str, obj):
+        """Records a value that was skipped because it is empty or None."""
+        self.none_values[predicate] += 1
+        self._none_file.write(f"{(subject, predicate, obj)!r}\n")
+
+    def unhandled_value(self, subject: str, predicate: str, obj):
+        """Records a value of a type the converter does not handle."""
+        self.unhandled_values[predicate] += 1
+        self._error_file.write(f"{(subject, predicate, obj)!r}\n")
+
+    def exception(self, error: Exception, record=None):
+        """
+        Records an exception that made the converter skip a record.
+        :param error: The exception.
+        :param record: The record, or the part of it, that failed. Only kept in the sample, shortened to 1000 characters.
+        """
+        error_type = type(error).__name__
+        self.exceptions[error_type] += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append({"type": error_type, "message": str(error), "record": repr(record)[:1000]})
+
+        now = time.monotonic()
+        if now - self._last_print >= self.print_interval:
+            suppressed = f" ({self._suppressed} more since the last one)" if self._suppressed else ""
+            print(f"{self.name}: {error_type}: {error}{suppressed}")
+            self._last_print = now
+            self._suppressed = 0
+        else:
+            self._suppressed += 1
+
+    def state(self) -> dict:
+        """Forces the files to disk and returns their sizes and the counts, to be stored in a checkpoint."""
+        return {"none_bytes": self._none_file.sync(),
+                "error_bytes": self._error_file.sync(),
+                "none_values": dict(self.none_values),
+                "unhandled_values": dict(self.unhandled_values),
+                "exceptions": dict(self.exceptions),
+                "samples": self.samples}
+
+    def summary(self) -> dict:
+        return {"name": self.name,
+                "none_values": sum(self.none_values.values()),
+                "unhandled_values": sum(self.unhandled_values.values()),
+                "exceptions": sum(self.exceptions.values()),
+                "none_values_per_predicate": dict(self.none_values.most_common()),
+                "unhandled_values_per_predicate": dict(self.unhandled_values.most_common()),
+                "exceptions_per_type": dict(self.exceptions.most_common()),
+                "exception_samples": self.samples}
+
+    def close(self) -> dict:
+        """
+        Closes the files and writes the summary JSON.
+        :return: The summary.
+        """
+        self._none_file.close()
+        self._error_file.close()
+        summary = self.summary()
+        with open(self.summary_path, mode="wt") as file:
+            json.dump(summary, file, indent=2)
+        return summary
@@ -0,0 +1,123 @@
+import sqlite3
+
+import numpy as np
+
+from sentence_transformers import SentenceTransformer
+
+default_model = "sentence-transformers/all-MiniLM-L6-v2"
+
+# The models loaded in this process, by name, as loading one takes seconds.
+_models = dict()
+
+
+def load_model(model_name: str) -> SentenceTransformer:
+    if model_name not in _models:
+        _models[model_name] = SentenceTransformer(model_name)
+    return _models[model_name]
+
+
+def normalize_text(text: str) -> str:
+    """Collapses all whitespace, so texts that only differ in their spacing share an embedding."""
+    return " ".join(text.split())
+
+
+class EmbeddingStore:
+    """
+    Persistent store of sentence embeddings in an SQLite database, keyed on the name of the model and the normalized text.
+    Only the texts that are not in the store yet are encoded, and the model is only loaded when there are any.
+    """
+
+    def __init__(self, path: str, model_name: str = default_model):
+        """
+        :param path: The SQLite database file. Created if it does not exist.
+        :param model_name: The name of the SentenceTransformer model.
+        """
+        self.path = path
+        self.model_name = model_name
+        self.hits = 0
+        self.encoded = 0
+
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                                        model TEXT,
+                                        text TEXT,
+                                        vector BLOB,
+                                        PRIMARY KEY (model, text))""")
+        self._connection.commit()
+
+    def _stored(self, texts: list) -> dict:
+        stored = dict()
+        for start in range(0, len(texts), 500):  # SQLite limits the number of parameters of a query.
+            batch = texts[start:start + 500]
+            rows = self._connection.execute(f"SELECT text, vector FROM embeddings WHERE model = ? AND text IN "
+                                            f"({', '.join('?' * len(batch))})", [self.model_name, *batch])
+            stored.update((text, np.frombuffer(vector, dtype=np.float32)) for text, vector in rows)
+        return stored
+
+    def encode(self, texts: list) -> np.ndarray:
+        """
+        :param texts: The texts to embed.
+        :return: The embeddings of the texts, one float32 row per text.
+        """
+        keys = [normalize_text(text) for text in texts]
+        unique = list(dict.fromkeys(keys))
+        embeddings = self._stored(unique)
+        self.hits += len(embeddings)
+
+        missing = [text for text in unique if text not in embeddings]
+        if missing:
+            vectors = np.asarray(load_model(self.model_name).encode(missing), dtype=np.float32)
+            self._connection.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                                         [(self.model_name, text, vector.tobytes()) for text, vector in zip(missing, vectors)])
+            self._connection.commit()
+            embeddings.update(zip(missing, vectors))
+            self.encoded += len(missing)
+
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([embeddings[key] for key in keys])
+
+    def close(self):
+        self._connection.close()
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """The rows of a matrix scaled to unit length, as float32. Rows of zeros stay zero."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def top_k_similar(queries, candidates, k: int = 1, chunk_size: int = 1024):
+    """
+    Finds the k candidates with the highest cosine similarity to every query. The similarities are computed for a chunk of
+    queries at a time, and only the k best of every row are selected with argpartition and then sorted.
+    :param queries: The embeddings of the queries, one row per query.
+    :param candidates: The embeddings of the candidates, one row per candidate.
+    :param k: The number of candidates per query. At most the number of candidates are returned.
+    :param chunk_size: The number of queries per chunk.
+    :return: Two arrays with a row per query: the numbers of the k best candidates, best first, and their similarities.
+    Of candidates with the same similarity the first one comes first, like with idxmax, except that of candidates tied
+    at the k-th place, for k above 1, argpartition may keep a later one.
+    """
+    queries, candidates = normalize_rows(queries), normalize_rows(candidates)
+    k = min(k, len(candidates))
+    indices = np.zeros((len(queries), k), dtype=np.int64)
+    scores = np.zeros((len(queries), k), dtype=np.float32)
+    if k == 0:
+        return indices, scores
+
+    for start in range(0, len(queries), chunk_size):
+        similarities = queries[start:start + chunk_size] @ candidates.T
+        if k == 1:
+            best = np.argmax(similarities, axis=1)[:, None]
+        elif k < similarities.shape[1]:
+            best = np.sort(np.argpartition(-similarities, k - 1, axis=1)[:, :k], axis=1)
+        else:
+            best = np.broadcast_to(np.arange(similarities.shape[1]), similarities.shape)
+        best_scores = np.take_along_axis(similarities, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        indices[start:start + chunk_size] = np.take_along_axis(best, order, axis=1)
+        scores[start:start + chunk_size] = np.take_along_axis(best_scores, order, axis=1)
+
+    return indices, scores
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from Code.UtilityFunctions.shard_functions import read_line_range
+
+# The Yelp files start every object with its ID, e.g. {"review_id":"KU_O5udG6zpxOg-VcAEodg",...
+# Matching it directly avoids parsing every line with json.loads.
+_id_pattern = re.compile(rb'^\{"[a-z_]+": ?"([^"\\]*)"')
+
+_chunk_size = 1_000_000
+
+
+def hash64(data: bytes) -> int:
+    """A 64 bit BLAKE2 hash, used both for the IDs and the contents of the Yelp objects."""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def build_manifest(file_path: str) -> dict:
+    """
+    Reads a Yelp JSON-lines file and computes, for every object, a hash of its ID and a hash of its full line. The arrays are
+    filled in chunks, so only the numpy arrays, about 16 bytes plus the ID per object, are held in memory.
+    :param file_path: The Yelp JSON file.
+    :return: A dictionary of the numpy arrays "keys" (uint64 ID hashes), "contents" (uint64 line hashes), "ids" (the IDs
+    as fixed-width bytes) and "offsets" (the byte offset of every line), all sorted on "keys".
+    """
+    chunks = {"keys": [], "contents": [], "ids": [], "offsets": []}
+    keys, contents, ids, offsets = [], [], [], []
+
+    def flush_chunk():
+        chunks["keys"].append(np.array(keys, dtype=np.uint64))
+        chunks["contents"].append(np.array(contents, dtype=np.uint64))
+        chunks["ids"].append(np.array(ids, dtype=np.bytes_))
+        chunks["offsets"].append(np.array(offsets, dtype=np.uint64))
+        keys.clear(), contents.clear(), ids.clear(), offsets.clear()
+
+    with open(file_path, mode="rb") as file:
+        for offset, line in read_line_range(file):
+            line = line.rstrip(b"\r\n")
+            if not line:
+                continue
+            match = _id_pattern.match(line)
+            _id = match.group(1) if match else next(iter(json.loads(line).values())).encode("utf-8")
+
+            keys.append(hash64(_id))
+            contents.append(hash64(line))
+            ids.append(_id)
+            offsets.append(offset)
+            if len(keys) == _chunk_size:
+                flush_chunk()
+    flush_chunk()
+
+    manifest = {name: np.concatenate(arrays) for name, arrays in chunks.items()}  # IDs are widened to the longest one.
+    order = np.argsort(manifest["keys"], kind="stable")
+
+    return {name: array[order] for name, array in manifest.items()}
+
+
+def manifest_path(manifest_dir: str, file_name: str) -> str:
+    return os.path.join(manifest_dir, file_name.replace(".json", ".manifest.npz"))
+
+
+def save_manifest(manifest: dict, manifest_dir: str, file_name: str):
+    """Saves the keys, contents and IDs of a manifest. The offsets belong to one snapshot only, so they are not saved."""
+    if not os.path.exists(manifest_dir): os.makedirs(manifest_dir)
+    np.savez(manifest_path(manifest_dir, file_name),
+             keys=manifest["keys"],
+             contents=manifest["contents"],
+             ids=manifest["ids"])
+
+
+def load_manifest(manifest_dir: str, file_name: str) -> dict:
+    """
+    :return: The manifest saved by save_manifest, or an empty manifest if there is none, in which case every object of the
+    new snapshot counts as added.
+    """
+    path = manifest_path(manifest_dir, file_name)
+    if not os.path.isfile(path):
+        return {"keys": np.empty(0, dtype=np.uint64), "contents": np.empty(0, dtype=np.uint64), "ids": np.empty(0, dtype="S1")}
+
+    with np.load(path) as manifest:
+        return {name: manifest[name] for name in ("keys", "contents", "ids")}
+
+
+def diff_manifests(old: dict, new: dict) -> dict:
+    """
+    Compares the manifest of the previous snapshot to the one of the new snapshot.
+    :return: A dictionary with "added_offsets" and "changed_offsets", the byte offsets of the added and changed objects in
+    the new file, and "changed_ids" and "deleted_ids", the IDs whose triples must be removed from the previous build.
+    """
+    positions = np.searchsorted(old["keys"], new["keys"])
+    positions_in_bounds = np.minimum(positions, max(len(old["keys"]) - 1, 0))
+
+    if len(old["keys"]):
+        found = old["keys"][positions_in_bounds] == new["keys"]
+        changed = found & (old["contents"][positions_in_bounds] != new["contents"])
+    else:
+        found = np.zeros(len(new["keys"]), dtype=bool)
+        changed = found
+
+    deleted = ~np.isin(old["keys"], new["keys"])
+
+    return {"added_offsets": new["offsets"][~found],
+            "changed_offsets": new["offsets"][changed],
+            "changed_ids": new["ids"][changed],
+            "deleted_ids": old["ids"][deleted]}
@@ -0,0 +1,122 @@
+import argparse
+import ast
+import os
+
+import numpy as np
+import pandas as pd
+
+from Code.UtilityFunctions.category_mappings import category_similarities
+
+
+def read_ground_truth(path: str) -> pd.DataFrame:
+    """Reads the ground truth mappings, a CSV file with a Yelp category and a list of Schema types per row, like
+    yelp_category_schema_mappings.csv. A category with an empty list has no correct Schema type.
+
+    Args:
+        path (str): The CSV file with the columns YelpCategory and SchemaType
+
+    Returns:
+        pd.DataFrame: The columns yelp_category and mapped_schema, with a mapped_schema of None for the categories without one
+    """
+
+    truth = pd.read_csv(filepath_or_buffer=path)
+    truth["SchemaType"] = truth["SchemaType"].apply(
+        lambda x: ast.literal_eval(x) if isinstance(x, str) and x.startswith("[") else [] if pd.isna(x) else [x])
+    truth = truth.explode("SchemaType")
+
+    return pd.DataFrame({"yelp_category": truth["YelpCategory"].to_numpy(),
+                         "mapped_schema": truth["SchemaType"].where(truth["SchemaType"].notna(), None).to_numpy()})
+
+
+def sweep_thresholds(similarities: pd.DataFrame, ground_truth: pd.DataFrame, thresholds=None, top_k: list = None) -> pd.DataFrame:
+    """Computes precision, recall and F1 of the mappings of every combination of a threshold and a top-k, from the
+    similarities computed once by category_similarities. A mapping is predicted for a setting if the Schema type is among
+    the k best of the category, or of one of its split parts, with a similarity of at least the threshold. Only the
+    categories in the ground truth are evaluated.
+
+    Args:
+        similarities (pd.DataFrame): The result of category_similarities, with as many ranks as the largest top-k
+        ground_truth (pd.DataFrame): The result of read_ground_truth
+        thresholds (optional): The thresholds to evaluate. Defaults to 201 thresholds from 0 to 1.
+        top_k (list, optional): The numbers of best Schema types to evaluate. Defaults to every rank in similarities.
+
+    Returns:
+        pd.DataFrame: One row per top-k and threshold, with the number of predicted and correct mappings, and the
+        precision, recall and F1
+    """
+
+    thresholds = np.linspace(0, 1, 201) if thresholds is None else np.asarray(thresholds, dtype=np.float64)
+    top_k = sorted(similarities["rank"].unique() + 1) if top_k is None else sorted(top_k)
+
+    evaluated = similarities[similarities["yelp_category"].isin(set(ground_truth["yelp_category"]))]
+    correct_pairs = ground_truth.dropna(subset=["mapped_schema"]).drop_duplicates()
+    correct = pd.MultiIndex.from_frame(correct_pairs[["yelp_category", "mapped_schema"]])
+
+    curves = []
+    for k in top_k:
+        # A pair is predicted from the threshold of its best similarity within the top k, whichever part it came from.
+        pairs = evaluated[evaluated["rank"] < k].groupby(["yelp_category", "mapped_schema"])["similarity"].max()
+        is_correct = pairs.index.isin(correct)
+        all_scores = np.sort(pairs.to_numpy())
+        correct_scores = np.sort(pairs.to_numpy()[is_correct])
+
+        predicted = len(all_scores) - np.searchsorted(all_scores, thresholds, side="left")
+        true_positives = len(correct_scores) - np.searchsorted(correct_scores, thresholds, side="left")
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = np.where(predicted > 0, true_positives / predicted, np.nan)
+            recall = true_positives / len(correct) if len(correct) else np.full(len(thresholds), np.nan)
+            f1 = np.where(true_positives > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+        curves.append(pd.DataFrame({"top_k": k, "threshold": thresholds, "predicted": predicted,
+                                    "true_positives": true_positives, "precision": precision, "recall": recall, "f1": f1}))
+
+    return pd.concat(curves, ignore_index=True)
+
+
+def operating_point(curves: pd.DataFrame) -> dict:
+    """The setting with the highest F1. Of settings with the same F1, the one with the highest threshold and the smallest
+    top-k is chosen, as it predicts the fewest mappings."""
+    best = curves.sort_values(by=["f1", "threshold", "top_k"], ascending=[False, False, True], kind="stable").index[0]
+    return {column: curves[column].to_numpy()[best].item() for column in curves.columns}
+
+
+def evaluate_category_mappings(read_dir: str, ground_truth_path: str = None, max_k: int = 5, thresholds=None,
+                               output_path: str = None) -> dict:
+    """Evaluates the semantic category mappings against the ground truth for many thresholds and top-k settings at once.
+    The similarities are computed once, the sweep over the settings takes milliseconds.
+
+    Args:
+        read_dir (str): the path to read the data from
+        ground_truth_path (str, optional): The ground truth CSV. Defaults to ground_truth_yelp_category_schema_mappings.csv
+            in read_dir.
+        max_k (int, optional): The largest number of best Schema types per category to evaluate. Defaults to 5.
+        thresholds (optional): The thresholds to evaluate. Defaults to 201 thresholds from 0 to 1.
+        output_path (str, optional): A CSV file to write the precision, recall and F1 curves to. Defaults to None.
+
+    Returns:
+        dict: The operating point: the top-k and threshold with the highest F1, with its precision, recall and F1
+    """
+
+    ground_truth_path = ground_truth_path or os.path.join(read_dir, "ground_truth_yelp_category_schema_mappings.csv")
+    curves = sweep_thresholds(category_similarities(read_dir, k=max_k), read_ground_truth(ground_truth_path), thresholds)
+
+    if output_path:
+        curves.to_csv(output_path, index=False)
+    return operating_point(curves)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluates the semantic Yelp category to Schema type mappings against "
+                                                 "the ground truth for a sweep of thresholds and top-k settings.")
+    parser.add_argument('--read_dir', type=str, help='The directory with the Yelp, Schema and ground truth files')
+    parser.add_argument('--ground_truth', type=str, help='The ground truth CSV, if not in the read directory')
+    parser.add_argument('--max_k', type=int, default=5, help='The largest number of best Schema types per category')
+    parser.add_argument('--thresholds', type=int, default=201, help='The number of thresholds from 0 to 1')
+    parser.add_argument('--output', type=str, help='The CSV file to write the precision, recall and F1 curves to')
+    args = parser.parse_args()
+
+    point = evaluate_category_mappings(args.read_dir, ground_truth_path=args.ground_truth, max_k=args.max_k,
+                                       thresholds=np.linspace(0, 1, args.thresholds), output_path=args.output)
+    print(f"Best F1 {point['f1']:.3f} at top-{int(point['top_k'])} and threshold {point['threshold']:.3f}: "
+          f"precision {point['precision']:.3f}, recall {point['recall']:.3f}")
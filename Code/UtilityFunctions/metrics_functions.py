@@ -0,0 +1,204 @@
+import cProfile
+import json
+import os
+import sys
+import time
+
+from datetime import timedelta
+
+from Code.UtilityFunctions.output_functions import output_reports
+
+# resource is not available on Windows, where the peak memory is then not reported.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Options of the instrumentation. Changed with set_metrics_options.
+metrics_options = {"profile_dir": None, "progress_interval": 30.0}
+
+# Metrics of every stage finished in this process, and those returned by worker processes, see StageMetrics.as_dict.
+stage_metrics = []
+
+# The process a stage is being profiled in, as only one cProfile profiler can be active per process.
+_profiling_pid = None
+
+
+def set_metrics_options(profile_dir: str = None, progress_interval: float = None):
+    """
+    :param profile_dir: If given, every stage is profiled with cProfile and the statistics are saved to
+    <profile_dir>/<stage>.prof, to be read with pstats or snakeviz.
+    :param progress_interval: The minimum number of seconds between two progress lines.
+    """
+    metrics_options["profile_dir"] = profile_dir
+    if progress_interval is not None:
+        metrics_options["progress_interval"] = progress_interval
+
+
+def reset_peak_rss() -> bool:
+    """Resets the peak resident memory of the process, so it can be measured per stage. Only possible on Linux."""
+    try:
+        with open("/proc/self/clear_refs", mode="wt") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> int:
+    """
+    :return: The peak resident memory of the process in bytes, since the last reset_peak_rss on Linux, or since the start of
+    the process elsewhere. None if it cannot be measured.
+    """
+    try:
+        with open("/proc/self/status", mode="rt") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == "darwin" else max_rss * 1024  # Bytes on macOS, kilobytes elsewhere.
+    return None
+
+
+class StageMetrics:
+    """
+    Measures one stage of the pipeline: wall time, peak memory, and the records, triples and bytes counted by the stage
+    itself, plus the seconds spent in each of its phases. Used as a context manager, or with start() and finish().
+    On finish the metrics are added to stage_metrics.
+    """
+
+    def __init__(self, name: str, profile_dir: str = None):
+        """
+        :param name: The name of the stage.
+        :param profile_dir: If given, the stage is profiled with cProfile and the statistics are saved to
+        <profile_dir>/<name>.prof. Defaults to the directory set with set_metrics_options.
+        """
+        self.name = name
+        self.profile_dir = profile_dir or metrics_options["profile_dir"]
+        self.records = 0
+        self.triples = 0
+        self.bytes_read = 0
+        self.bytes_written = None  # Summed from the triple files closed during the stage if not set by the stage.
+        self.phases = dict()
+        self.seconds = None
+        self.peak_rss = None
+
+        self._profiler = None
+        self._reports = 0
+        self._stages = 0
+        self._start = None
+
+    def start(self):
+        global _profiling_pid
+        reset_peak_rss()
+        self._reports = len(output_reports)
+        self._stages = len(stage_metrics)
+        if self.profile_dir and _profiling_pid != os.getpid():
+            self._profiler = cProfile.Profile()
+            _profiling_pid = os.getpid()
+            self._profiler.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def add_phase(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def finish(self) -> dict:
+        """
+        Stops the measurement and adds the metrics to stage_metrics.
+        :return: The metrics, see as_dict.
+        """
+        global _profiling_pid
+        self.seconds = time.perf_counter() - self._start
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            _profiling_pid = None
+            if not os.path.exists(self.profile_dir): os.makedirs(self.profile_dir)
+            self._profiler.dump_stats(os.path.join(self.profile_dir, f"{self.name}.prof"))
+            self._profiler = None
+
+        if self.bytes_written is None:
+            self.bytes_written = sum(report["bytes_out"] for report in output_reports[self._reports:])
+
+        # A stage that only calls others, like the conversion of a file by several workers, adds up their counts.
+        nested = stage_metrics[self._stages:]
+        if not self.records and nested:
+            self.records = sum(metrics["records"] for metrics in nested)
+            self.triples = sum(metrics["triples"] for metrics in nested)
+            self.bytes_read = sum(metrics["bytes_read"] for metrics in nested)
+
+        # Stages nested in this one reset the peak memory, so their peaks count as well.
+        nested_peaks = [metrics["peak_rss_bytes"] for metrics in nested
+                        if metrics["pid"] == os.getpid() and metrics["peak_rss_bytes"] is not None]
+        self.peak_rss = max([peak_rss() or 0] + nested_peaks) or None
+
+        metrics = self.as_dict()
+        stage_metrics.append(metrics)
+        return metrics
+
+    def as_dict(self) -> dict:
+        return {"stage": self.name,
+                "pid": os.getpid(),
+                "seconds": round(self.seconds, 3),
+                "records": self.records,
+                "triples": self.triples,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+                "records_per_second": round(self.records / self.seconds, 1) if self.seconds else None,
+                "triples_per_second": round(self.triples / self.seconds, 1) if self.seconds else None,
+                "peak_rss_bytes": self.peak_rss,
+                "phases": {phase: round(seconds, 3) for phase, seconds in self.phases.items()}}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+
+
+class Progress:
+    """
+    Prints the progress of a conversion through a byte range of its input file, with the records per second and an estimate
+    of the time left. Based on the byte offset, so the lines of the file do not need to be counted first.
+    """
+
+    def __init__(self, name: str, start: int, end: int, interval: float = None):
+        """
+        :param name: The name printed with the progress.
+        :param start: The byte offset the conversion starts at.
+        :param end: The byte offset the conversion stops at.
+        :param interval: The minimum number of seconds between two progress lines. Defaults to the interval set with
+        set_metrics_options.
+        """
+        self.name = name
+        self.start = start
+        self.end = end
+        self.interval = interval if interval is not None else metrics_options["progress_interval"]
+        self._started = time.monotonic()
+        self._last = self._started
+
+    def update(self, offset: int, records: int):
+        """
+        :param offset: The byte offset reached.
+        :param records: The number of records done since the start.
+        """
+        now = time.monotonic()
+        if now - self._last < self.interval or self.end <= self.start:
+            return
+        self._last = now
+
+        elapsed = now - self._started
+        fraction = (offset - self.start) / (self.end - self.start)
+        eta = timedelta(seconds=round(elapsed * (1 - fraction) / fraction)) if fraction else "unknown"
+        print(f"{self.name}: {fraction:.1%} of {(self.end - self.start) / 1e6:,.0f} MB, "
+              f"{records / elapsed:,.0f} records/s, ETA {eta}")
+
+
+def write_metrics(path: str):
+    """Writes the metrics of every stage in stage_metrics to a JSON file."""
+    with open(path, mode="wt") as file:
+        json.dump({"stages": stage_metrics}, file, indent=2)
@@ -0,0 +1,173 @@
+import re
+
+from rdflib import Graph, URIRef, Literal, BNode, XSD
+
+# Characters rdflib refuses to serialize inside an IRI. We reject them the same way, so that a record which
+# would have failed with rdflib also fails with the direct emitter.
+_invalid_iri_chars = '<>" {}|\\^`'
+_invalid_iri_pattern = "[" + re.escape(_invalid_iri_chars) + "]"
+
+# Escapes for the lexical form of a literal, identical to the ones used by rdflib's N-Triples serializer.
+_literal_escapes = str.maketrans({"\\": "\\\\", "\n": "\\n", '"': '\\"', "\r": "\\r"})
+
+
+def render_iri(iri: str) -> str:
+    """
+    Renders an IRI as an N-Triples term.
+    :param iri: The IRI to render.
+    :return: The IRI enclosed in angle brackets.
+    """
+    for char in _invalid_iri_chars:
+        if char in iri:
+            raise ValueError(f'"{iri}" does not look like a valid IRI, it cannot be serialized as N-Triples.')
+    return f"<{iri}>"  # Formatting, rather than concatenating, keeps rdflib's URIRef.__radd__ out of the way.
+
+
+def render_iris(iris):
+    """
+    Renders a pandas Series of IRIs as N-Triples terms at once, e.g. the subjects of a chunk of records.
+    :param iris: The IRIs to render.
+    :return: The IRIs enclosed in angle brackets.
+    """
+    invalid = iris.str.contains(_invalid_iri_pattern, regex=True)
+    if invalid.any():
+        render_iri(iris[invalid].iloc[0])  # Raises the same error as for a single IRI.
+    return "<" + iris + ">"
+
+
+def lexical_form(value) -> str:
+    """
+    Returns the lexical form rdflib would give a Python value when it is used as a literal.
+    :param value: The Python value of the literal.
+    :return: The lexical form of the value.
+    """
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    return str(value)
+
+
+def implicit_datatype(value):
+    """
+    Returns the datatype rdflib assigns to a Python value when a literal is created without a datatype.
+    :param value: The Python value of the literal.
+    :return: The XSD datatype, or None for plain literals.
+    """
+    if isinstance(value, bool):
+        return XSD.boolean
+    if isinstance(value, int):
+        return XSD.integer
+    if isinstance(value, float):
+        return XSD.double
+    return None
+
+
+class NTriplesEmitter:
+    """
+    Writes N-Triples lines directly from strings, without building an rdflib Graph for every record.
+    Terms are rendered to their N-Triples form once, and the rendered lines of a record are collected until
+    serialize() is called. Like a Graph, a record holds every triple once, even if it is added again, e.g. a repeated
+    category or elite year.
+    """
+
+    def __init__(self, bnode_prefix: str = "b"):
+        """
+        :param bnode_prefix: Prefix of the blank node labels. Must be unique for every output that is merged into
+        the same graph, as the labels are only unique within one emitter.
+        """
+        self.bnode_prefix = bnode_prefix
+        self.bnodes = 0  # The number of blank nodes created, stored in checkpoints so labels are not reused on resume.
+        self.triples = 0  # The number of triples serialized.
+        self._datatype_suffixes = {}
+        self._terms = {}
+        self._lines = {}  # Used as an ordered set, so the lines are written in the order they were added.
+
+    def uri(self, iri: str) -> str:
+        return render_iri(iri)
+
+    def term(self, iri: str) -> str:
+        """Renders a vocabulary IRI (predicates and classes). These repeat for every record, so they are cached."""
+        rendered = self._terms.get(iri)
+        if rendered is None:
+            rendered = self._terms[iri] = render_iri(iri)
+        return rendered
+
+    def literal(self, value, datatype=None) -> str:
+        if datatype is None:
+            datatype = implicit_datatype(value)
+        lexical = '"' + lexical_form(value).translate(_literal_escapes) + '"'
+        if datatype is None:
+            return lexical
+
+        suffix = self._datatype_suffixes.get(datatype)
+        if suffix is None:
+            suffix = self._datatype_suffixes[datatype] = "^^" + render_iri(datatype)
+        return lexical + suffix
+
+    def bnode(self) -> str:
+        self.bnodes += 1
+        return f"_:{self.bnode_prefix}{self.bnodes}"
+
+    def add(self, triple: tuple):
+        self._lines[f"{triple[0]} {triple[1]} {triple[2]} .\n"] = None
+
+    def serialize(self) -> str:
+        """
+        :return: The N-Triples lines added since the last call.
+        """
+        lines = "".join(self._lines)
+        self.triples += len(self._lines)
+        self._lines = {}
+        return lines
+
+    def discard(self):
+        """Drops the lines added since the last call to serialize(), e.g. when a record fails halfway."""
+        self._lines = {}
+
+
+class GraphEmitter:
+    """
+    Reference implementation of the emitter interface that builds an rdflib Graph for every record, and
+    serializes it with rdflib. This is how the Yelp files were originally converted, and the output of
+    NTriplesEmitter should be isomorphic to the output of this class.
+    """
+
+    def __init__(self, bnode_prefix: str = "b"):
+        self.bnode_prefix = bnode_prefix  # Unused, rdflib generates globally unique blank node ids.
+        self.bnodes = 0
+        self.triples = 0
+        self._graph = Graph()
+
+    def uri(self, iri: str) -> URIRef:
+        return URIRef(iri)
+
+    def term(self, iri: str) -> URIRef:
+        return URIRef(iri)
+
+    def literal(self, value, datatype=None) -> Literal:
+        return Literal(value, datatype=datatype)
+
+    def bnode(self) -> BNode:
+        return BNode()
+
+    def add(self, triple: tuple):
+        self._graph.add(triple)
+
+    def serialize(self) -> str:
+        lines = self._graph.serialize(format="nt")
+        self.triples += len(self._graph)
+        self._graph = Graph()
+        return lines
+
+    def discard(self):
+        self._graph = Graph()
+
+
+def get_emitter(use_rdflib: bool = False, bnode_prefix: str = "b"):
+    """
+    :param use_rdflib: If True, return the rdflib based reference emitter instead of the direct N-Triples emitter.
+    :param bnode_prefix: Prefix of the blank node labels written by the direct emitter.
+    :return: An emitter with the methods uri, term, literal, bnode, add, serialize and discard.
+    """
+    return GraphEmitter(bnode_prefix) if use_rdflib else NTriplesEmitter(bnode_prefix)
@@ -0,0 +1,218 @@
+import gzip
+import os
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# zstd and lz4 are optional, the codecs are only available when the packages are installed.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# The file extension written by every codec. "gzip" and "pgzip" both write regular (multi-member) gzip files.
+codec_extensions = {
+    "gzip": ".nt.gz",
+    "pgzip": ".nt.gz",
+    "zstd": ".nt.zst",
+    "lz4": ".nt.lz4",
+    "none": ".nt",
+}
+
+# The level used when no level is given. 9 is also the default level of gzip.open.
+default_levels = {
+    "gzip": 9,
+    "pgzip": 9,
+    "zstd": 3,
+    "lz4": 0,
+    "none": None,
+}
+
+# Codec and level used when open_triple_file is called without them. Changed with set_output_codec.
+output_options = {"codec": "gzip", "level": None, "threads": os.cpu_count() or 1, "buffer_size": 4 * 1024 * 1024}
+
+# Reports of every sink closed in this process, see TripleSink.report.
+output_reports = []
+
+
+def set_output_codec(codec: str = "gzip", level: int = None, threads: int = None, buffer_size: int = None):
+    """
+    Sets the codec used by every writer that calls open_triple_file without a codec.
+    :param codec: One of "gzip", "pgzip", "zstd", "lz4" or "none".
+    :param level: The compression level. Defaults to the default level of the codec.
+    :param threads: The number of threads the pgzip codec compresses blocks with.
+    :param buffer_size: The number of characters buffered before they are compressed and written.
+    """
+    if codec not in codec_extensions:
+        raise ValueError(f"Unknown codec {codec}, choose one of {', '.join(codec_extensions)}.")
+    output_options["codec"] = codec
+    output_options["level"] = level
+    if threads is not None:
+        output_options["threads"] = threads
+    if buffer_size is not None:
+        output_options["buffer_size"] = buffer_size
+
+
+def output_path(path: str, codec: str = None) -> str:
+    """
+    Replaces the .nt.gz (or other triple file) extension of path with the extension of the codec.
+    :param path: A path ending in .nt.gz, as used by the writers.
+    :param codec: The codec to write the file with. Defaults to the codec set with set_output_codec.
+    :return: The path the codec writes to.
+    """
+    codec = codec or output_options["codec"]
+    for extension in (".nt.gz", ".nt.zst", ".nt.lz4", ".nt"):
+        if path.endswith(extension):
+            path = path[:-len(extension)]
+            break
+    return path + codec_extensions[codec]
+
+
+class TripleSink:
+    """
+    Text file that buffers what is written to it and compresses it in large blocks with the chosen codec.
+    Keeps count of the bytes written to it, the bytes written to disk and the time spent compressing.
+    """
+
+    def __init__(self, path: str, mode: str = "at", codec: str = None, level: int = None, threads: int = None,
+                 buffer_size: int = None):
+        """
+        :param path: The file to write to. The extension is replaced by the one of the codec, see output_path.
+        :param mode: "at" to append to the file, "wt" to overwrite it.
+        :param codec: One of "gzip", "pgzip", "zstd", "lz4" or "none". Defaults to the codec set with set_output_codec.
+        :param level: The compression level. Defaults to the level set with set_output_codec.
+        :param threads: The number of threads used by the pgzip codec.
+        :param buffer_size: The number of characters buffered before they are compressed and written.
+        """
+        self.codec = codec or output_options["codec"]
+        if level is None:
+            level = output_options["level"] if output_options["level"] is not None else default_levels[self.codec]
+        self.level = level
+        self.path = output_path(path, self.codec)
+        self.buffer_size = buffer_size or output_options["buffer_size"]
+        self.threads = threads or output_options["threads"]
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_seconds = 0.0
+
+        self._buffer = []
+        self._buffered = 0
+        self._raw = open(self.path, mode="ab" if mode.startswith("a") else "wb")
+        self._pending = deque()
+        self._executor = None
+        self._compressor = None
+
+        if self.codec == "pgzip":
+            self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        elif self.codec == "zstd":
+            if zstandard is None:
+                raise ImportError("The zstd codec needs the zstandard package.")
+            self._compressor = zstandard.ZstdCompressor(level=self.level)
+        elif self.codec == "lz4":
+            if lz4_frame is None:
+                raise ImportError("The lz4 codec needs the lz4 package.")
+
+    def write(self, text: str):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size:
+            self._write_buffer()
+
+    def flush(self):
+        """Compresses and writes everything buffered. For the compressed codecs this ends a gzip member or frame."""
+        self._write_buffer()
+        while self._pending:
+            self._write_block(*self._pending.popleft().result())
+        self._raw.flush()
+
+    def sync(self) -> int:
+        """
+        Flushes the sink and forces the file to disk. As every block is a complete gzip member or frame, the file is a
+        valid compressed file up to the returned position, which can be stored in a checkpoint.
+        :return: The size of the file after the flush.
+        """
+        self.flush()
+        os.fsync(self._raw.fileno())
+        return self._raw.tell()
+
+    def close(self):
+        self.flush()
+        self._raw.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+        output_reports.append(self.report())
+
+    def report(self) -> dict:
+        """
+        :return: The file written, the codec, the uncompressed bytes written to the sink, the bytes written to disk, and the
+        seconds spent compressing. For pgzip the seconds are summed over the threads.
+        """
+        return {"path": self.path,
+                "codec": self.codec,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "compress_seconds": round(self.compress_seconds, 3)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_buffer(self):
+        if not self._buffer:
+            return
+        block = "".join(self._buffer).encode("utf-8")
+        self._buffer = []
+        self._buffered = 0
+        self.bytes_in += len(block)
+
+        if self._executor is not None:
+            # Blocks are compressed as separate gzip members on the thread pool, zlib releases the GIL while compressing.
+            # Finished blocks are written in order, and at most two blocks per thread are held in memory.
+            self._pending.append(self._executor.submit(_compress_block, block, self.codec, self.level))
+            while len(self._pending) > 2 * self.threads or (self._pending and self._pending[0].done()):
+                self._write_block(*self._pending.popleft().result())
+        else:
+            self._write_block(*_compress_block(block, self.codec, self.level, self._compressor))
+
+    def _write_block(self, data: bytes, seconds: float):
+        self._raw.write(data)
+        self.bytes_out += len(data)
+        self.compress_seconds += seconds
+
+
+def _compress_block(block: bytes, codec: str, level: int, compressor=None):
+    """
+    Compresses one block as a complete gzip member, zstd frame or lz4 frame, so the blocks can simply be concatenated.
+    :return: The compressed block and the seconds it took to compress.
+    """
+    start = time.perf_counter()
+    if codec in ("gzip", "pgzip"):
+        data = gzip.compress(block, compresslevel=level, mtime=0)
+    elif codec == "zstd":
+        data = compressor.compress(block)
+    elif codec == "lz4":
+        data = lz4_frame.compress(block, compression_level=level)
+    else:
+        data = block
+    return data, time.perf_counter() - start
+
+
+def open_triple_file(path: str, mode: str = "at", codec: str = None, level: int = None) -> TripleSink:
+    """
+    Opens a triple file for writing, compressed with the codec set with set_output_codec unless another one is given.
+    :param path: The file to write to, ending in .nt.gz. The extension is replaced by the one of the codec.
+    :param mode: "at" to append to the file, "wt" to overwrite it.
+    :param codec: One of "gzip", "pgzip", "zstd", "lz4" or "none".
+    :param level: The compression level.
+    :return: A TripleSink with write and close methods, also usable as a context manager.
+    """
+    return TripleSink(path, mode=mode, codec=codec, level=level)
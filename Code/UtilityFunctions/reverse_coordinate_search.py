@@ -1,82 +1,306 @@
 # For the GeoPy Documentation, see https://geopy.readthedocs.io/en/latest/#
 # For the Nominatim Documentation, see https://nominatim.org/release-docs/latest/
 # For the Nominatim Terms of Service, see https://operations.osmfoundation.org/policies/nominatim/
+# For the GeoNames dumps the gazetteer is built from, see https://download.geonames.org/export/dump/readme.txt
+# and, for the postal codes, https://download.geonames.org/export/zip/readme.txt
+
+import argparse
+import csv
+import math
+import os
+import sqlite3
+import time
 
 from time import sleep
 
+import numpy as np
 import pandas as pd
+from geopy.exc import GeopyError
 from geopy.geocoders import Nominatim
 
+from Code.UtilityFunctions.cache_functions import ResponseCache
+from Code.UtilityFunctions.spatial_functions import SpatialIndex
+
+desired_address_levels = ["neighbourhood", "postcode", "city", "county", "state", "country"]
+
+# The radius in km within which the nearest centroid of a neighbourhood, postcode or city is taken as that of a coordinate.
+lookup_radii_km = {"neighbourhood": 3.0, "postcode": 15.0, "city": 30.0}
+
+geonames_columns = ["geonameid", "name", "asciiname", "alternatenames", "latitude", "longitude", "feature_class",
+                    "feature_code", "country_code", "cc2", "admin1_code", "admin2_code", "admin3_code", "admin4_code",
+                    "population", "elevation", "dem", "timezone", "modification_date"]
+postal_code_columns = ["country_code", "postal_code", "place_name", "admin_name1", "admin_code1", "admin_name2",
+                       "admin_code2", "admin_name3", "admin_code3", "latitude", "longitude", "accuracy"]
+
+# Populated places that no longer exist, or were never more than a name: historical, abandoned and destroyed ones.
+excluded_feature_codes = ["PPLH", "PPLQ", "PPLW", "PPLCH"]
+
+
+def read_geonames_file(path: str, names: list, usecols: list, chunksize: int = None):
+    """Reads a tab separated GeoNames file as text, so codes like "NA" (Namibia) and "01" stay as they are."""
+    return pd.read_csv(path, sep="\t", header=None, names=names, usecols=usecols, dtype=str, quoting=csv.QUOTE_NONE,
+                       keep_default_na=False, na_values=[], comment=None, chunksize=chunksize, encoding="utf-8")
+
+
+def read_code_names(path: str) -> dict:
+    """Reads admin1CodesASCII.txt or admin2Codes.txt: the name of every administrative division by its code, e.g. US.PA."""
+    codes = read_geonames_file(path, ["code", "name", "asciiname", "geonameid"], ["code", "name"])
+    return dict(zip(codes["code"], codes["name"]))
+
+
+def read_country_names(path: str) -> dict:
+    """Reads countryInfo.txt: the name of every country by its ISO code. The lines starting with # are comments."""
+    with open(path, mode="rt", encoding="utf-8") as file:
+        rows = [line.rstrip("\n").split("\t") for line in file if line.strip() and not line.startswith("#")]
+    return {row[0]: row[4] for row in rows}
+
+
+def build_gazetteer(geonames_dir: str, gazetteer_path: str, places_file: str = "cities500.txt",
+                    postal_codes_file: str = None, min_city_population: int = 1000) -> dict:
+    """
+    Builds the gazetteer of the offline reverse geocoder from GeoNames dumps: the centroids of the neighbourhoods (PPLX),
+    the populated places with at least min_city_population inhabitants, and optionally the postal codes, each with the
+    names of its county, state and country.
+
+    Args:
+        geonames_dir (str): The directory with the GeoNames files: the places file, admin1CodesASCII.txt, admin2Codes.txt
+            and countryInfo.txt, and the postal codes file if given.
+        gazetteer_path (str): The SQLite file to write the gazetteer to. It is replaced.
+        places_file (str, optional): The GeoNames dump of the places, e.g. cities500.txt, or allCountries.txt for every
+            neighbourhood. Defaults to cities500.txt.
+        postal_codes_file (str, optional): The GeoNames postal code dump, e.g. allCountries.txt of the zip export, or
+            US.txt. Defaults to None, for no postcodes.
+        min_city_population (int, optional): The smallest population of a place to count as a city. Defaults to 1000.
+
+    Returns:
+        dict: The number of neighbourhoods, postcodes and cities in the gazetteer
+    """
+
+    start = time.perf_counter()
+    admin1 = read_code_names(os.path.join(geonames_dir, "admin1CodesASCII.txt"))
+    admin2 = read_code_names(os.path.join(geonames_dir, "admin2Codes.txt"))
+    countries = read_country_names(os.path.join(geonames_dir, "countryInfo.txt"))
+
+    frames = []
+    usecols = ["name", "latitude", "longitude", "feature_class", "feature_code", "country_code", "admin1_code",
+               "admin2_code", "population"]
+    for chunk in read_geonames_file(os.path.join(geonames_dir, places_file), geonames_columns, usecols, chunksize=500_000):
+        chunk = chunk[(chunk["feature_class"] == "P") & ~chunk["feature_code"].isin(excluded_feature_codes)]
+        population = pd.to_numeric(chunk["population"], errors="coerce").fillna(0)
+        neighbourhood = chunk["feature_code"] == "PPLX"
+        chunk = chunk[neighbourhood | (population >= min_city_population)]
+
+        state_codes = chunk["country_code"] + "." + chunk["admin1_code"]
+        frames.append(pd.DataFrame({"kind": np.where(chunk["feature_code"] == "PPLX", "neighbourhood", "city"),
+                                    "name": chunk["name"],
+                                    "latitude": chunk["latitude"].astype(float),
+                                    "longitude": chunk["longitude"].astype(float),
+                                    "county": (state_codes + "." + chunk["admin2_code"]).map(admin2),
+                                    "state": state_codes.map(admin1),
+                                    "country": chunk["country_code"].map(countries)}))
+
+    if postal_codes_file:
+        postal_codes = read_geonames_file(os.path.join(geonames_dir, postal_codes_file), postal_code_columns,
+                                          ["country_code", "postal_code", "admin_name1", "admin_name2", "latitude", "longitude"])
+        postal_codes = postal_codes[(postal_codes["latitude"] != "") & (postal_codes["longitude"] != "")]
+        frames.append(pd.DataFrame({"kind": "postcode",
+                                    "name": postal_codes["postal_code"],
+                                    "latitude": postal_codes["latitude"].astype(float),
+                                    "longitude": postal_codes["longitude"].astype(float),
+                                    "county": postal_codes["admin_name2"].replace("", None),
+                                    "state": postal_codes["admin_name1"].replace("", None),
+                                    "country": postal_codes["country_code"].map(countries)}))
+
+    places = pd.concat(frames, ignore_index=True)
+
+    temporary_path = gazetteer_path + ".tmp"
+    if os.path.exists(temporary_path): os.remove(temporary_path)
+    connection = sqlite3.connect(temporary_path)
+    places.to_sql("places", connection, index=False)
+    connection.commit()
+    connection.close()
+    os.replace(temporary_path, gazetteer_path)
+
+    counts = places["kind"].value_counts().to_dict()
+    print(f"Wrote the gazetteer to {gazetteer_path} in {time.perf_counter() - start:.0f} s")
+    return {kind: counts.get(kind, 0) for kind in ("neighbourhood", "postcode", "city")}
+
+
+class ReverseGeocoder:
+    """
+    Offline reverse geocoder over a gazetteer built by build_gazetteer. A coordinate gets the nearest neighbourhood,
+    postcode and city whose centroid lies within lookup_radii_km, and the county, state and country of that city. Levels
+    the city lacks, or all levels if no city is near, come from the postcode or neighbourhood, but only from one in the
+    same state and country. All coordinates are looked up at once.
+    """
+
+    def __init__(self, gazetteer_path: str, radii_km: dict = None):
+        """
+        Args:
+            gazetteer_path (str): The SQLite file written by build_gazetteer
+            radii_km (dict, optional): The radius per kind of place. Defaults to lookup_radii_km.
+        """
+
+        radii_km = {**lookup_radii_km, **(radii_km or {})}
+        connection = sqlite3.connect(gazetteer_path)
+        places = pd.read_sql("SELECT * FROM places", connection)
+        connection.close()
+
+        self.places = {kind: frame.reset_index(drop=True) for kind, frame in places.groupby("kind")}
+        self.indexes = {kind: SpatialIndex(frame["latitude"].to_numpy(), frame["longitude"].to_numpy(), radii_km[kind])
+                        for kind, frame in self.places.items()}
+
+    def reverse(self, latitudes, longitudes) -> pd.DataFrame:
+        """
+        Args:
+            latitudes: The latitudes of the coordinates in degrees
+            longitudes: The longitudes of the coordinates in degrees
+
+        Returns:
+            pd.DataFrame: One row per coordinate with the columns of desired_address_levels, None where nothing was found
+        """
+
+        addresses = pd.DataFrame(None, index=range(len(latitudes)), columns=desired_address_levels, dtype=object)
+
+        # The administrative levels are taken from the city first, as it is the most reliable of the three. A postcode or
+        # neighbourhood only fills in the levels that are missing if it lies in the state and country found so far, as
+        # the nearest one can be across a border, e.g. a Pennsylvania postcode for a point in Camden, New Jersey.
+        for kind in ("city", "postcode", "neighbourhood"):
+            if kind not in self.indexes:
+                continue
+            nearest, _ = self.indexes[kind].nearest(latitudes, longitudes)
+            found = nearest >= 0
+            places = self.places[kind].iloc[nearest[found]]
+            addresses.loc[found, kind] = places["name"].to_numpy()
+
+            same_area = np.ones(len(places), dtype=bool)
+            for level in ("state", "country"):
+                current = addresses.loc[found, level].to_numpy()
+                same_area &= pd.isna(current) | (current == places[level].to_numpy())
+            for level in ("county", "state", "country"):
+                missing = addresses.loc[found, level].isna().to_numpy() & same_area
+                addresses.loc[np.flatnonzero(found)[missing], level] = places[level].to_numpy()[missing]
+
+        return addresses.astype(object).where(addresses.notna(), None)
+
+
+def nominatim_addresses(locations: list, zoom_level: int = 14, min_delay_seconds: float = 1,
+                        cell_cache: str = None) -> dict:
+    """
+    Reverse searches coordinates with the Nominatim API, one request per second as its terms of service ask. With a
+    cell cache every coordinate is only ever requested once: the addresses found, and the coordinates without an address,
+    are stored, while failed requests are tried again on the next call.
+
+    Args:
+        locations (list): The coordinates as "latitude,longitude" strings
+        zoom_level (int, optional): The zoom level to use when reverse searching the coordinates. Defaults to 14.
+        min_delay_seconds (float, optional): The delay after every request to the API. Defaults to 1.
+        cell_cache (str, optional): The SQLite file to cache the addresses in. Defaults to None, for no cache.
+
+    Returns:
+        dict: The Nominatim address of every coordinate, or None
+    """
+
+    cache = ResponseCache(cell_cache, ttl=math.inf) if cell_cache else None
+    geolocator = None
+    addresses = {}
+    for location in locations:
+        request = f"{location} zoom={zoom_level}"
+        cached = cache.get("nominatim", request, ignore_ttl=True) if cache is not None else None
+        if cached is not None:
+            addresses[location] = cached["address"]
+            continue
+
+        if geolocator is None:
+            geolocator = Nominatim(user_agent="YelpLocationMatching")
+        try:
+            found = geolocator.reverse(location, zoom=zoom_level)
+        except GeopyError as e:
+            print(f"Reverse searching {location} failed: {type(e).__name__}: {e}")
+            addresses[location] = None
+        else:
+            addresses[location] = found.raw.get("address") if found is not None else None
+            if cache is not None:
+                cache.put("nominatim", request, {"address": addresses[location]})
+        sleep(min_delay_seconds)  # Sleep to avoid API timeout
+
+    if cache is not None:
+        cache.close()
+    return addresses
+
+
 def find_business_locations(df: pd.DataFrame,
                               coordinate_rounding: int=2,
                               min_delay_seconds: int=1,
                               zoom_level: int=14,
-                              report_missing: bool=False):
+                              report_missing: bool=False,
+                              gazetteer: str=None,
+                              cell_cache: str=None,
+                              remote_fallback: bool=True):
     """
     Take a pd.dataframe with two columns ["latitude", "longitude"] and update the locations to the neighbourhood level
-    using the geopy library to reverse search this coordinate set, rounded to the coordinate_rounding.
+    by reverse searching this coordinate set, rounded to the coordinate_rounding. The coordinates are looked up in the
+    offline gazetteer if one is given, and the ones it has no country for through the Nominatim API of geopy.
 
     Args:
         df (pd.DataFrame): A dataframe with two columns ["latitude", "longitude"]
         coordinate_rounding (int, optional): The number of decimal places to round the coordinates to. Defaults to 2.
-        min_delay_seconds (int, optional): The minimum delay between requests to the geopy API. Defaults to 2.
+        min_delay_seconds (int, optional): The minimum delay between requests to the geopy API. Defaults to 1.
         zoom_level (int, optional): The zoom level to use when reverse searching the coordinates. Defaults to 14.
         report_missing (bool, optional): Whether to report missing locations. Defaults to False.
+        gazetteer (str, optional): The gazetteer written by build_gazetteer. Defaults to None, for only the Nominatim API.
+        cell_cache (str, optional): The SQLite file the Nominatim addresses of the rounded coordinates are cached in, so
+            each is only requested once. Defaults to None.
+        remote_fallback (bool, optional): Whether to reverse search the coordinates the gazetteer has no country for
+            through the Nominatim API. Defaults to True.
 
     Returns:
         pd.DataFrame: The original dataframe with additional columns ["neighbourhood", "city", "county", "state", "country"]
     """
-    
+
     # Preprocess the DataFrame
     df.drop(['city', 'state'], inplace=True, axis=1)
-    round_lat = df["latitude"].apply(round, args=(coordinate_rounding,)).astype(str)
-    round_lon = df["longitude"].apply(round, args=(coordinate_rounding,)).astype(str)
-    df["coordinate_set"] = round_lat + ',' + round_lon
-    
-    # Create list of unique rounded coordinates
-    unique_locations = list(df["coordinate_set"].unique())
-    
-    # Create geolocator using the Nominatim API
-    geolocator = Nominatim(user_agent="YelpLocationMatching")
-
-    # Create a dictionary with location as key and address as value
-    location_dict = {}
-    for location in unique_locations:
-        try:
-            location_dict[location] = geolocator.reverse(location, zoom=zoom_level).raw['address']
-        except:
-            location_dict[location] = None
-        sleep(min_delay_seconds)  # Sleep to avoid API timeout
-    
-    desired_address_levels = ["neighbourhood", "postcode", "city", "county", "state", "country"]
-    address_dict = {}
-    
-    # Extract only desired address levels from location_dict into address_dict
-    for location, address in location_dict.items():
-        if address is not None:
-            address_dict[location] = {level: address[level] for level in desired_address_levels if level in address}
-    
-    if report_missing:  # Count entries in address_dict that have no key in desired_address_levels
-        missing_count_dict = {}
-        desired_address_levels_set = set(desired_address_levels)
-        for location, address in address_dict.items():
-            included_addresses_set = set(list(address.keys()))
-            if included_addresses_set != desired_address_levels_set:  # If the address is missing any of the desired levels
-                missing_locations = desired_address_levels_set.difference(included_addresses_set)  # Get the missing levels
-                for missing_location in missing_locations:  # Add to the missing_count_dict
-                    missing_count_dict.setdefault(missing_location, 0)
-                    missing_count_dict[missing_location] += 1
-        print(missing_count_dict)
-    
-    # Create address DataFrame from the address_dict
-    address_df = pd.DataFrame.from_dict(address_dict, orient="index")
-
-    # Merge the two DataFrames on the coordinate_set column of businesses and the index of address_df
-    updated_businesses = df.merge(address_df, how="left", left_on="coordinate_set", right_index=True)
-
-    # Remove the rounded coordinate set column
-    updated_businesses.drop("coordinate_set", inplace=True, axis=1)
+    round_lat = df["latitude"].round(coordinate_rounding).to_numpy()
+    round_lon = df["longitude"].round(coordinate_rounding).to_numpy()
+    coordinate_set = pd.Series(round_lat).astype(str) + ',' + pd.Series(round_lon).astype(str)
+
+    # The unique rounded coordinates, and the number of the unique one of every business
+    unique_locations, first, inverse = np.unique(coordinate_set.to_numpy(dtype=str), return_index=True, return_inverse=True)
+
+    if gazetteer:
+        address_df = ReverseGeocoder(gazetteer).reverse(round_lat[first], round_lon[first])
+    else:
+        address_df = pd.DataFrame(None, index=range(len(unique_locations)), columns=desired_address_levels, dtype=object)
+
+    if remote_fallback:
+        missing = address_df["country"].isna().to_numpy()
+        location_dict = nominatim_addresses(unique_locations[missing].tolist(), zoom_level=zoom_level,
+                                            min_delay_seconds=min_delay_seconds, cell_cache=cell_cache)
+        for row, location in zip(np.flatnonzero(missing), unique_locations[missing]):
+            address = location_dict[location] or {}
+            for level in desired_address_levels:
+                address_df.at[row, level] = address.get(level)
+
+    if report_missing:  # Count the missing levels of the coordinates with an address
+        found = address_df[address_df.notna().any(axis=1)]
+        print({level: count for level, count in found.isna().sum().items() if count})
+
+    # Every business gets the address of its rounded coordinates
+    updated_businesses = pd.concat([df[["business_id"]].reset_index(drop=True),
+                                    address_df.iloc[inverse].reset_index(drop=True)], axis=1)
     updated_businesses = updated_businesses[["business_id", "neighbourhood", "postcode", "city", "county", "state", "country"]]
-    
+
     return updated_businesses
-    
\ No newline at end of file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds the gazetteer of the offline reverse geocoder from GeoNames dumps.")
+    parser.add_argument('--geonames_dir', type=str, help='The directory with the GeoNames files')
+    parser.add_argument('--gazetteer', type=str, help='The SQLite file to write the gazetteer to')
+    parser.add_argument('--places_file', type=str, default="cities500.txt", help='The GeoNames dump of the places')
+    parser.add_argument('--postal_codes_file', type=str, help='The GeoNames dump of the postal codes')
+    parser.add_argument('--min_city_population', type=int, default=1000, help='The smallest population of a city')
+    args = parser.parse_args()
+
+    print(build_gazetteer(args.geonames_dir, args.gazetteer, places_file=args.places_file,
+                          postal_codes_file=args.postal_codes_file, min_city_population=args.min_city_population))
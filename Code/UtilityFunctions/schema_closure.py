@@ -0,0 +1,154 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from Code.UtilityFunctions.cache_functions import cache_path
+
+cache_version = 1
+
+
+def file_hash(file_path: str) -> str:
+    """The SHA-256 of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(file_path, mode="rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SchemaClosure:
+    """
+    Reachability index over the subTypeOf relation of the Schema.org types. Every type has a number, its direct supertypes
+    are stored as a compressed sparse row, and the set of all its supertypes as a bitset with one bit per type. Whether a
+    type is a subclass of another is one bit lookup, and all supertypes of a type are one unpacked row.
+    """
+
+    def __init__(self, ids, parent_offsets, parents, ancestors):
+        """
+        :param ids: The IRIs of the types, in the order of their numbers.
+        :param parent_offsets: The offset of the direct supertypes of every type in parents, and the end of parents.
+        :param parents: The numbers of the direct supertypes of all types, type by type.
+        :param ancestors: The bitsets of all supertypes of every type, one row of packed bits per type.
+        """
+        self.ids = np.asarray(ids, dtype=object)
+        self.parent_offsets = np.asarray(parent_offsets, dtype=np.int64)
+        self.parents = np.asarray(parents, dtype=np.int64)
+        self.ancestors = np.asarray(ancestors, dtype=np.uint8)
+        self.numbers = {iri: number for number, iri in enumerate(self.ids)}
+
+    @classmethod
+    def from_csv(cls, file_path: str) -> "SchemaClosure":
+        """
+        Builds the index from the Schema.org types CSV. The supertypes of a type are the union of the supertypes of its
+        direct supertypes, so they are computed in topological order, supertypes first. Types on a cycle, which Schema.org
+        does not have, are settled by repeating the pass until nothing changes.
+        :param file_path: The schemaorg-current-https-types.csv file, with the columns id and subTypeOf.
+        """
+        schema_df = pd.read_csv(file_path)[["id", "subTypeOf"]]
+        schema_df["subTypeOf"] = schema_df["subTypeOf"].str.split(", ")
+        edges = schema_df.explode("subTypeOf").dropna()
+
+        ids = list(dict.fromkeys([*schema_df["id"], *edges["subTypeOf"]]))
+        numbers = {iri: number for number, iri in enumerate(ids)}
+        direct = [[] for _ in ids]
+        for child, parent in zip(edges["id"].map(numbers), edges["subTypeOf"].map(numbers)):
+            if parent not in direct[child]:
+                direct[child].append(parent)
+
+        # Kahn's algorithm from the types without supertypes down to their subtypes.
+        children = [[] for _ in ids]
+        remaining = [len(parents) for parents in direct]
+        for child, parents in enumerate(direct):
+            for parent in parents:
+                children[parent].append(child)
+        order = [number for number, count in enumerate(remaining) if count == 0]
+        for number in order:
+            for child in children[number]:
+                remaining[child] -= 1
+                if remaining[child] == 0:
+                    order.append(child)
+        order += [number for number, count in enumerate(remaining) if count > 0]
+
+        ancestors = np.zeros((len(ids), len(ids)), dtype=np.bool_)
+        changed = True
+        while changed:
+            changed = False
+            for number in order:
+                if not direct[number]:
+                    continue
+                reachable = ancestors[direct[number]].any(axis=0)
+                reachable[direct[number]] = True
+                if (reachable != ancestors[number]).any():
+                    ancestors[number] = reachable
+                    changed = True
+
+        parent_offsets = np.cumsum([0] + [len(parents) for parents in direct])
+        parents = np.array([parent for parents in direct for parent in parents], dtype=np.int64)
+        return cls(ids, parent_offsets, parents, np.packbits(ancestors, axis=1))
+
+    @classmethod
+    def load(cls, read_dir: str, file_name: str = "schemaorg-current-https-types.csv") -> "SchemaClosure":
+        """
+        Returns the index of the Schema.org types CSV in read_dir. It is built once and saved to the cache directory, keyed
+        on the hash of the CSV, so it is only built again when the types change.
+        :param read_dir: The directory the Schema.org types CSV is read from, which holds the cache directory.
+        :param file_name: The name of the Schema.org types CSV.
+        """
+        csv_hash = file_hash(os.path.join(read_dir, file_name))
+        index_path = cache_path(read_dir, file_name.replace(".csv", ".closure.npz"))
+
+        if os.path.isfile(index_path):
+            with np.load(index_path, allow_pickle=False) as saved:
+                if int(saved["version"]) == cache_version and str(saved["hash"]) == csv_hash:
+                    return cls(saved["ids"].astype(object), saved["parent_offsets"], saved["parents"], saved["ancestors"])
+
+        closure = cls.from_csv(os.path.join(read_dir, file_name))
+
+        # Written to a temporary file first, so an interrupted run never leaves a half-written index.
+        with open(index_path + ".tmp", mode="wb") as file:
+            np.savez(file, version=cache_version, hash=csv_hash, ids=closure.ids.astype(str),
+                     parent_offsets=closure.parent_offsets, parents=closure.parents, ancestors=closure.ancestors)
+        os.replace(index_path + ".tmp", index_path)
+
+        return closure
+
+    def number(self, iri: str) -> int:
+        """The number of a type. Raises a KeyError for IRIs that are not a type."""
+        return self.numbers[iri]
+
+    def direct_supertypes(self, iri: str) -> list:
+        number = self.number(iri)
+        return self.ids[self.parents[self.parent_offsets[number]:self.parent_offsets[number + 1]]].tolist()
+
+    def supertypes(self, iri: str) -> list:
+        """All supertypes of a type, not including the type itself."""
+        row = np.unpackbits(self.ancestors[self.number(iri)], count=len(self.ids))
+        return self.ids[np.flatnonzero(row)].tolist()
+
+    def is_subclass(self, iri: str, super_iri: str) -> bool:
+        """Whether a type is the other type or one of its subtypes, like rdfs:subClassOf*."""
+        number, super_number = self.number(iri), self.number(super_iri)
+        return number == super_number or bool(self.ancestors[number, super_number >> 3] & (0x80 >> (super_number & 7)))
+
+    def closure_mask(self, iris) -> np.ndarray:
+        """A boolean array over all types, True for the given types and all their supertypes."""
+        numbers = np.array([self.number(iri) for iri in iris], dtype=np.int64)
+        mask = np.unpackbits(np.bitwise_or.reduce(self.ancestors[numbers], axis=0), count=len(self.ids)).astype(np.bool_) \
+            if len(numbers) else np.zeros(len(self.ids), dtype=np.bool_)
+        mask[numbers] = True
+        return mask
+
+    def hierarchy_edges(self, iris) -> pd.DataFrame:
+        """
+        The direct subTypeOf edges between the given types and all their supertypes, which together hold the full
+        hierarchy above the given types.
+        :param iris: The IRIs of the types.
+        :return: The columns type and superType, one row per edge.
+        """
+        types = np.flatnonzero(self.closure_mask(iris))
+        counts = self.parent_offsets[types + 1] - self.parent_offsets[types]
+        starts = np.repeat(self.parent_offsets[types], counts)
+        positions = starts + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return pd.DataFrame({"type": np.repeat(self.ids[types], counts), "superType": self.ids[self.parents[positions]]})
@@ -1,14 +1,22 @@
+import json
 import os
+import sys
 import pandas as pd
-from networkx import DiGraph
-from networkx.algorithms.traversal.depth_first_search import dfs_tree
-from rdflib import Namespace, XSD
+from types import MappingProxyType
+from rdflib import Namespace, XSD, URIRef
 
 from Code.UtilityFunctions.string_functions import string_is_float
+from Code.UtilityFunctions.dictionary_functions import flatten_dictionary
+from Code.UtilityFunctions.cache_functions import cache_path, file_signature
+from Code.UtilityFunctions.schema_closure import SchemaClosure
 
 schema = Namespace("https://schema.org/")
 yelpvoc = Namespace("https://purl.archive.org/purl/yckg/vocabulary#")
 
+# The version of the cached predicate tables. Increase it whenever get_schema_predicate or infer_predicate_table change,
+# so the tables inferred by the earlier code are inferred again.
+cache_version = 1
+
 def get_schema_predicate(predicate, obj=None, file=None):
     """
     This match function gets as input keys and values from the Yelp JSON files and tries to map the keys to proper
@@ -76,6 +84,102 @@ def get_schema_predicate(predicate, obj=None, file=None):
             return yelpvoc + predicate, object_type
 
 
+class PredicateTable:
+    """
+    Frozen lookup table from the keys of a Yelp JSON file to the (predicate, datatype) pair get_schema_predicate returns for
+    them, built once by infer_predicate_table. Keys whose datatype differed within the sample, or which were not in the
+    sample at all, are not in the table, and for those get_schema_predicate still checks every value.
+    """
+
+    def __init__(self, entries: dict, file: str = None):
+        """
+        :param entries: Dictionary from key to a (predicate, datatype) pair.
+        :param file: The Yelp JSON file the table belongs to, passed on to get_schema_predicate.
+        """
+        self.file = file
+        self.entries = MappingProxyType({sys.intern(key): (sys.intern(str(predicate)), URIRef(datatype))
+                                         for key, (predicate, datatype) in entries.items()})
+
+    def lookup(self, predicate, obj=None):
+        """Same as get_schema_predicate(predicate, obj, file), without looking at obj for the keys in the table."""
+        entry = self.entries.get(predicate)
+        if entry is None:
+            return get_schema_predicate(predicate, obj, self.file)
+        return entry
+
+
+def infer_predicate_table(file_path: str, sample_size: int = 200_000) -> dict:
+    """
+    Runs get_schema_predicate over every key and value of the first sample_size objects of a Yelp JSON file, taking the
+    objects apart the same way the converters in create_yelp_nt_files do.
+    :param file_path: The Yelp JSON file.
+    :param sample_size: The number of objects to look at. The whole file is read if None.
+    :return: Dictionary from key to (predicate, datatype), for the keys that got the same pair for every value.
+    """
+    file_name = os.path.basename(file_path)
+    observed = dict()
+
+    with open(file_path, mode="rb") as file:
+        for number, line in enumerate(file):
+            if sample_size is not None and number >= sample_size:
+                break
+            try:
+                line = json.loads(line)
+            except ValueError:
+                continue
+
+            if file_name != "yelp_academic_dataset_tip.json":
+                del line[next(iter(line))]  # The ID, which becomes the subject.
+            line.pop("user_id", None)  # The author of reviews and tips.
+            line = flatten_dictionary(line)
+            line.pop("categories", None)  # Written as keywords, not through get_schema_predicate.
+
+            for _predicate, _object in line.items():
+                if _object in ("None", None, "none", "null", "Null", "NULL", ""):
+                    continue
+                try:
+                    result = get_schema_predicate(_predicate, _object, file_name)
+                except Exception:  # An unknown type, get_schema_predicate must see every value of this key.
+                    result = None
+                observed.setdefault(_predicate, set()).add(result)
+
+    return {key: results.pop() for key, results in observed.items() if len(results) == 1 and None not in results}
+
+
+def load_predicate_table(file_path: str, read_dir: str, sample_size: int = 200_000) -> PredicateTable:
+    """
+    Returns the PredicateTable of a Yelp JSON file. The table is inferred once and saved to the cache directory, from where
+    later runs, and the worker processes of create_nt_file_sharded, load it. A table is inferred again when the file changes,
+    or when it was inferred by another cache_version.
+    :param file_path: The Yelp JSON file.
+    :param read_dir: The directory the Yelp files are read from, which holds the cache directory.
+    :param sample_size: The number of objects to infer the table from, see infer_predicate_table.
+    :return: The PredicateTable of the file.
+    """
+    file_name = os.path.basename(file_path)
+    table_path = cache_path(read_dir, file_name.replace(".json", ".predicates.json"))
+    signature = file_signature(file_path)
+
+    if os.path.isfile(table_path):
+        with open(table_path, mode="rt") as file:
+            saved = json.load(file)
+        if saved.get("version") == cache_version and saved["signature"] == signature and saved["sample_size"] == sample_size:
+            return PredicateTable(saved["entries"], file_name)
+
+    entries = infer_predicate_table(file_path, sample_size)
+
+    # Written to a temporary file first, so a worker never loads a half-written table.
+    with open(table_path + ".tmp", mode="wt") as file:
+        json.dump({"version": cache_version,
+                   "signature": signature,
+                   "sample_size": sample_size,
+                   "entries": {key: [str(predicate), str(datatype)] for key, (predicate, datatype) in entries.items()}},
+                  file, indent=1)
+    os.replace(table_path + ".tmp", table_path)
+
+    return PredicateTable(entries, file_name)
+
+
 def get_schema_type(entity: str):
     """
     This function assigns a schema.org or yelpvoc type to a Yelp entity
@@ -102,37 +206,23 @@ def get_schema_type(entity: str):
             print(f"Unknown schema type for entity: {entity}")
 
 
-def class_hierarchy(read_dir: str):
+def read_schema_mappings(read_dir: str) -> pd.DataFrame:
     """
-    This function is used to create the hierarchy only for the mapped Schema types.
-    :return: a dataframe with schema type and its supertype(s).
+    Reads the mappings from Yelp categories to Schema types, one row per category and type.
+    :return: a dataframe with the columns YelpCategory and SchemaType, the name of the Schema type.
     """
+    schema_mapping = pd.read_csv(os.path.join(read_dir, 'yelp_category_schema_mappings.csv'))
+    # The column contains a string representation of a list, so we need to convert it to a list.
+    schema_mapping['SchemaType'] = schema_mapping['SchemaType'].apply(lambda x: eval(x))
+    return schema_mapping.explode('SchemaType').dropna().reset_index(drop=True)
 
-    class_mappings_manual_df = pd.read_csv(os.path.join(read_dir, 'yelp_category_schema_mappings.csv'))
-    class_mappings_manual_df['SchemaType'] = class_mappings_manual_df.SchemaType.str.split(",")
-    class_mappings_manual_df = class_mappings_manual_df.explode('SchemaType')
-    class_mapping_dict = pd.Series(class_mappings_manual_df.SchemaType.values,index=class_mappings_manual_df.YelpCategory).to_dict()
-    for key, value in class_mapping_dict.items():
-        class_mapping_dict[key] = value.replace("'", "").replace("[", "").replace("]", "").replace(" ", "")
-
-    schema_df = pd.read_csv(os.path.join(read_dir, 'schemaorg-current-https-types.csv'))[["id", "subTypeOf"]]
-    schema_df = schema_df.apply(
-        lambda x: x.str.split(', ').explode())  # Some types have multiple supertypes, so we explode those rows.
 
-    supertypes_dict = dict()
-
-    graph = DiGraph()
-    graph.add_edges_from(list(zip(schema_df["id"], schema_df["subTypeOf"])))  # Here we add EVERY row to the graph
-
-    # We do a depth first search on the constructed graph starting at each type in the input dictionary.
-    for _class in class_mapping_dict.values():
-        supertypes = dfs_tree(graph, "https://schema.org/" + _class)
-        edges = supertypes.edges()  # edges is a list of lists
-        for edge in edges:
-            supertypes_dict.setdefault(edge[0], set()).add(edge[1])
-
-    supertypes_df = pd.DataFrame(list(supertypes_dict.items()), columns=['type', 'superType'])
-    supertypes_df = supertypes_df.explode("superType")
-    supertypes_df.dropna(inplace=True)
-
-    return supertypes_df
+def class_hierarchy(read_dir: str, closure: SchemaClosure = None):
+    """
+    This function is used to create the hierarchy only for the mapped Schema types.
+    :param closure: The index of the Schema types, loaded from the cache directory if None.
+    :return: a dataframe with schema type and its supertype(s).
+    """
+    closure = closure or SchemaClosure.load(read_dir)
+    mapped_types = ("https://schema.org/" + read_schema_mappings(read_dir)['SchemaType']).unique()
+    return closure.hierarchy_edges(mapped_types)
@@ -0,0 +1,64 @@
+import os
+import shutil
+
+
+def newline_aligned_ranges(file_path: str, n_shards: int) -> list:
+    """
+    Splits a JSON-lines file into byte ranges of roughly equal size, where every range starts at the beginning of a line.
+    :param file_path: The JSON-lines file to split.
+    :param n_shards: The number of ranges to split the file into. Fewer ranges are returned for very small files.
+    :return: A list of (start, end) byte offsets. Every line of the file starts in exactly one range.
+    """
+    file_size = os.path.getsize(file_path)
+    boundaries = [0]
+
+    with open(file_path, mode="rb") as file:
+        for shard in range(1, n_shards):
+            offset = file_size * shard // n_shards
+            if offset <= boundaries[-1]:
+                continue
+            file.seek(offset - 1)
+            file.readline()  # Moves to the start of the first line beginning at or after the offset.
+            if file.tell() > boundaries[-1] and file.tell() < file_size:
+                boundaries.append(file.tell())
+
+    boundaries.append(file_size)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def read_line_range(file, start: int = 0, end: int = None):
+    """
+    Yields the lines of a file opened in binary mode that start within the byte range [start, end).
+    :param file: A file object opened with mode "rb".
+    :param start: The byte offset of the first line. Must be the start of a line.
+    :param end: The byte offset to stop at. Reads to the end of the file if None.
+    :return: A generator of (offset, line) tuples, where offset is the byte offset of the line.
+    """
+    file.seek(start)
+    offset = start
+    for line in file:
+        if end is not None and offset >= end:
+            break
+        yield offset, line
+        offset += len(line)
+
+
+def concatenate_parts(part_paths: list, destination: str, remove_parts: bool = True):
+    """
+    Concatenates triple files into one file. A sequence of gzip members is itself a valid gzip file, and the same holds for
+    zstd and lz4 frames and uncompressed N-Triples, so the parts are copied byte for byte without decompressing them.
+    :param part_paths: The triple files to concatenate, in order.
+    :param destination: The file to write the parts to. An existing file is replaced.
+    :param remove_parts: Whether to delete the parts once they are copied.
+    """
+    # Written to a temporary file first, so an interrupted run never leaves a half-concatenated file behind.
+    with open(destination + ".tmp", mode="wb") as destination_file:
+        for part_path in part_paths:
+            with open(part_path, mode="rb") as part_file:
+                shutil.copyfileobj(part_file, destination_file, length=1024 * 1024)
+    os.replace(destination + ".tmp", destination)
+
+    if remove_parts:
+        for part_path in part_paths:
+            os.remove(part_path)
@@ -0,0 +1,188 @@
+import math
+
+import numpy as np
+
+earth_radius_km = 6371.0
+km_per_degree = math.pi * earth_radius_km / 180
+
+
+def haversine(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    """The great-circle distances in km between two arrays of points in degrees, or two points."""
+    latitudes_1, longitudes_1, latitudes_2, longitudes_2 = map(np.radians, (latitudes_1, longitudes_1, latitudes_2, longitudes_2))
+    a = (np.sin((latitudes_2 - latitudes_1) / 2) ** 2
+         + np.cos(latitudes_1) * np.cos(latitudes_2) * np.sin((longitudes_2 - longitudes_1) / 2) ** 2)
+    return 2 * earth_radius_km * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def unit_vectors(latitudes, longitudes):
+    """The points as vectors on the unit sphere, an array with a row of x, y and z per point."""
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    return np.stack([np.cos(latitudes) * np.cos(longitudes), np.cos(latitudes) * np.sin(longitudes), np.sin(latitudes)], axis=1)
+
+
+class SpatialIndex:
+    """
+    Grid index of points on the earth for lookups within a fixed radius. The points are sorted by the cell of a
+    latitude/longitude grid whose rows are as high as the radius, so the points within the radius of a query lie in the
+    row of the query and the rows next to it, in the columns its radius spans. Those are found for all queries at once
+    with binary searches, and refined with the haversine distance.
+    """
+
+    def __init__(self, latitudes, longitudes, radius_km: float = 100.0):
+        """
+        :param latitudes: The latitudes of the points in degrees.
+        :param longitudes: The longitudes of the points in degrees.
+        :param radius_km: The radius of the lookups.
+        """
+        self.radius_km = radius_km
+        self.cell_degrees = min(radius_km / km_per_degree, 180.0)
+        # The columns divide the 360 degrees exactly, so the columns west of the first one are the last ones.
+        self.longitude_cells = math.ceil(360 / self.cell_degrees)
+        self.column_degrees = 360 / self.longitude_cells
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        keys = self._keys(*self._cells(latitudes, longitudes))
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self.latitudes = latitudes[self.order]
+        self.longitudes = longitudes[self.order]
+        self.vectors = unit_vectors(self.latitudes, self.longitudes)
+        # The smallest dot product of the unit vectors of two points within the radius, slightly lowered for rounding.
+        self.min_dot = math.cos(min(radius_km / earth_radius_km, math.pi)) - 1e-9
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _cells(self, latitudes, longitudes):
+        rows = np.floor((latitudes + 90) / self.cell_degrees).astype(np.int64)
+        columns = np.floor((longitudes + 180) / self.column_degrees).astype(np.int64) % self.longitude_cells
+        return rows, columns
+
+    def _keys(self, rows, columns):
+        return rows * self.longitude_cells + columns
+
+    def _chunks(self, latitudes, longitudes, chunk_size: int = 2048):
+        """Yields the pairs of within per chunk of queries, with the numbers of the queries counted from the first chunk."""
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        for start in range(0, len(latitudes), chunk_size):
+            queries, points, distances = self._within(latitudes[start:start + chunk_size], longitudes[start:start + chunk_size])
+            yield queries + start, points, distances
+
+    def within(self, latitudes, longitudes):
+        """
+        Finds all points within the radius of every query point.
+        :param latitudes: The latitudes of the query points in degrees.
+        :param longitudes: The longitudes of the query points in degrees.
+        :return: Three arrays with one element per pair of a query and a point within its radius: the number of the
+        query, the number of the point in the order the points were given, and their distance in km.
+        """
+        chunks = list(self._chunks(latitudes, longitudes))
+        if not chunks:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+
+    def _within(self, latitudes, longitudes):
+        rows, columns = self._cells(latitudes, longitudes)
+        cells = self.longitude_cells
+
+        # A degree of longitude gets shorter towards the poles, so the radius spans more columns of cells there. The
+        # longitudes within the radius differ at most arcsin(sin(radius) / cos(latitude)), or everything if that is above 1,
+        # where the circle contains a pole.
+        with np.errstate(divide="ignore"):
+            ratio = np.abs(np.sin(np.radians(min(self.cell_degrees, 90.0))) / np.cos(np.radians(latitudes)))
+        reach = np.where(ratio >= 1, 360.0, np.degrees(np.arcsin(np.clip(ratio, 0, 1))) * (1 + 1e-9) + 1e-9)
+        unwrapped = np.floor((longitudes + 180) / self.column_degrees).astype(np.int64)
+        first = columns + np.floor((longitudes - reach + 180) / self.column_degrees).astype(np.int64) - unwrapped
+        last = columns + np.floor((longitudes + reach + 180) / self.column_degrees).astype(np.int64) - unwrapped
+
+        # The columns of a query form one range of cells in a row, or two where they wrap around at 180 degrees.
+        everything = last - first + 1 >= cells
+        wraps_west = ~everything & (first < 0)
+        wraps_east = ~everything & (last >= cells)
+        ranges = [(np.where(everything, 0, np.maximum(first, 0)), np.where(everything, cells - 1, np.minimum(last, cells - 1))),
+                  (np.where(wraps_west, first + cells, 0), np.where(wraps_west, cells - 1, np.where(wraps_east, last - cells, -1)))]
+
+        queries, points = [], []
+        for row_offset in (-1, 0, 1):
+            row_keys = (rows + row_offset) * cells
+            for low, high in ranges:
+                starts = np.searchsorted(self.keys, row_keys + low, side="left")
+                counts = np.searchsorted(self.keys, row_keys + high, side="right") - starts
+                counts[high < low] = 0
+                total = int(counts.sum())
+                if not total:
+                    continue
+                # The ranges [start, start + count) of all queries, concatenated.
+                offsets = np.repeat(np.cumsum(counts) - counts, counts)
+                queries.append(np.repeat(np.arange(len(rows)), counts))
+                points.append(np.arange(total) - offsets + np.repeat(starts, counts))
+
+        if not queries:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        queries, points = np.concatenate(queries), np.concatenate(points)
+        # Most points of the cells are outside the radius, they are dropped by the cheaper dot product first.
+        dots = np.einsum("ij,ij->i", unit_vectors(latitudes, longitudes)[queries], self.vectors[points])
+        candidates = dots >= self.min_dot
+        queries, points = queries[candidates], points[candidates]
+        distances = haversine(latitudes[queries], longitudes[queries], self.latitudes[points], self.longitudes[points])
+        close = distances <= self.radius_km
+        return queries[close], self.order[points[close]], distances[close]
+
+    def nearest(self, latitudes, longitudes):
+        """
+        Finds the nearest point within the radius of every query point.
+        :return: The number of the nearest point per query, -1 if there is none, and its distance in km, inf if there is none.
+        """
+        nearest = np.full(len(latitudes), -1, dtype=np.int64)
+        nearest_distances = np.full(len(latitudes), np.inf)
+        for queries, points, distances in self._chunks(latitudes, longitudes):
+            chunk_nearest, chunk_distances = nearest_per_query(len(latitudes), queries, points, distances)
+            found = chunk_nearest >= 0
+            nearest[found], nearest_distances[found] = chunk_nearest[found], chunk_distances[found]
+        return nearest, nearest_distances
+
+
+def nearest_per_query(queries: int, query_numbers, point_numbers, distances):
+    """Reduces the pairs returned by SpatialIndex.within to the nearest point per query."""
+    nearest = np.full(queries, -1, dtype=np.int64)
+    nearest_distances = np.full(queries, np.inf)
+    np.minimum.at(nearest_distances, query_numbers, distances)
+    # Of points at the same distance the one given first is taken, like the first result of a sorted query.
+    is_nearest = distances == nearest_distances[query_numbers]
+    first = np.full(queries, np.iinfo(np.int64).max)
+    np.minimum.at(first, query_numbers[is_nearest], point_numbers[is_nearest])
+    found = first != np.iinfo(np.int64).max
+    nearest[found] = first[found]
+    return nearest, nearest_distances
+
+
+def nearest_candidates(latitudes, longitudes, candidates: list, coordinates: dict, radius_km: float = 100.0) -> list:
+    """
+    Finds the nearest candidate within the radius of every query point, e.g. the nearest of the settlements found by
+    searching for the name of a city, around the mean location of its businesses. All queries are done at once.
+    :param latitudes: The latitudes of the query points in degrees.
+    :param longitudes: The longitudes of the query points in degrees.
+    :param candidates: The candidates of every query point, e.g. lists of q_ids.
+    :param coordinates: The coordinates of the candidates, a list of (latitude, longitude) per candidate, as an entity
+    can have more than one. Candidates without coordinates are skipped.
+    :param radius_km: The radius.
+    :return: The nearest candidate per query point, or None.
+    """
+    names = list(coordinates)
+    numbers = {name: number for number, name in enumerate(names)}
+    point_names = np.array([numbers[name] for name in names for _ in coordinates[name]], dtype=np.int64)
+    point_coordinates = np.array([point for name in names for point in coordinates[name]], dtype=np.float64).reshape(-1, 2)
+
+    index = SpatialIndex(point_coordinates[:, 0], point_coordinates[:, 1], radius_km)
+    query_numbers, points, distances = index.within(latitudes, longitudes)
+
+    # Keeps the pairs of a query and a point of one of its own candidates.
+    allowed = np.array([query * len(names) + numbers[name] for query, names_of_query in enumerate(candidates)
+                        for name in names_of_query if name in numbers], dtype=np.int64)
+    names_of_points = point_names[points]
+    own = np.isin(query_numbers * len(names) + names_of_points, allowed)
+
+    nearest, _ = nearest_per_query(len(candidates), query_numbers[own], names_of_points[own], distances[own])
+    return [names[number] if number >= 0 else None for number in nearest]
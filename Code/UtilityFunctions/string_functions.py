@@ -1,6 +1,9 @@
+import functools
 import inflect
 import re
 
+_inflect_engine = None
+
 def string_is_float(string):
     """
     This function checks if a string is a float.
@@ -23,19 +26,26 @@ def turn_words_singular(categories_dict):
     :return: A dictionary with the same keys as the original dictionary, but with the values being a
     list of singular words.
     """
-    p = inflect.engine()
     categories_dict_singular = {}
     for key, value in categories_dict.items():
-        new_value = []
-        for word in value:
-            word = word.lower()
-            if p.singular_noun(word) is False:  # If the word is already singular p.singular_noun  returns False
-                word = word
-            else:
-                word = p.singular_noun(word)
-            new_value.append(word)
-        categories_dict_singular[key] = new_value
+        categories_dict_singular[key] = [singular_word(word.lower()) for word in value]
     return categories_dict_singular
 
+
+@functools.lru_cache(maxsize=None)
+def singular_word(word):
+    """
+    Turns a word into its singular form. Memoized, as inflect is slow and the same words come back in many categories.
+    :param word: The word, or words, to turn singular.
+    :return: The singular form, or the word itself if it is already singular.
+    """
+    global _inflect_engine
+    if _inflect_engine is None:
+        _inflect_engine = inflect.engine()
+    singular = _inflect_engine.singular_noun(word)
+    return word if singular is False else singular  # singular_noun returns False if the word is already singular
+
+
+@functools.lru_cache(maxsize=None)
 def space_words_lower(string):
     return re.sub('(?<!^)([A-Z])([^A-Z])', r' \1\2', string).lower()
@@ -1,30 +1,357 @@
+import random
 import sys
+import threading
+import time
 import pandas as pd
+import requests
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib.error import URLError
 from SPARQLWrapper import SPARQLWrapper, JSON
+from SPARQLWrapper.SPARQLExceptions import EndPointInternalError
+
+from Code.UtilityFunctions.cache_functions import ResponseCache
+
+user_agent = "Yelp knowledge graph mapping/%s.%s" % (sys.version_info[0], sys.version_info[1])
+
+# Where the Wikidata calls go, and how their responses are cached. Changed with set_wikidata_options.
+wikidata_options = {
+    "sparql_endpoint": "https://query.wikidata.org/sparql",
+    "api_endpoint": "https://www.wikidata.org/w/api.php",
+    "cache_path": None,
+    "ttl": 30 * 24 * 3600,
+    "max_bytes": 1024 ** 3,
+    "offline": False,
+    "requests_per_second": 5.0,
+    "search_workers": 4,
+    "max_retries": 5,
+}
+
+_cache = None
+_search_client = None
+_lock = threading.Lock()  # The cache and the search client are opened on first use, which may be in a worker thread.
+
+
+class CacheMiss(LookupError):
+    """Raised in offline mode for a Wikidata call that is not in the cache."""
+
+
+def set_wikidata_options(sparql_endpoint: str = None, api_endpoint: str = None, cache_path: str = None, ttl: float = None,
+                         max_bytes: int = None, offline: bool = None, requests_per_second: float = None,
+                         search_workers: int = None, max_retries: int = None):
+    """
+    :param sparql_endpoint: The SPARQL endpoint to query, e.g. a local stand-in for the Wikidata Query Service.
+    :param api_endpoint: The MediaWiki API to search entities with.
+    :param cache_path: The SQLite database to cache the responses in, see ResponseCache. Nothing is cached if None.
+    :param ttl: The number of seconds a cached response is used.
+    :param max_bytes: The maximum size of the cached responses, above it the least recently used ones are evicted.
+    :param offline: If True, every call is answered from the cache, also with expired responses, and a call that is not
+    in the cache raises CacheMiss instead of going to Wikidata.
+    :param requests_per_second: The maximum rate of requests to the MediaWiki API, shared by all searches.
+    :param search_workers: The number of searches run at the same time by wikidata_search_many.
+    :param max_retries: The number of times a search is retried after a 429 or 5xx response, or a connection error.
+    """
+    global _cache, _search_client
+    for option, value in (("sparql_endpoint", sparql_endpoint), ("api_endpoint", api_endpoint), ("cache_path", cache_path),
+                          ("ttl", ttl), ("max_bytes", max_bytes), ("offline", offline),
+                          ("requests_per_second", requests_per_second), ("search_workers", search_workers),
+                          ("max_retries", max_retries)):
+        if value is not None:
+            wikidata_options[option] = value
+    if _cache is not None:
+        _cache.close()
+        _cache = None
+    if _search_client is not None:
+        _search_client.close()
+        _search_client = None
+
+
+def response_cache():
+    """:return: The ResponseCache set with set_wikidata_options, or None."""
+    global _cache
+    with _lock:
+        if _cache is None and wikidata_options["cache_path"]:
+            _cache = ResponseCache(wikidata_options["cache_path"], ttl=wikidata_options["ttl"],
+                                   max_bytes=wikidata_options["max_bytes"])
+        return _cache
+
+
+def cached_call(kind: str, request: str, fetch):
+    """
+    Returns the cached response to a request, or fetches and caches it.
+    :param kind: The kind of request, e.g. "sparql" or "search".
+    :param request: The request, which is the cache key after normalizing its whitespace.
+    :param fetch: Function without arguments that fetches the response from Wikidata, as a JSON-serializable object.
+    :return: The response.
+    """
+    cache = response_cache()
+    if cache is not None:
+        response = cache.get(kind, request, ignore_ttl=wikidata_options["offline"])
+        if response is not None:
+            return response
+
+    if wikidata_options["offline"]:
+        raise CacheMiss(f"The {kind} request is not in the cache, and offline mode is on: {' '.join(request.split())[:300]}")
+
+    response = fetch()
+    if cache is not None:
+        cache.put(kind, request, response)
+    return response
+
 
 def wikidata_query(sparql_query: str):
     """
     It takes a SPARQL query as a string, and returns a pandas dataframe of the results
-    
+
     :param sparql_query: the query you want to run
     :type sparql_query: str
     :return: The query returns the wikidata item id, the wikidata item label, the wikidata item
     description, and the wikidata item category.
     """
-    user_agent = "Yelp knowledge graph mapping/%s.%s" % (sys.version_info[0], sys.version_info[1])
-    sparql = SPARQLWrapper("https://query.wikidata.org/sparql", agent=user_agent)
-    sparql.setQuery(sparql_query)
-    sparql.setReturnFormat(JSON)
-    results = sparql.query().convert()
+    def fetch():
+        sparql = SPARQLWrapper(wikidata_options["sparql_endpoint"], agent=user_agent)
+        sparql.setQuery(sparql_query)
+        sparql.setReturnFormat(JSON)
+        return sparql.query().convert()
+
+    results = cached_call("sparql", sparql_query, fetch)
     results_df = pd.json_normalize(results['results']['bindings'])
-    
+
     return results_df
 
 
+def query_timed_out(error: Exception) -> bool:
+    """Whether a failed query timed out. The Query Service reports its own timeout as an internal error."""
+    if isinstance(error, URLError):
+        error = error.reason
+    return isinstance(error, (EndPointInternalError, TimeoutError))
+
+
+def batched_wikidata_query(build_query, keys: list, batch_size: int = 200, skip_failed: bool = False) -> pd.DataFrame:
+    """
+    Runs one query per batch of keys, e.g. QIDs put into a VALUES block by build_query. When a query times out, the batch
+    is halved and queried again, and the remaining keys are queried in batches of that size too.
+    :param build_query: Function that takes a list of keys and returns the SPARQL query for them.
+    :param keys: The keys to query.
+    :param batch_size: The number of keys per query to start with.
+    :param skip_failed: Whether to halve the batch on any error, not just on timeouts, and leave out a single key whose
+    query fails instead of raising the error.
+    :return: The results of all batches, in the order of the keys.
+    """
+    frames = []
+    position = 0
+    while position < len(keys):
+        batch = keys[position:position + batch_size]
+        try:
+            frames.append(wikidata_query(build_query(batch)))
+        except CacheMiss:
+            raise
+        except Exception as e:
+            if len(batch) > 1 and (skip_failed or query_timed_out(e)):
+                batch_size = len(batch) // 2
+                print(f"A query of {len(batch)} keys failed ({type(e).__name__}), continuing with {batch_size} keys per query")
+                continue
+            if not skip_failed:
+                raise
+        position += len(batch)
+
+    frames = [frame for frame in frames if not frame.empty]
+
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+class TokenBucket:
+    """Limits the rate of an action shared by several threads: acquire() blocks until a token is available."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        :param rate: The number of tokens added per second.
+        :param capacity: The maximum number of tokens, i.e. the size of a burst. Defaults to one second of tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EntitySearchClient:
+    """
+    Searches Wikidata items with the wbsearchentities action of the MediaWiki API, from any number of threads:
+        - all threads share one session, so connections are reused,
+        - the requests of all threads together are limited to requests_per_second,
+        - a 429 or 5xx response, a timeout or a connection error is retried with exponential backoff, following the
+          Retry-After header when the API sends one,
+        - a search that is already running in another thread is waited for instead of being sent again.
+    The responses go through the ResponseCache, see cached_call.
+    """
+
+    def __init__(self, api_endpoint: str, requests_per_second: float = 5.0, workers: int = 4, max_retries: int = 5,
+                 backoff: float = 1.0, timeout: float = 60):
+        """
+        :param api_endpoint: The MediaWiki API.
+        :param requests_per_second: The maximum rate of requests.
+        :param workers: The number of searches run at the same time by search_many, and the size of the connection pool.
+        :param max_retries: The number of retries of a failed request.
+        :param backoff: The seconds waited before the first retry, doubled for every next one.
+        :param timeout: The seconds to wait for a response.
+        """
+        self.api_endpoint = api_endpoint
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(requests_per_second)
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.requests = 0
+        self.retries = 0
+        self.deduplicated = 0
+        self.latencies = []
+        self._in_flight = dict()
+        self._lock = threading.Lock()
+
+    def _retry_delay(self, attempt: int, response=None) -> float:
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def get(self, url: str) -> dict:
+        """Sends a GET request within the rate limit, retrying it on 429 and 5xx responses, and returns the JSON response."""
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                response = None
+            else:
+                with self._lock:
+                    self.requests += 1
+                    self.latencies.append(time.perf_counter() - start)
+                if not (response.status_code == 429 or response.status_code >= 500) or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response.json()
+
+            with self._lock:
+                self.retries += 1
+            time.sleep(self._retry_delay(attempt, response))
+
+    def search(self, search_string: str) -> dict:
+        """
+        :param search_string: The search string, already URL-encoded.
+        :return: The JSON response of the API.
+        """
+        with self._lock:
+            future = self._in_flight.get(search_string)
+            running = future is not None
+            if running:
+                self.deduplicated += 1
+            else:
+                future = self._in_flight[search_string] = Future()
+        if running:
+            return future.result()
+
+        url = f"{self.api_endpoint}?action=wbsearchentities&format=json&language=en&type=item&continue=0&search={search_string}"
+        try:
+            # The endpoint is not part of the key, so responses recorded from Wikidata can be replayed against a stand-in.
+            result = cached_call("search", f"search={search_string}", lambda: self.get(url))
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[search_string]
+
+    def search_many(self, search_strings: list) -> dict:
+        """
+        Runs the searches on workers threads.
+        :return: The JSON response per distinct search string.
+        """
+        distinct = list(dict.fromkeys(search_strings))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return dict(zip(distinct, pool.map(self.search, distinct)))
+
+    def statistics(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))], 4) if latencies else None
+
+        return {"requests": self.requests, "retries": self.retries, "deduplicated": self.deduplicated,
+                "latency_mean": round(sum(latencies) / len(latencies), 4) if latencies else None,
+                "latency_p50": percentile(0.5), "latency_p95": percentile(0.95)}
+
+    def close(self):
+        self.session.close()
+
+
+def search_client() -> EntitySearchClient:
+    """:return: The EntitySearchClient set with set_wikidata_options, shared by all searches."""
+    global _search_client
+    with _lock:
+        if _search_client is None:
+            _search_client = EntitySearchClient(wikidata_options["api_endpoint"],
+                                                requests_per_second=wikidata_options["requests_per_second"],
+                                                workers=wikidata_options["search_workers"],
+                                                max_retries=wikidata_options["max_retries"])
+        return _search_client
+
+
+def wikidata_search(search_string: str) -> dict:
+    """
+    Searches Wikidata items with the wbsearchentities action of the MediaWiki API.
+    :param search_string: The search string, already URL-encoded.
+    :return: The JSON response of the API.
+    """
+    return search_client().search(search_string)
+
+
+def wikidata_search_many(search_strings: list) -> dict:
+    """
+    Runs the searches concurrently, see EntitySearchClient.
+    :param search_strings: The search strings, already URL-encoded.
+    :return: The JSON response per distinct search string.
+    """
+    return search_client().search_many(search_strings)
+
+
 def category_query(schema_iri: str):
     return f"""
     SELECT distinct ?item ?itemLabel WHERE{{
         ?item wdt:P1709 <{schema_iri}>.
         SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en".}}
     }}"""
-    
\ No newline at end of file
+
+
+def category_batch_query(schema_iris: list):
+    """The query of category_query for several Schema types at once, with the type of every item in ?schemaType."""
+    values = " ".join(f"<{schema_iri}>" for schema_iri in schema_iris)
+    return f"""
+    SELECT distinct ?schemaType ?item ?itemLabel WHERE{{
+        VALUES ?schemaType {{{values}}}
+        ?item wdt:P1709 ?schemaType.
+        SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en".}}
+    }}"""
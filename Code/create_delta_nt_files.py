@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+
+from Code.create_yelp_nt_files import convert_json_range
+from Code.UtilityFunctions.get_iri import get_iri
+from Code.UtilityFunctions.manifest_functions import build_manifest, load_manifest, save_manifest, diff_manifests
+
+# The number of subjects per DELETE operation in the delete patch.
+delete_batch_size = 1000
+
+
+def update_manifest(file_name: str, read_dir: str, manifest_dir: str):
+    """
+    Saves the manifest of a Yelp JSON file after a full build, so the next snapshot can be built as a delta against it.
+    :param file_name: The Yelp JSON file that was transformed to RDF.
+    :param read_dir: The directory to read the Yelp JSON file from.
+    :param manifest_dir: The directory to save the manifest to.
+    """
+    save_manifest(build_manifest(os.path.join(read_dir, file_name)), manifest_dir, file_name)
+
+
+def create_delta_nt_file(file_name: str, read_dir: str, write_dir: str, manifest_dir: str) -> dict:
+    """
+    Builds the difference between the previous build of one of the three Yelp JSON files handled by create_nt_file and a
+    new snapshot of it, using the manifest saved by the previous build. Two patch files are written:
+        - yelp_<entity>.delta.delete.ru, a SPARQL Update removing every triple of the changed and deleted objects,
+          including the triples of their blank nodes.
+        - yelp_<entity>.delta.add.nt.gz, the triples of the added and changed objects.
+    The delete patch must be applied before the add patch. Afterwards the manifest is replaced by the one of the new snapshot.
+    :param file_name: The Yelp JSON file to transform to RDF.
+    :param read_dir: The directory to read the new snapshot of the Yelp JSON file from.
+    :param write_dir: The directory to write the patch files to.
+    :param manifest_dir: The directory with the manifest of the previous build.
+    :return: The number of added, changed and deleted objects.
+    """
+    entity_name = file_name[22:-5]  # Either business, user, or review
+    new_manifest = build_manifest(os.path.join(read_dir, file_name))
+    delta = diff_manifests(load_manifest(manifest_dir, file_name), new_manifest)
+
+    convert_json_range(file_name=file_name,
+                       read_dir=read_dir,
+                       triple_file_path=os.path.join(write_dir, f"yelp_{entity_name}.delta.add.nt.gz"),
+                       error_suffix="_delta",
+                       mode="wt",
+                       only_offsets=np.union1d(delta["added_offsets"], delta["changed_offsets"]).astype(np.int64))
+
+    removed_ids = [_id.decode("utf-8") for _id in delta["changed_ids"].tolist() + delta["deleted_ids"].tolist()]
+    write_delete_patch(subjects=[get_iri(file_name) + _id for _id in removed_ids],
+                       patch_path=os.path.join(write_dir, f"yelp_{entity_name}.delta.delete.ru"))
+
+    save_manifest(new_manifest, manifest_dir, file_name)
+
+    return {"added": len(delta["added_offsets"]),
+            "changed": len(delta["changed_offsets"]),
+            "deleted": len(delta["deleted_ids"])}
+
+
+def write_delete_patch(subjects: list, patch_path: str):
+    """
+    Writes a SPARQL Update that deletes every triple of the given subjects, and every triple of the blank nodes they link to,
+    such as the opening hours and the parking attributes of a business.
+    :param subjects: The IRIs of the subjects to delete.
+    :param patch_path: The file to write the update to.
+    """
+    with open(patch_path, mode="wt", encoding="utf-8") as file:
+        file.write(f"# Deletes the triples of {len(subjects)} subjects. Apply before the matching .delta.add.nt.gz file.\n")
+        for start in range(0, len(subjects), delete_batch_size):
+            values = "\n        ".join(f"<{subject}>" for subject in subjects[start:start + delete_batch_size])
+            if start:
+                file.write(";\n")
+            file.write(f"""DELETE {{ ?s ?p ?o . ?o ?bp ?bo }}
+WHERE {{
+    VALUES ?s {{
+        {values}
+    }}
+    ?s ?p ?o .
+    OPTIONAL {{ ?o ?bp ?bo . FILTER(isBlank(?o)) }}
+}}
+""")
@@ -1,10 +1,16 @@
-import gzip
 import os
 
+import numpy as np
 import pandas as pd
 from rdflib import Namespace, Graph, URIRef
-from rdflib.namespace import RDFS
-from Code.UtilityFunctions.schema_functions import class_hierarchy
+from rdflib.namespace import RDF, RDFS
+from Code.UtilityFunctions.schema_functions import class_hierarchy, read_schema_mappings
+from Code.UtilityFunctions.schema_closure import SchemaClosure
+from Code.UtilityFunctions.columnar_functions import load_columns
+from Code.UtilityFunctions.get_iri import get_iri
+from Code.UtilityFunctions.output_functions import open_triple_file, output_path
+from Code.UtilityFunctions.ntriples_functions import get_emitter, render_iris
+from Code.UtilityFunctions.metrics_functions import StageMetrics
 
 schema = Namespace("https://schema.org/")
 skos = Namespace("https://www.w3.org/2004/02/skos/core#")
@@ -18,21 +24,23 @@ def create_schema_hierarchy_file(read_dir: str, write_dir: str):
         write_dir (str): The directory to write the triple file to.
     """
 
-    triple_file = gzip.open(os.path.join(write_dir, "schema_hierarchy.nt.gz"),
-                            mode="at",
-                            encoding="utf-8")
-    
-    class_hierarchies = class_hierarchy(read_dir=read_dir) 
-    
-    G = Graph()  
-    for idx, row in class_hierarchies.iterrows():  # Adds type hierarchies to the graph
-        G.add(triple=(URIRef(Namespace(row['type'])),
-                        RDFS.subClassOf,
-                        URIRef(Namespace(row['superType']))))
-    
-    triple_file.write(G.serialize(format='nt'))
+    metrics = StageMetrics("schema_hierarchy_triples").start()
+    triple_file = open_triple_file(os.path.join(write_dir, "schema_hierarchy.nt.gz"),
+                                   mode="wt")
+
+    class_hierarchies = class_hierarchy(read_dir=read_dir)
+
+    # The edges come from the closure index once each, so they are rendered as lines directly.
+    emitter = get_emitter()
+    lines = (render_iris(class_hierarchies['type']) + f" {emitter.term(RDFS.subClassOf)} "
+             + render_iris(class_hierarchies['superType']) + " .\n")
+
+    triple_file.write("".join(lines))
     triple_file.close()
 
+    metrics.records = metrics.triples = len(class_hierarchies)
+    metrics.finish()
+
 
 def create_schema_mappings_file(read_dir: str, write_dir: str):
     """Creates the schema mappings file containing the mappings from Yelp categories to Schema.org types.
@@ -41,9 +49,9 @@ def create_schema_mappings_file(read_dir: str, write_dir: str):
         write_dir (str): The directory to write the triple file to.
     """
 
-    triple_file = gzip.open(os.path.join(write_dir, "yelp_schema_mappings.nt.gz"),
-                        mode="at",
-                        encoding="utf-8")
+    metrics = StageMetrics("schema_mapping_triples").start()
+    triple_file = open_triple_file(os.path.join(write_dir, "yelp_schema_mappings.nt.gz"),
+                                   mode="wt")
     
     schema_mapping = pd.read_csv(os.path.join(read_dir, "yelp_category_schema_mappings.csv"))
 
@@ -75,4 +83,62 @@ def create_schema_mappings_file(read_dir: str, write_dir: str):
     
     triple_file.write(G.serialize(format='nt'))
     triple_file.close()
-    
\ No newline at end of file
+
+    metrics.records, metrics.triples = len(schema_mapping), len(G)
+    metrics.finish()
+    
+
+def create_inferred_types_file(read_dir: str, write_dir: str, lines_per_write: int = 1_000_000) -> dict:
+    """Creates the inferred types file containing, for every business, the Schema.org types of its categories and all
+    their supertypes, so queries for the businesses of a type need no property path over keywords, relatedMatch and
+    subClassOf at query time.
+
+    The categories are coded as integers into the mapped categories, and every mapped category as the numbers of its
+    types and their supertypes from the Schema closure index, so the join of the businesses, the mappings and the
+    hierarchy is done on integer arrays in one pass.
+    Args:
+        read_dir (str): The directory to read the data from.
+        write_dir (str): The directory to write the triple file to.
+        lines_per_write (int): The number of triples rendered and written at a time.
+
+    Returns:
+        dict: The number of businesses and of inferred type triples.
+    """
+
+    metrics = StageMetrics("inferred_type_triples").start()
+    closure = SchemaClosure.load(read_dir)
+    types_by_category = read_schema_mappings(read_dir).groupby('YelpCategory')['SchemaType'].agg(list)
+
+    # The types of every mapped category and all their supertypes, as a compressed sparse row.
+    category_types = [np.flatnonzero(closure.closure_mask([str(schema) + _type for _type in types]))
+                      for types in types_by_category]
+    type_offsets = np.cumsum([0] + [len(types) for types in category_types])
+    type_numbers = np.concatenate(category_types) if category_types else np.zeros(0, dtype=np.int64)
+
+    biz = load_columns("yelp_academic_dataset_business.json", read_dir, ["business_id", "categories"])
+    categories = biz['categories'].str.split(", ").explode().dropna()
+    codes = types_by_category.index.get_indexer(categories)
+    businesses, codes = categories.index.to_numpy()[codes >= 0], codes[codes >= 0]
+
+    # Every (business, type) pair of every mapped category, deduplicated and sorted by business as one integer key.
+    counts = type_offsets[codes + 1] - type_offsets[codes]
+    positions = np.repeat(type_offsets[codes], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pairs = np.unique(np.repeat(businesses, counts).astype(np.int64) * len(closure.ids) + type_numbers[positions])
+
+    emitter = get_emitter()
+    subjects = render_iris(get_iri("yelp_academic_dataset_business.json") + biz['business_id'].astype(str)).to_numpy()
+    objects = np.asarray(render_iris(pd.Series(closure.ids)) + " .\n", dtype=object)
+    predicate = f" {emitter.term(RDF.type)} "
+
+    triple_file = output_path(os.path.join(write_dir, "yelp_business_types.nt.gz"))
+    if os.path.isfile(triple_file):  # Remove file if it already exists
+        os.remove(triple_file)
+
+    with open_triple_file(triple_file, mode="at") as file:
+        for start in range(0, len(pairs), lines_per_write):
+            chunk = pairs[start:start + lines_per_write]
+            file.write("".join(subjects[chunk // len(closure.ids)] + predicate + objects[chunk % len(closure.ids)]))
+
+    metrics.records, metrics.triples = len(biz), len(pairs)
+    metrics.finish()
+    return {"businesses": len(biz), "triples": len(pairs)}
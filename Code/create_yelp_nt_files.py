@@ -1,14 +1,23 @@
-import gzip
 import json
 import os
+import time
 
-from rdflib import Namespace, Graph, URIRef, Literal, BNode, XSD
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from rdflib import Namespace, XSD
 from rdflib.namespace import RDF
 from collections import Counter
 
 from Code.UtilityFunctions.dictionary_functions import flatten_dictionary
-from Code.UtilityFunctions.schema_functions import get_schema_predicate, get_schema_type
+from Code.UtilityFunctions.schema_functions import get_schema_type, load_predicate_table
 from Code.UtilityFunctions.get_iri import get_iri
+from Code.UtilityFunctions.ntriples_functions import get_emitter
+from Code.UtilityFunctions.attribute_functions import AttributeParser
+from Code.UtilityFunctions.shard_functions import newline_aligned_ranges, read_line_range, concatenate_parts
+from Code.UtilityFunctions.output_functions import open_triple_file, output_path, output_options, output_reports
+from Code.UtilityFunctions.checkpoint_functions import ConversionCheckpoint, checkpoint_path
+from Code.UtilityFunctions.diagnostics_functions import DiagnosticsSink
+from Code.UtilityFunctions.metrics_functions import StageMetrics, Progress, metrics_options, stage_metrics
 
 schema = Namespace("https://schema.org/")
 skos = Namespace("https://www.w3.org/2004/02/skos/core#")
@@ -18,66 +27,215 @@ yelpcat = Namespace("https://purl.archive.org/purl/yckg/categories#")
 yelpvoc = Namespace("https://purl.archive.org/purl/yckg/vocabulary#")
 yelpent = Namespace("https://purl.archive.org/purl/yckg/entities#")
 
-def create_nt_file(file_name: str, read_dir: str, write_dir: str):
+def create_nt_file(file_name: str, read_dir: str, write_dir: str, use_rdflib: bool = False, resume: bool = False):
     """
     This function takes as input one of three Yelp JSON files (The tip/checkin files are handled in different functions),
     transforms the objects in that file to RDF format, and writes them to a output file.
     :param file_name: The Yelp JSON file to transform to RDF.
     :param read_dir: The directory to read the Yelp JSON file from.
     :param write_dir: The directory to write the RDF file to.
+    :param use_rdflib: If True, build and serialize an rdflib Graph per record instead of writing the N-Triples lines
+    directly. Slow, but kept as a reference to check the output of the direct emitter against.
+    :param resume: Whether to continue from the checkpoint left by an earlier, interrupted, run.
     :return: a .nt.gz file with Yelp data in RDF format.
     """
     entity_name = file_name[22:-5]  # Either business, user, or review
-    triple_file = gzip.open(filename=os.path.join(write_dir, f"yelp_{entity_name}.nt.gz"), mode="at", encoding="utf-8")
-    file_path = os.path.join(read_dir, file_name)
-    if not os.path.exists("Errors"): os.makedirs("Errors")  # Creates a folder that will contain files with any triples that threw an error.
-    
-    # Lists for keeping track of errors
-    none_triples = []
-    error_triples = []
+    convert_json_range(file_name=file_name,
+                       read_dir=read_dir,
+                       triple_file_path=os.path.join(write_dir, f"yelp_{entity_name}.nt.gz"),
+                       use_rdflib=use_rdflib,
+                       resume=resume)
 
-    with open(file=file_path, mode="r") as file:
+
+def create_nt_file_sharded(file_name: str, read_dir: str, write_dir: str, workers: int, concatenate: bool = False,
+                           resume: bool = False):
+    """
+    Parallel version of create_nt_file. The Yelp JSON file is split into one newline-aligned byte range per worker, and
+    each range is converted in its own process to a part file yelp_<entity>.part<n>.nt.gz.
+    The type triples of the Yelp categories are not written by the workers, as each worker would only deduplicate the
+    categories it has seen itself. Instead the workers return their categories, and the type triples are written once to
+    an extra, last, part.
+    :param file_name: The Yelp JSON file to transform to RDF.
+    :param read_dir: The directory to read the Yelp JSON file from.
+    :param write_dir: The directory to write the RDF files to.
+    :param workers: The number of processes to convert the file with.
+    :param concatenate: Whether to concatenate the parts into yelp_<entity>.nt.gz, the file written by create_nt_file.
+    :param resume: Whether to continue every part from the checkpoint left by an earlier, interrupted, run.
+    :return: The paths of the part files, or of the concatenated file.
+    """
+    entity_name = file_name[22:-5]
+    load_predicate_table(os.path.join(read_dir, file_name), read_dir)  # Inferred once here, the workers load it from the cache.
+    byte_ranges = newline_aligned_ranges(os.path.join(read_dir, file_name), workers)
+    part_paths = [output_path(os.path.join(write_dir, f"yelp_{entity_name}.part{shard:03d}.nt.gz"))
+                  for shard in range(len(byte_ranges) + 1)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(convert_json_range,
+                                   file_name=file_name,
+                                   read_dir=read_dir,
+                                   triple_file_path=part_paths[shard],
+                                   start=start,
+                                   end=end,
+                                   bnode_prefix=f"{entity_name}_{shard}_",  # Blank node labels must differ between the parts.
+                                   error_suffix=f"_part{shard:03d}",
+                                   write_categories=False,
+                                   mode="wt",
+                                   codec=output_options["codec"],  # Passed on, as the workers may not share our globals.
+                                   level=output_options["level"],
+                                   resume=resume,
+                                   profile_dir=metrics_options["profile_dir"])
+                   for shard, (start, end) in enumerate(byte_ranges)]
+        results = [future.result() for future in futures]
+
+    categories = set().union(*(shard_categories for shard_categories, _, _ in results))
+    output_reports.extend(report for _, report, _ in results if report is not None)  # Parts done in an earlier run have none.
+    stage_metrics.extend(metrics for _, _, metrics in results if metrics is not None)
+
+    emitter = get_emitter()
+    with open_triple_file(part_paths[-1], mode="wt") as triple_file:
+        for category in sorted(categories):
+            emitter.add((emitter.term(yelpcat + category),
+                         emitter.term(RDF.type),
+                         emitter.term(yelpvoc + "YelpCategory")))
+        triple_file.write(emitter.serialize())
+
+    if concatenate:
+        triple_file_path = output_path(os.path.join(write_dir, f"yelp_{entity_name}.nt.gz"))
+        concatenate_parts(part_paths, triple_file_path)
+        for part_path in part_paths[:-1]:  # The parts are gone, so their checkpoints can no longer be resumed from.
+            os.remove(checkpoint_path(part_path))
+        return [triple_file_path]
+
+    return part_paths
+
+
+def convert_json_range(file_name: str, read_dir: str, triple_file_path: str, start: int = 0, end: int = None,
+                       bnode_prefix: str = None, error_suffix: str = "", write_categories: bool = True,
+                       use_rdflib: bool = False, mode: str = "wt", codec: str = None, level: int = None,
+                       resume: bool = False, only_offsets: np.ndarray = None, profile_dir: str = None):
+    """
+    Transforms the objects of one of the three Yelp JSON files handled by create_nt_file that start within the byte range
+    [start, end) to RDF format, and writes them to triple_file_path.
+    :param file_name: The Yelp JSON file to transform to RDF.
+    :param read_dir: The directory to read the Yelp JSON file from.
+    :param triple_file_path: The .nt.gz file to write the triples to.
+    :param start: The byte offset of the first object to transform. Must be the start of a line.
+    :param end: The byte offset to stop at. The whole rest of the file is transformed if None.
+    :param bnode_prefix: Prefix for the blank node labels. Defaults to the entity name.
+    :param error_suffix: Suffix for the names of the files the skipped and failed values are written to.
+    :param write_categories: Whether to write the rdf:type triple of every new Yelp category.
+    :param use_rdflib: If True, serialize the triples through an rdflib Graph, as a reference for the direct emitter.
+    :param mode: The mode to open triple_file_path with. A resumed conversion always appends to the truncated file.
+    :param codec: The codec to compress the triples with, see open_triple_file.
+    :param level: The compression level.
+    :param resume: Whether to continue from the checkpoint left by an earlier, interrupted, run.
+    :param only_offsets: If given, only the objects whose lines start at these byte offsets, sorted in ascending order,
+    are transformed.
+    :param profile_dir: If given, the conversion is profiled with cProfile, see StageMetrics.
+    :return: The set of Yelp categories seen in the range, the report of the triple file and the metrics of the
+    conversion (both None if the range was already done in an earlier run).
+    """
+    entity_name = file_name[22:-5]  # Either business, user, or review
+    emitter = get_emitter(use_rdflib=use_rdflib, bnode_prefix=bnode_prefix or entity_name)
+    file_path = os.path.join(read_dir, file_name)
+    category_cache = set()  # Cache for categories to avoid triple duplicates.
+    get_predicate = load_predicate_table(file_path, read_dir).lookup  # Maps the keys to predicates and datatypes.
+    attribute_parser = AttributeParser(emitter)  # Parses and renders the nested attributes, like BusinessParking.
+
+    # Continue from the last checkpoint, truncating anything written to the triple file after it.
+    checkpoint = ConversionCheckpoint(output_path(triple_file_path, codec), file_path, resume=resume)
+    records = checkpoint.records
+    resumed = checkpoint.resumed
+    if resumed:
+        category_cache = set(checkpoint.extra["categories"])
+        if checkpoint.complete:
+            return category_cache, None, None
+        start, mode = checkpoint.input_offset, "at"
+        emitter.bnodes = checkpoint.extra["bnodes"]
+        checkpoint.prepare_output()
+    next_offset = start
+
+    # The lines are read in file order, so the next offset to transform is found with a cursor into the sorted offsets.
+    if only_offsets is not None:
+        only_offsets = np.asarray(only_offsets, dtype=np.int64)
+        cursor = int(np.searchsorted(only_offsets, start))
+        wanted = int(only_offsets[cursor]) if cursor < len(only_offsets) else None
+
+    triple_file = open_triple_file(triple_file_path, mode=mode, codec=codec, level=level)
+    metrics = StageMetrics(f"convert_{entity_name}{error_suffix}", profile_dir).start()
+    progress = Progress(f"{entity_name}{error_suffix}", start, end if end is not None else os.path.getsize(file_path))
+    first_record = records
+    clock = time.perf_counter
+    decode_seconds = build_seconds = write_seconds = 0.0
+
+    # Keeps track of the skipped values and the errors. When resuming, it continues from the checkpoint.
+    diagnostics = DiagnosticsSink(f"{entity_name}{error_suffix}", mode="at" if resumed else "wt",
+                                  state=checkpoint.extra.get("diagnostics"))
+
+    with open(file=file_path, mode="rb") as file:
 
         # Creates the URLs which we link to
         if file_name == "yelp_academic_dataset_business.json":
             url = business_uri
         elif file_name == 'yelp_academic_dataset_user.json':
             url = user_uri
-            
-        category_cache = set()  # Cache for categories to avoid triple duplicates.
+
+        # Terms that are the same for every object are rendered once.
+        rdf_type = emitter.term(RDF.type)
+        url_predicate = emitter.term(schema + 'url')
+        author_predicate = emitter.term(schema + "author")
+        keywords_predicate = emitter.term(schema + "keywords")
+        category_class = emitter.term(yelpvoc + "YelpCategory")
+        subject_class = emitter.term(get_schema_type(entity_name))  # get_schema_type returns the schema type for the entity.
+        subject_prefix = get_iri(file_name)  # get_iri makes sure the ID is a proper IRI.
 
         # Iterate over every object in the JSON file as each object is one line.
-        for line in file:
+        for offset, line in read_line_range(file, start, end):
+            if only_offsets is not None:
+                if wanted is None:
+                    break
+                if offset != wanted:
+                    continue
+                cursor += 1
+                wanted = int(only_offsets[cursor]) if cursor < len(only_offsets) else None
+            if checkpoint.due(records):
+                checkpoint.save(triple_file, offset, records,
+                                extra={"bnodes": emitter.bnodes, "categories": sorted(category_cache),
+                                       "diagnostics": diagnostics.state()})
+            if records % 1000 == 0:
+                progress.update(offset, records - first_record)
+            records += 1
+            next_offset = offset + len(line)
+
             try:
+                started = clock()
                 line = json.loads(line)  # json.loads loads the JSON object into a dictionary.
+                decoded = clock()
 
                 # If the file is reviews, the URL depends on the line being iterated over.
                 if file_name == 'yelp_academic_dataset_review.json':
                     url = business_uri + line['business_id'] + '?hrid='
 
-                G = Graph()  # Initialize an empty graph object to write triples to.
-
-                json_key = list(line.keys())[0]  # Each dictionary has the ID as the value to the first key
-                subject = get_iri(file_name) + line[json_key]  # get_iri makes sure the ID is a proper IRI.
-                subjectURI = URIRef(subject)
-                subject_class = get_schema_type(entity_name) #get_schema_type returns the schema type for the entity.
+                json_key = next(iter(line))  # Each dictionary has the ID as the value to the first key
+                subject = subject_prefix + line[json_key]
+                subjectURI = emitter.uri(subject)
 
-                G.add(triple=(subjectURI,
-                            RDF.type,
-                            URIRef(subject_class)))     
+                emitter.add((subjectURI,
+                             rdf_type,
+                             subject_class))
 
-                G.add(triple=(subjectURI,  
-                              URIRef(schema + 'url'),  
-                              URIRef(url + line[json_key])))  
+                emitter.add((subjectURI,
+                             url_predicate,
+                             emitter.uri(url + line[json_key])))
                 
                 del line[json_key]  # After assigning the IRI to the subject variable, we no longer need the first key/value pair
 
                 # For reviews create a special triple making a connection between user and the review.
                 if file_name == "yelp_academic_dataset_review.json":
-                    G.add(triple=(subjectURI,
-                                  URIRef(schema + "author"),
-                                  URIRef(yelpent + 'user_id/' + line["user_id"])
-                                  ))
+                    emitter.add((subjectURI,
+                                 author_predicate,
+                                 emitter.uri(yelpent + 'user_id/' + line["user_id"])
+                                 ))
                     del line["user_id"]  # No longer need the this key/value pair.
 
                 line = flatten_dictionary(line)  # Some values are dictionaries themselves, so we flatten them before proceeding
@@ -92,54 +250,52 @@ def create_nt_file(file_name: str, read_dir: str, write_dir: str):
                             # Need to replace special characters as we use it as IRI.
                             category = category.replace(' ', '_').replace("&", "_").replace("/", "_").replace("'", "_").replace("-", "_").replace("(", "_").replace(")", "_")
 
-                            G.add(triple=(
+                            emitter.add((
                                 subjectURI,
-                                URIRef(schema + "keywords"),
-                                URIRef(yelpcat + category)
+                                keywords_predicate,
+                                emitter.term(yelpcat + category)
                                 ))
 
-                            if category not in category_cache:
-                                G.add(triple=(
-                                    URIRef(yelpcat + category),
-                                    RDF.type,
-                                    URIRef(yelpvoc + "YelpCategory")
+                            if category not in category_cache and write_categories:
+                                emitter.add((
+                                    emitter.term(yelpcat + category),
+                                    rdf_type,
+                                    category_class
                                     ))
                                 
-                                category_cache.add(category)
+                            category_cache.add(category)
                 
                 # Now we iterate over the rest of the key/value pairs and transform them to RDF format.
                 for _predicate, _object in line.items():
-                    if _object in ("None", None, "none", "null", "Null", "NULL", ""): # Some values are None, add to them a list, and skip them.
-                        none_triples.append((subject, _predicate, _object))
+                    if _object in ("None", None, "none", "null", "Null", "NULL", ""): # Some values are None, record them, and skip them.
+                        diagnostics.none_value(subject, _predicate, _object)
                         continue
                     # Some values are dictionaries, which needs to be handled differently.
                     elif isinstance(_object, dict) or _predicate in ("BusinessParking", "GoodForMeal", "Ambience", "Music", "BestNights", "HairSpecializesIn", "DietaryRestrictions"):
-                        if isinstance(_object, str):
-                            _object = _object.replace("'", '"').replace("None", "null").replace('u"', '"').replace("True", "true").replace("False", "false") 
-                            _object = json.loads(_object)
-                        
-                        predicate, object_type = get_schema_predicate(_predicate, _object, file_name)
-                        b_node = BNode()
+                        attribute_pairs = attribute_parser.pairs(_object)
+                        predicate, object_type = get_predicate(_predicate, _object)
+                        b_node = emitter.bnode()
 
-                        G.add(triple=(subjectURI,
-                                      URIRef(predicate),  
-                                      b_node))  
+                        emitter.add((subjectURI,
+                                     emitter.term(predicate),
+                                     b_node))
 
                         blanknode_class = get_schema_type(_predicate)
 
-                        G.add(triple=(b_node,
-                                      RDF.type,
-                                      URIRef(blanknode_class)))
+                        emitter.add((b_node,
+                                     rdf_type,
+                                     emitter.term(blanknode_class)))
 
-                        for sub_predicate, sub_object in _object.items():
-                            G.add(triple=(b_node,
-                                          URIRef(yelpvoc + "has" + sub_predicate),
-                                          Literal(sub_object)))
+                        for sub_predicate, sub_object in attribute_pairs:
+                            emitter.add((b_node,
+                                         sub_predicate,
+                                         sub_object))
                             
                     elif _predicate in ["date", "friends", "elite"]:  # The values to these keys contains listed objects
                         obj_lst = _object.split(", ") if _predicate != "elite" else _object.split(",")  # Splits the listed objects
 
-                        predicate, object_type = get_schema_predicate(_predicate, _object, file_name)
+                        predicate, object_type = get_predicate(_predicate, _object)
+                        predicate = emitter.term(predicate)
                         if obj_lst:
                             for obj in obj_lst:
                                 if _predicate == "date":
@@ -147,73 +303,118 @@ def create_nt_file(file_name: str, read_dir: str, write_dir: str):
                                 
                                 if _predicate == "friends":
                                     obj = yelpent + 'user_id/' + obj  
-                                    G.add(triple=(subjectURI,
-                                              URIRef(predicate),
-                                              URIRef(obj)))
+                                    emitter.add((subjectURI,
+                                                 predicate,
+                                                 emitter.uri(obj)))
                                 
                                 else:
-                                    G.add(triple=(subjectURI,
-                                                URIRef(predicate),
-                                                Literal(obj, datatype=object_type)))
+                                    emitter.add((subjectURI,
+                                                 predicate,
+                                                 emitter.literal(obj, datatype=object_type)))
                     
                                         
                     elif _predicate == "business_id":  # If we are dealing with a reivew, we add a link to the business
-                        predicate, object_type = get_schema_predicate(_predicate, _object, file_name)
+                        predicate, object_type = get_predicate(_predicate, _object)
                         obj = yelpent + 'business_id/' + _object
                         
-                        G.add(triple=(subjectURI,
-                                      URIRef(predicate),
-                                      URIRef(obj)))
+                        emitter.add((subjectURI,
+                                     emitter.term(predicate),
+                                     emitter.uri(obj)))
 
                     elif type(_object) in (str, int, float, bool):
                         if _predicate == "yelping_since":
                             _object = _object.replace(" ", "T")
 
-                        predicate, object_type = get_schema_predicate(_predicate, _object, file_name)
-                        G.add(triple=(subjectURI,
-                                      URIRef(predicate),
-                                      Literal(_object, datatype=object_type)))
+                        predicate, object_type = get_predicate(_predicate, _object)
+                        emitter.add((subjectURI,
+                                     emitter.term(predicate),
+                                     emitter.literal(_object, datatype=object_type)))
                                             
                     else:
-                        error_triples.append((subject, _predicate, _object))   
+                        diagnostics.unhandled_value(subject, _predicate, _object)
+
+                built = clock()
+                triple_file.write(emitter.serialize())  # Writes to the .nt file the triples of the object.
+                written = clock()
 
-                triple_file.write(
-                    G.serialize(format='nt'))  # Writes to the .nt file the graph now containing a RDF triple.
+                decode_seconds += decoded - started
+                build_seconds += built - decoded
+                write_seconds += written - built
 
             except Exception as e:
-                print(e)
-                print(line)
+                emitter.discard()  # Drops the triples of the object that failed halfway.
+                diagnostics.exception(e, line)
 
+    checkpoint.save(triple_file, next_offset, records,
+                    extra={"bnodes": emitter.bnodes, "categories": sorted(category_cache),
+                           "diagnostics": diagnostics.state()}, complete=True)
     triple_file.close()
-    
-    with open(os.path.join("Code", "Errors", f"none_list_{entity_name}.txt"),"wt") as file:
-        for triple in none_triples:
-            print(triple, file=file)
+    diagnostics.close()
 
-    with open(os.path.join("Code", "Errors", f"error_list_{entity_name}.txt"),"wt") as file:
-        for triple in error_triples:
-            print(triple, file=file)
+    # The write phase includes the compression of the blocks, which is also given on its own.
+    metrics.records, metrics.triples = records - first_record, emitter.triples
+    metrics.bytes_read, metrics.bytes_written = next_offset - start, triple_file.bytes_out
+    for phase, seconds in (("decode", decode_seconds), ("build", build_seconds), ("write", write_seconds),
+                           ("compress", triple_file.compress_seconds)):
+        metrics.add_phase(phase, seconds)
 
+    attribute_statistics = attribute_parser.statistics()
+    if attribute_statistics["hits"] + attribute_statistics["misses"]:
+        print(f"Nested attributes of {entity_name}{error_suffix}: {attribute_statistics['misses']} parsed, "
+              f"{attribute_statistics['hits']} taken from the cache ({attribute_statistics['hit_rate']:.1%})")
 
-def create_checkin_nt_file(read_dir: str, write_dir: str):
+    return category_cache, triple_file.report(), metrics.finish()
+
+
+def create_checkin_nt_file(read_dir: str, write_dir: str, use_rdflib: bool = False, resume: bool = False):
     """Creates a .nt file containing the Checkin data from the Yelp dataset.
-    The checkin json only contains two lines, a business id and a string of dates."""
+    The checkin json only contains two lines, a business id and a string of dates.
+    If use_rdflib is True, the triples are serialized through an rdflib Graph, as a reference for the direct emitter.
+    If resume is True, the conversion continues from the checkpoint left by an earlier, interrupted, run."""
 
     file_name = "yelp_academic_dataset_checkin.json"
     entity_name = file_name[22:-5]
+    emitter = get_emitter(use_rdflib=use_rdflib, bnode_prefix=entity_name)
 
-    triple_file = gzip.open(filename=os.path.join(write_dir, f"yelp_{entity_name}.nt.gz"), mode="at", encoding="utf-8")
+    triple_file_path = output_path(os.path.join(write_dir, f"yelp_{entity_name}.nt.gz"))
     file_path = os.path.join(read_dir, file_name)
 
-    with open(file=file_path, mode="r") as file:
-        for line in file:
+    checkpoint = ConversionCheckpoint(triple_file_path, file_path, resume=resume)
+    if checkpoint.complete:
+        return
+    checkpoint.prepare_output()
+    start = checkpoint.input_offset or 0
+    records = checkpoint.records
+    emitter.bnodes = checkpoint.extra.get("bnodes", 0)
+    next_offset = start
+
+    # Only a resumed conversion appends, to the output truncated to the checkpoint. Otherwise it starts over.
+    triple_file = open_triple_file(triple_file_path, mode="at" if checkpoint.resumed else "wt")
+    diagnostics = DiagnosticsSink(entity_name, mode="at" if checkpoint.resumed else "wt", state=checkpoint.extra.get("diagnostics"))
+    metrics = StageMetrics(f"convert_{entity_name}").start()
+    progress = Progress(entity_name, start, os.path.getsize(file_path))
+    first_record = records
+
+    object_predicate = emitter.term(schema + "object")
+    rdf_type = emitter.term(RDF.type)
+    arrive_action = emitter.term(schema + "ArriveAction")
+    start_time_predicate = emitter.term(schema + 'startTime')
+    statistic_predicate = emitter.term(schema + 'interactionStatistic')
+
+    with open(file=file_path, mode="rb") as file:
+        for offset, line in read_line_range(file, start):
+            if checkpoint.due(records):
+                checkpoint.save(triple_file, offset, records, extra={"bnodes": emitter.bnodes, "diagnostics": diagnostics.state()})
+            if records % 1000 == 0:
+                progress.update(offset, records - first_record)
+            records += 1
+            next_offset = offset + len(line)
+
             try:
                 line = json.loads(line)
 
-                G = Graph()  
-
-                json_key = list(line.keys())[0]  # Each dictionary has the ID as the value to the first key, in this case the business id
-                business = get_iri(file_name) + line[json_key]  # get_iri makes sure the businnes_id is a valid IRI
+                json_key = next(iter(line))  # Each dictionary has the ID as the value to the first key, in this case the business id
+                business = emitter.uri(get_iri(file_name) + line[json_key])  # get_iri makes sure the businnes_id is a valid IRI
 
                 dates = line["date"].split(", ")  # The date key contains a list of dates, which we split
 
@@ -224,65 +425,104 @@ def create_checkin_nt_file(read_dir: str, write_dir: str):
 
                 for date, count in date_counter.items():
                     
-                    b_node = BNode()
+                    b_node = emitter.bnode()
         
-                    G.add(triple=(b_node,
-                                  URIRef(schema + "object"),
-                                  URIRef(business)))
+                    emitter.add((b_node,
+                                 object_predicate,
+                                 business))
                     
-                    G.add(triple=(b_node,
-                                  RDF.type,
-                                  URIRef(schema + "ArriveAction")))
+                    emitter.add((b_node,
+                                 rdf_type,
+                                 arrive_action))
                     
-                    G.add(triple=(b_node,
-                                  URIRef(schema + 'startTime'),
-                                  Literal(date, datatype=XSD.dateTime)))
+                    emitter.add((b_node,
+                                 start_time_predicate,
+                                 emitter.literal(date, datatype=XSD.dateTime)))
                     
-                    G.add(triple=(b_node,
-                                 URIRef(schema + 'interactionStatistic'),
-                                 Literal(count, datatype=XSD.integer)))
+                    emitter.add((b_node,
+                                 statistic_predicate,
+                                 emitter.literal(count, datatype=XSD.integer)))
                     
-                triple_file.write(G.serialize(format='nt'))  # Writes to the .nt file the graph now containing a RDF triple
+                triple_file.write(emitter.serialize())  # Writes to the .nt file the triples of the checkins
 
             except Exception as e:
-                print(e)
+                emitter.discard()
+                diagnostics.exception(e, line)
 
+    checkpoint.save(triple_file, next_offset, records, extra={"bnodes": emitter.bnodes, "diagnostics": diagnostics.state()},
+                    complete=True)
     triple_file.close()
+    diagnostics.close()
 
+    metrics.records, metrics.triples = records - first_record, emitter.triples
+    metrics.bytes_read, metrics.bytes_written = next_offset - start, triple_file.bytes_out
+    metrics.add_phase("compress", triple_file.compress_seconds)
+    metrics.finish()
 
-def create_tip_nt_file(read_dir: str, write_dir: str):
+
+def create_tip_nt_file(read_dir: str, write_dir: str, use_rdflib: bool = False, resume: bool = False):
     """
     Special case of the create_nt_file function. This function transforms the tip JSON file to RDF format.
+    :param use_rdflib: If True, serialize the triples through an rdflib Graph, as a reference for the direct emitter.
+    :param resume: Whether to continue from the checkpoint left by an earlier, interrupted, run.
     :return: A .nt.gz file with Yelp tip data in RDF format.
     """
 
     file_name = "yelp_academic_dataset_tip.json"
     entity_name = file_name[22:-5]
+    emitter = get_emitter(use_rdflib=use_rdflib, bnode_prefix=entity_name)
 
-    triple_file = gzip.open(filename=os.path.join(write_dir, f"yelp_{entity_name}.nt.gz"), mode="at", encoding="utf-8")
+    triple_file_path = output_path(os.path.join(write_dir, f"yelp_{entity_name}.nt.gz"))
     file_path = os.path.join(read_dir, file_name)
 
-    with open(file=file_path, mode="r") as file:
-        for line in file:
+    checkpoint = ConversionCheckpoint(triple_file_path, file_path, resume=resume)
+    if checkpoint.complete:
+        return
+    checkpoint.prepare_output()
+    start = checkpoint.input_offset or 0
+    records = checkpoint.records
+    emitter.bnodes = checkpoint.extra.get("bnodes", 0)
+    next_offset = start
+
+    # Only a resumed conversion appends, to the output truncated to the checkpoint. Otherwise it starts over.
+    triple_file = open_triple_file(triple_file_path, mode="at" if checkpoint.resumed else "wt")
+    diagnostics = DiagnosticsSink(entity_name, mode="at" if checkpoint.resumed else "wt", state=checkpoint.extra.get("diagnostics"))
+    metrics = StageMetrics(f"convert_{entity_name}").start()
+    progress = Progress(entity_name, start, os.path.getsize(file_path))
+    first_record = records
+    get_predicate = load_predicate_table(file_path, read_dir).lookup
+
+    author_predicate = emitter.term(schema + "author")
+    rdf_type = emitter.term(RDF.type)
+    tip_class = emitter.term(yelpvoc + 'Tip')
+
+    with open(file=file_path, mode="rb") as file:
+        for offset, line in read_line_range(file, start):
+            if checkpoint.due(records):
+                checkpoint.save(triple_file, offset, records, extra={"bnodes": emitter.bnodes, "diagnostics": diagnostics.state()})
+            if records % 1000 == 0:
+                progress.update(offset, records - first_record)
+            records += 1
+            next_offset = offset + len(line)
+
             try:
                 line = json.loads(line)
-                G = Graph()
-                b_node = BNode()
+                b_node = emitter.bnode()
                 user = line["user_id"]                
                 del line["user_id"]
 
                 # Creates the edge between a user and their tip
-                G.add(triple=(b_node,
-                              URIRef(schema + "author"),
-                              URIRef(yelpent + 'user_id/' + user)))
+                emitter.add((b_node,
+                             author_predicate,
+                             emitter.uri(yelpent + 'user_id/' + user)))
 
                 # Assigns a RDF type to the blank node.
-                G.add(triple=(b_node,
-                              RDF.type,
-                              URIRef(yelpvoc + 'Tip')))
+                emitter.add((b_node,
+                             rdf_type,
+                             tip_class))
 
                 for _predicate, _object in line.items():
-                    predicate, object_type = get_schema_predicate(_predicate, _object, file_name)
+                    predicate, object_type = get_predicate(_predicate, _object)
 
                     if _predicate == "date":
                         obj = _object.replace(" ", "T")
@@ -291,15 +531,23 @@ def create_tip_nt_file(read_dir: str, write_dir: str):
                     else:
                         obj = _object
 
-                    G.add(triple=(b_node,
-                                  URIRef(predicate),
-                                  Literal(obj, datatype=object_type)))
+                    emitter.add((b_node,
+                                 emitter.term(predicate),
+                                 emitter.literal(obj, datatype=object_type)))
 
-                triple_file.write(G.serialize(format="nt"))
+                triple_file.write(emitter.serialize())
 
             except Exception as e:
-                print(e)
-                print(b_node, _predicate, _object)
+                emitter.discard()
+                diagnostics.exception(e, line)
 
+    checkpoint.save(triple_file, next_offset, records, extra={"bnodes": emitter.bnodes, "diagnostics": diagnostics.state()},
+                    complete=True)
     triple_file.close()
+    diagnostics.close()
+
+    metrics.records, metrics.triples = records - first_record, emitter.triples
+    metrics.bytes_read, metrics.bytes_written = next_offset - start, triple_file.bytes_out
+    metrics.add_phase("compress", triple_file.compress_seconds)
+    metrics.finish()
     
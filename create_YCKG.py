@@ -1,52 +1,131 @@
 import os
 import argparse
 
-from Code.create_yelp_nt_files import create_nt_file, create_checkin_nt_file, create_tip_nt_file
-from Code.create_schema_nt_files import create_schema_hierarchy_file, create_schema_mappings_file
+from Code.create_yelp_nt_files import create_nt_file, create_nt_file_sharded, create_checkin_nt_file, create_tip_nt_file
+from Code.create_delta_nt_files import create_delta_nt_file, update_manifest
+from Code.create_schema_nt_files import create_schema_hierarchy_file, create_schema_mappings_file, create_inferred_types_file
 from Code.KnowledgeGraphEnrichment.create_schema_wiki_mapping import create_yelp_wiki_mapping
 from Code.KnowledgeGraphEnrichment.location_from_wikidata import create_locations_nt
+from Code.UtilityFunctions.output_functions import set_output_codec, output_reports
+from Code.UtilityFunctions.metrics_functions import StageMetrics, set_metrics_options, write_metrics
+from Code.UtilityFunctions.wikidata_functions import set_wikidata_options, response_cache, search_client
+from Code.UtilityFunctions.cache_functions import cache_path
 
 parser = argparse.ArgumentParser()
 
 parser.add_argument('--read_dir', type=str, help='Your directory to read data from')
 parser.add_argument('--write_dir', type=str, help='Your directory to write data to')
 parser.add_argument('--include_schema', type=bool, help='Whether to include Schema links in the YKCG')
+parser.add_argument('--materialize_types', type=bool, help='Whether to also write the Schema types of every business, inferred from its categories and the Schema hierarchy, with --include_schema')
 parser.add_argument('--include_wikidata', type=bool, help='Whether to include Wikidata links in the YKCG')
+parser.add_argument('--workers', type=int, default=1, help='The number of processes to convert the business, user and review files with')
+parser.add_argument('--concatenate', type=bool, help='Whether to concatenate the part files written when --workers is above 1')
+parser.add_argument('--codec', type=str, default='gzip', choices=['gzip', 'pgzip', 'zstd', 'lz4', 'none'], help='The codec to compress the triple files with')
+parser.add_argument('--compression_level', type=int, help='The compression level of the codec')
+parser.add_argument('--resume', type=bool, help='Whether to continue from the checkpoints left by an earlier, interrupted, run')
+parser.add_argument('--manifest_dir', type=str, help='Your directory to keep the manifests of the business, user and review files in, used by --delta')
+parser.add_argument('--delta', type=bool, help='Whether to only write add/delete patches for the business, user and review files against the previous build')
+parser.add_argument('--profile', type=bool, help='Whether to profile every stage with cProfile, the statistics are written to <write_dir>/profiles')
+parser.add_argument('--wikidata_cache', type=str, help='The SQLite file to cache the Wikidata responses in, defaults to .yckg_cache/wikidata.sqlite in the read_dir')
+parser.add_argument('--wikidata_cache_days', type=float, default=30, help='The number of days a cached Wikidata response is used')
+parser.add_argument('--offline', type=bool, help='Whether to answer every Wikidata call from the cache, failing on calls that are not in it')
+parser.add_argument('--sparql_endpoint', type=str, help='The SPARQL endpoint to use instead of the Wikidata Query Service')
+parser.add_argument('--api_endpoint', type=str, help='The MediaWiki API to use instead of the one of Wikidata')
+parser.add_argument('--requests_per_second', type=float, default=5.0, help='The maximum rate of Wikidata searches')
+parser.add_argument('--search_workers', type=int, default=4, help='The number of Wikidata searches sent at the same time')
+parser.add_argument('--location_index', type=str, help='The location index built from a Wikidata dump with Code/KnowledgeGraphEnrichment/location_index.py, to resolve the locations without calling Wikidata')
 
-args = parser.parse_args()
-
-read_dir = args.read_dir
-write_dir = args.write_dir
-include_schema = args.include_schema
-include_wikidata = args.include_wikidata
-
-if not os.path.exists(write_dir): os.makedirs(write_dir)  # Creates a folder that will contain the YCKG .nt.gz files
-
-files = [
-        'yelp_academic_dataset_business.json',
-        'yelp_academic_dataset_user.json',
-        'yelp_academic_dataset_review.json'
-    ]
-
-for file in files:
-    create_nt_file(file_name=file, read_dir=read_dir, write_dir=write_dir)
-    print("Finished creating NT file for " + file)
-
-create_checkin_nt_file(read_dir=read_dir, write_dir=write_dir)
-print("Finished creating Checkin NT file")
-create_tip_nt_file(read_dir=read_dir, write_dir=write_dir)
-print("Finished creating all Yelp NT files")
-
-# # Creates the Schema triple files
-if include_schema:
-    create_schema_hierarchy_file(read_dir=read_dir, write_dir=write_dir)
-    print("Finished creating Schema Hierarchy NT file")
-    create_schema_mappings_file(read_dir=read_dir, write_dir=write_dir)
-    print("Finished creating Schema Mappings NT file")
-
-# Creates the Wikidata triple files
-if include_wikidata:
-    create_yelp_wiki_mapping(read_dir=read_dir, write_dir=write_dir)
-    print("Finished creating Wikidata Mapping NT file")
-    create_locations_nt(read_dir=read_dir, write_dir=write_dir)
-    print("Finished creating Wikidata location NT file")
+# The guard is needed as the worker processes started by --workers may import this module.
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    read_dir = args.read_dir
+    write_dir = args.write_dir
+    include_schema = args.include_schema
+    include_wikidata = args.include_wikidata
+    workers = args.workers
+    concatenate = args.concatenate
+    resume = args.resume
+    manifest_dir = args.manifest_dir
+    delta = args.delta
+
+    if delta and not manifest_dir: parser.error("--delta needs the --manifest_dir of the previous build")
+
+    set_output_codec(codec=args.codec, level=args.compression_level)
+
+    if not os.path.exists(write_dir): os.makedirs(write_dir)  # Creates a folder that will contain the YCKG .nt.gz files
+
+    if args.profile:
+        set_metrics_options(profile_dir=os.path.join(write_dir, "profiles"))
+
+    set_wikidata_options(sparql_endpoint=args.sparql_endpoint,
+                         api_endpoint=args.api_endpoint,
+                         cache_path=args.wikidata_cache or cache_path(read_dir, "wikidata.sqlite"),
+                         ttl=args.wikidata_cache_days * 24 * 3600,
+                         offline=args.offline,
+                         requests_per_second=args.requests_per_second,
+                         search_workers=args.search_workers)
+
+    files = [
+            'yelp_academic_dataset_business.json',
+            'yelp_academic_dataset_user.json',
+            'yelp_academic_dataset_review.json'
+        ]
+
+    for file in files:
+        stage = StageMetrics(file[22:-5]).start()  # The business, user or review stage.
+        if delta:
+            counts = create_delta_nt_file(file_name=file, read_dir=read_dir, write_dir=write_dir, manifest_dir=manifest_dir)
+            print(f"Finished creating delta NT files for {file}: {counts['added']} added, {counts['changed']} changed, {counts['deleted']} deleted")
+        else:
+            if workers > 1:
+                create_nt_file_sharded(file_name=file, read_dir=read_dir, write_dir=write_dir, workers=workers, concatenate=concatenate, resume=resume)
+            else:
+                create_nt_file(file_name=file, read_dir=read_dir, write_dir=write_dir, resume=resume)
+            print("Finished creating NT file for " + file)
+
+            if manifest_dir:  # Lets the next snapshot be built with --delta
+                update_manifest(file_name=file, read_dir=read_dir, manifest_dir=manifest_dir)
+        stage.finish()
+
+    with StageMetrics("checkin"):
+        create_checkin_nt_file(read_dir=read_dir, write_dir=write_dir, resume=resume)
+    print("Finished creating Checkin NT file")
+    with StageMetrics("tip"):
+        create_tip_nt_file(read_dir=read_dir, write_dir=write_dir, resume=resume)
+    print("Finished creating all Yelp NT files")
+
+    # # Creates the Schema triple files
+    if include_schema:
+        with StageMetrics("schema_hierarchy"):
+            create_schema_hierarchy_file(read_dir=read_dir, write_dir=write_dir)
+        print("Finished creating Schema Hierarchy NT file")
+        with StageMetrics("schema_mappings"):
+            create_schema_mappings_file(read_dir=read_dir, write_dir=write_dir)
+        print("Finished creating Schema Mappings NT file")
+        if args.materialize_types:
+            with StageMetrics("inferred_types"):
+                counts = create_inferred_types_file(read_dir=read_dir, write_dir=write_dir)
+            print(f"Finished creating inferred types NT file: {counts['triples']} types of {counts['businesses']} businesses")
+
+    # Creates the Wikidata triple files
+    if include_wikidata:
+        with StageMetrics("wiki_mapping"):
+            create_yelp_wiki_mapping(read_dir=read_dir, write_dir=write_dir)
+        print("Finished creating Wikidata Mapping NT file")
+        with StageMetrics("locations"):
+            create_locations_nt(read_dir=read_dir, write_dir=write_dir, resume=resume, location_index=args.location_index)
+        print("Finished creating Wikidata location NT file")
+
+        statistics = response_cache().statistics()
+        print(f"Wikidata cache: {statistics['hits']} hits, {statistics['misses']} misses, {statistics['entries']} responses stored")
+        statistics = search_client().statistics()
+        print(f"Wikidata searches: {statistics['requests']} requests, {statistics['retries']} retried, "
+              f"median latency {statistics['latency_p50']} s")
+
+    for report in output_reports:
+        print(f"{report['path']}: {report['bytes_in']} bytes written as {report['bytes_out']} bytes with {report['codec']}, "
+              f"{report['compress_seconds']} seconds compressing")
+
+    # Throughput, memory and phase timings of every stage.
+    write_metrics(os.path.join(write_dir, "yckg_metrics.json"))
@@ -0,0 +1,34 @@
+import json
+import os
+import sys
+
+import pytest
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+from Code.Benchmarks.synthetic_yelp import generate_synthetic_yelp
+
+
+@pytest.fixture(scope="session")
+def synthetic_yelp(tmp_path_factory):
+    """A small synthetic Yelp dataset, with the CSV files of the Schema stages, shared by all tests."""
+    read_dir = tmp_path_factory.mktemp("yelp")
+    generate_synthetic_yelp(str(read_dir), businesses=40, seed=1, utility_dir=os.path.join(root_dir, "UtilityData"))
+
+    # The checkins are cut to 100 dates per business, as comparing graphs with many similar blank nodes is slow.
+    checkin_path = os.path.join(read_dir, "yelp_academic_dataset_checkin.json")
+    with open(checkin_path, mode="rt", encoding="utf-8") as file:
+        checkins = [json.loads(line) for line in file]
+    with open(checkin_path, mode="wt", encoding="utf-8") as file:
+        for checkin in checkins:
+            checkin["date"] = ", ".join(checkin["date"].split(", ")[:100])
+            file.write(json.dumps(checkin) + "\n")
+    return str(read_dir)
+
+
+@pytest.fixture
+def write_dir(tmp_path, monkeypatch):
+    """An empty output directory, also the working directory, as the error files are written relative to it."""
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path)
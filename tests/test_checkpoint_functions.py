@@ -0,0 +1,92 @@
+import gzip
+import os
+import shutil
+
+import pytest
+
+import Code.create_yelp_nt_files as create_yelp_nt_files
+from Code.create_yelp_nt_files import create_nt_file
+from Code.create_schema_nt_files import create_schema_hierarchy_file, create_schema_mappings_file
+from Code.UtilityFunctions.checkpoint_functions import ConversionCheckpoint
+
+file_name = "yelp_academic_dataset_business.json"
+
+
+class Interrupted(BaseException):
+    """Not an Exception, so the converter does not catch it as a failed record."""
+
+
+@pytest.fixture
+def read_dir(synthetic_yelp, tmp_path):
+    """A copy of the business file, which the tests may touch."""
+    directory = tmp_path / "read"
+    directory.mkdir()
+    shutil.copy(os.path.join(synthetic_yelp, file_name), directory / file_name)
+    return str(directory)
+
+
+def read_lines(write_dir: str) -> list:
+    with gzip.open(os.path.join(write_dir, "yelp_business.nt.gz"), mode="rt", encoding="utf-8") as file:
+        return file.read().splitlines()
+
+
+def convert(read_dir: str, write_dir: str, resume: bool = False, fail_after: int = None, monkeypatch=None):
+    """Converts the business file, with a checkpoint every 7 records, and stops after fail_after objects if given."""
+    with monkeypatch.context() as patch:
+        patch.setattr(ConversionCheckpoint, "due", lambda self, records: records % 7 == 0)
+        if fail_after is not None:
+            flatten, calls = create_yelp_nt_files.flatten_dictionary, []
+
+            def failing_flatten(line):  # Called once for every object.
+                calls.append(line)
+                if len(calls) > fail_after:
+                    raise Interrupted()
+                return flatten(line)
+            patch.setattr(create_yelp_nt_files, "flatten_dictionary", failing_flatten)
+
+        create_nt_file(file_name, read_dir, write_dir, resume=resume)
+
+
+@pytest.fixture
+def expected(read_dir, write_dir, monkeypatch):
+    os.makedirs(os.path.join(write_dir, "expected"))
+    convert(read_dir, os.path.join(write_dir, "expected"), monkeypatch=monkeypatch)
+    return read_lines(os.path.join(write_dir, "expected"))
+
+
+def test_resume_after_interruption_matches_uninterrupted_run(read_dir, write_dir, expected, monkeypatch):
+    with pytest.raises(Interrupted):
+        convert(read_dir, write_dir, fail_after=17, monkeypatch=monkeypatch)
+    convert(read_dir, write_dir, resume=True, monkeypatch=monkeypatch)
+
+    assert read_lines(write_dir) == expected
+
+
+@pytest.mark.parametrize("resume", [False, True])
+def test_rerun_does_not_duplicate_triples(read_dir, write_dir, expected, resume, monkeypatch):
+    for _ in range(2):
+        convert(read_dir, write_dir, resume=resume, monkeypatch=monkeypatch)
+
+    assert read_lines(write_dir) == expected
+
+
+def test_stale_checkpoint_starts_over(read_dir, write_dir, expected, monkeypatch):
+    with pytest.raises(Interrupted):
+        convert(read_dir, write_dir, fail_after=17, monkeypatch=monkeypatch)
+    stat = os.stat(os.path.join(read_dir, file_name))
+    os.utime(os.path.join(read_dir, file_name), (stat.st_atime, stat.st_mtime + 60))  # The input changed since.
+    convert(read_dir, write_dir, resume=True, monkeypatch=monkeypatch)
+
+    assert read_lines(write_dir) == expected
+
+
+@pytest.mark.parametrize("writer, triple_file", [(create_schema_hierarchy_file, "schema_hierarchy.nt.gz"),
+                                                 (create_schema_mappings_file, "yelp_schema_mappings.nt.gz")])
+def test_rerun_does_not_duplicate_schema_triples(synthetic_yelp, write_dir, writer, triple_file):
+    writer(synthetic_yelp, write_dir)
+    with gzip.open(os.path.join(write_dir, triple_file), mode="rt", encoding="utf-8") as file:
+        expected = file.read()
+    writer(synthetic_yelp, write_dir)
+
+    with gzip.open(os.path.join(write_dir, triple_file), mode="rt", encoding="utf-8") as file:
+        assert file.read() == expected
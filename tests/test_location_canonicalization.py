@@ -0,0 +1,65 @@
+import pandas as pd
+
+from Code.KnowledgeGraphEnrichment.location_canonicalization import canonical_cities, city_key, is_typo
+
+
+def businesses(rows) -> pd.DataFrame:
+    # city, state, latitude, longitude, number of businesses
+    return pd.DataFrame([(city, state, latitude, longitude) for city, state, latitude, longitude, count in rows
+                         for _ in range(count)], columns=["city", "state", "latitude", "longitude"])
+
+
+def test_city_key():
+    assert city_key("Philadelphia ") == city_key("PHILADELPHIA") == "philadelphia"
+    assert city_key("St. Louis") == city_key("Saint Louis") == "saint louis"
+
+
+def test_is_typo():
+    assert is_typo("pittsburg", "pittsburgh")
+    assert is_typo("saint petersburg", "saint petersberg")
+    assert not is_typo("newtown", "newton")
+    assert not is_typo("media", "medina")
+    assert not is_typo("newtown square", "newton square")
+    assert not is_typo("glendale", "glendora")
+    assert not is_typo("west chester", "westchester")
+
+
+def test_spellings_are_merged_under_the_most_common_one():
+    biz = businesses([
+        ("Philadelphia", "Pennsylvania", 39.95, -75.16, 5),
+        ("philadelphia ", "Pennsylvania", 39.96, -75.17, 2),
+        ("Pittsburgh", "Pennsylvania", 40.44, -79.99, 3),
+        ("Pittsburg", "Pennsylvania", 40.45, -80.00, 1),
+        ("Saint Louis", "Missouri", 38.63, -90.20, 1),
+        ("St. Louis", "Missouri", 38.62, -90.19, 2),
+    ])
+    canonical = canonical_cities(biz)
+
+    assert canonical.index.equals(biz.index)
+    assert canonical[biz["state"] == "Pennsylvania"].value_counts().to_dict() == {"Philadelphia": 7, "Pittsburgh": 4}
+    assert set(canonical[biz["state"] == "Missouri"]) == {"St. Louis"}
+
+
+def test_nearby_towns_with_similar_names_are_not_merged():
+    biz = businesses([
+        ("Newtown", "Pennsylvania", 40.23, -74.94, 3),
+        ("Newton", "Pennsylvania", 40.20, -75.00, 1),
+        ("Media", "Pennsylvania", 39.92, -75.39, 3),
+        ("Medina", "Pennsylvania", 39.93, -75.40, 1),
+        ("Newtown Square", "Pennsylvania", 39.99, -75.40, 2),
+        ("Newton Square", "Pennsylvania", 39.98, -75.41, 1),
+    ])
+
+    assert canonical_cities(biz).tolist() == biz["city"].tolist()
+
+
+def test_typos_far_apart_or_in_another_state_are_not_merged():
+    biz = businesses([
+        ("Pittsburgh", "Pennsylvania", 40.44, -79.99, 3),
+        ("Pittsburg", "Pennsylvania", 41.50, -77.00, 1),  # Over 25 km away.
+        ("Pittsburg", "California", 38.03, -121.88, 1),
+        ("philadelphia", "New Jersey", 39.95, -75.10, 1),
+        ("Philadelphia", "Pennsylvania", 39.95, -75.16, 1),
+    ])
+
+    assert canonical_cities(biz).tolist() == biz["city"].tolist()
@@ -0,0 +1,82 @@
+import gzip
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import Code.KnowledgeGraphEnrichment.location_from_wikidata as location_from_wikidata
+from Code.KnowledgeGraphEnrichment.location_from_wikidata import create_locations_nt, locations_checkpoint_path
+from Code.KnowledgeGraphEnrichment.location_namespaces import yelpent
+
+
+class Interrupted(BaseException):
+    pass
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Wikidata lookups answered without network access, which record every call."""
+    calls = []
+
+    def lookup(name, answer):
+        def batch(keys):
+            calls.append(name)
+            return {key: answer(key) for key in keys}
+        return batch
+
+    fake = SimpleNamespace(
+        return_city_q_ids_batch=lookup("city_q_ids", lambda string: f"wd:Q{100 + len(string)}"),
+        return_state_q_ids_batch=lookup("state_q_ids", lambda state: f"wd:Q{200 + len(state)}"),
+        qid_city_batch=lookup("city_qid", lambda row: (row[0][3:], f"City {row[0][3:]}")),
+        qid_state_batch=lookup("state_qid", lambda q_ids: (q_ids[3:], f"State {q_ids[3:]}")),
+        qid_return_county_batch=lookup("county_qid", lambda qid: ("Q3", "County")),
+        qid_return_country_batch=lookup("country_qid", lambda qid: ("Q30", "United States")),
+        city_population_batch=lookup("population", lambda qid: 1000))
+    monkeypatch.setattr(location_from_wikidata, "live_lookups", fake)
+    return calls
+
+
+def read_lines(write_dir: str) -> list:
+    with gzip.open(os.path.join(write_dir, "wikidata_location_mappings.nt.gz"), mode="rt", encoding="utf-8") as file:
+        return file.read().splitlines()
+
+
+def test_rerun_replaces_the_triples(synthetic_yelp, write_dir, lookups):
+    create_locations_nt(synthetic_yelp, write_dir)
+    first = read_lines(write_dir)
+    create_locations_nt(synthetic_yelp, write_dir, resume=True)
+
+    assert read_lines(write_dir) == first
+    assert len(first) == len(set(first))
+    assert not os.path.exists(locations_checkpoint_path(write_dir))
+
+
+def test_interrupted_write_keeps_the_lookups(synthetic_yelp, write_dir, lookups, monkeypatch):
+    os.makedirs(os.path.join(write_dir, "expected"))
+    create_locations_nt(synthetic_yelp, os.path.join(write_dir, "expected"))
+    expected = read_lines(os.path.join(write_dir, "expected"))
+    lookups.clear()
+
+    with monkeypatch.context() as patch:
+        render_iris, chunks = location_from_wikidata.render_iris, []
+
+        def failing_render_iris(iris):  # Fails on the second chunk of businesses.
+            if iris.str.startswith(str(yelpent)).any():
+                chunks.append(iris)
+                if len(chunks) > 1:
+                    raise Interrupted()
+            return render_iris(iris)
+        patch.setattr(location_from_wikidata, "render_iris", failing_render_iris)
+
+        with pytest.raises(Interrupted):
+            create_locations_nt(synthetic_yelp, write_dir, chunk_size=10)
+
+    assert os.path.exists(locations_checkpoint_path(write_dir))
+    assert not os.path.exists(os.path.join(write_dir, "wikidata_location_mappings.nt.gz"))
+    looked_up = len(lookups)
+
+    create_locations_nt(synthetic_yelp, write_dir, resume=True)
+
+    assert len(lookups) == looked_up
+    assert read_lines(write_dir) == expected
+    assert not os.path.exists(locations_checkpoint_path(write_dir))
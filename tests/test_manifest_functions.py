@@ -0,0 +1,74 @@
+import gzip
+import json
+import os
+
+from Code.create_delta_nt_files import create_delta_nt_file, update_manifest
+from Code.UtilityFunctions.get_iri import get_iri
+from Code.UtilityFunctions.manifest_functions import build_manifest, diff_manifests, load_manifest
+
+file_name = "yelp_academic_dataset_business.json"
+
+
+def write_snapshot(directory: str, records: list):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, file_name), mode="wt", encoding="utf-8") as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+
+def test_diff_finds_added_changed_and_deleted_objects(synthetic_yelp, tmp_path):
+    with open(os.path.join(synthetic_yelp, file_name), mode="rt", encoding="utf-8") as file:
+        old_records = [json.loads(line) for line in file]
+    new_records = [dict(record) for record in old_records[2:]]  # The first two are deleted.
+    new_records[0]["stars"] = 0.5  # Changed.
+    new_records.append({**old_records[0], "business_id": "added_business"})
+    new_records.reverse()  # The order of the file does not matter.
+
+    write_snapshot(str(tmp_path / "old"), old_records)
+    write_snapshot(str(tmp_path / "new"), new_records)
+    new_manifest = build_manifest(str(tmp_path / "new" / file_name))
+    delta = diff_manifests(build_manifest(str(tmp_path / "old" / file_name)), new_manifest)
+
+    with open(tmp_path / "new" / file_name, mode="rb") as file:
+        data = file.read()
+    def ids_at(offsets):
+        return sorted(json.loads(data[offset:data.index(b"\n", offset)])["business_id"] for offset in offsets.tolist())
+
+    assert ids_at(delta["added_offsets"]) == ["added_business"]
+    assert ids_at(delta["changed_offsets"]) == [old_records[2]["business_id"]]
+    assert [_id.decode() for _id in delta["changed_ids"]] == [old_records[2]["business_id"]]
+    assert sorted(_id.decode() for _id in delta["deleted_ids"]) == sorted(record["business_id"] for record in old_records[:2])
+
+
+def test_delta_against_missing_manifest_adds_everything(synthetic_yelp, write_dir):
+    manifest_dir = os.path.join(write_dir, "manifests")
+    counts = create_delta_nt_file(file_name, synthetic_yelp, write_dir, manifest_dir)
+    assert counts == {"added": len(build_manifest(os.path.join(synthetic_yelp, file_name))["keys"]), "changed": 0, "deleted": 0}
+
+    # The manifest of the snapshot was saved, so the same snapshot again is an empty delta.
+    assert create_delta_nt_file(file_name, synthetic_yelp, write_dir, manifest_dir) == {"added": 0, "changed": 0, "deleted": 0}
+    update_manifest(file_name, synthetic_yelp, manifest_dir)
+    assert len(load_manifest(manifest_dir, file_name)["keys"]) == counts["added"]
+
+
+def test_delta_writes_the_added_and_changed_objects(synthetic_yelp, write_dir):
+    with open(os.path.join(synthetic_yelp, file_name), mode="rt", encoding="utf-8") as file:
+        old_records = [json.loads(line) for line in file]
+    new_records = [dict(record) for record in old_records]
+    for record in new_records[5::9]:
+        record["stars"] = 0.5
+    new_records.append({**old_records[0], "business_id": "added_business"})
+
+    manifest_dir = os.path.join(write_dir, "manifests")
+    write_snapshot(os.path.join(write_dir, "old"), old_records)
+    write_snapshot(os.path.join(write_dir, "new"), new_records)
+    update_manifest(file_name, os.path.join(write_dir, "old"), manifest_dir)
+    counts = create_delta_nt_file(file_name, os.path.join(write_dir, "new"), write_dir, manifest_dir)
+
+    prefix = "<" + get_iri(file_name)
+    with gzip.open(os.path.join(write_dir, "yelp_business.delta.add.nt.gz"), mode="rt", encoding="utf-8") as file:
+        subjects = {line.split(" ")[0][len(prefix):-1] for line in file if line.startswith(prefix)}
+
+    changed = [record["business_id"] for record in new_records[5:-1:9]]
+    assert counts == {"added": 1, "changed": len(changed), "deleted": 0}
+    assert sorted(subjects) == sorted(["added_business"] + changed)
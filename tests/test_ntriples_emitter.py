@@ -0,0 +1,51 @@
+import gzip
+import os
+
+import pytest
+from rdflib import Graph
+from rdflib.compare import isomorphic
+
+from Code.create_yelp_nt_files import create_nt_file, create_checkin_nt_file, create_tip_nt_file
+from Code.UtilityFunctions.ntriples_functions import NTriplesEmitter
+
+converters = {
+    "business": lambda read_dir, write_dir, use_rdflib: create_nt_file("yelp_academic_dataset_business.json", read_dir, write_dir, use_rdflib),
+    "user": lambda read_dir, write_dir, use_rdflib: create_nt_file("yelp_academic_dataset_user.json", read_dir, write_dir, use_rdflib),
+    "review": lambda read_dir, write_dir, use_rdflib: create_nt_file("yelp_academic_dataset_review.json", read_dir, write_dir, use_rdflib),
+    "checkin": lambda read_dir, write_dir, use_rdflib: create_checkin_nt_file(read_dir, write_dir, use_rdflib),
+    "tip": lambda read_dir, write_dir, use_rdflib: create_tip_nt_file(read_dir, write_dir, use_rdflib),
+}
+
+
+def read_lines(path: str) -> list:
+    with gzip.open(path, mode="rt", encoding="utf-8") as file:
+        return [line for line in file.read().splitlines() if line]
+
+
+@pytest.mark.parametrize("entity", list(converters))
+def test_direct_emitter_matches_rdflib(entity, synthetic_yelp, write_dir):
+    """The direct emitter writes the same graph as the rdflib reference mode, and every triple of a record once."""
+    direct_dir, reference_dir = os.path.join(write_dir, "direct"), os.path.join(write_dir, "rdflib")
+    os.makedirs(direct_dir)
+    os.makedirs(reference_dir)
+    converters[entity](synthetic_yelp, direct_dir, False)
+    converters[entity](synthetic_yelp, reference_dir, True)
+
+    direct_lines = read_lines(os.path.join(direct_dir, f"yelp_{entity}.nt.gz"))
+    reference_lines = read_lines(os.path.join(reference_dir, f"yelp_{entity}.nt.gz"))
+    direct, reference = Graph(), Graph()
+    direct.parse(data="\n".join(direct_lines), format="nt")
+    reference.parse(data="\n".join(reference_lines), format="nt")
+
+    assert isomorphic(direct, reference)
+    assert len(direct_lines) == len(reference_lines) == len(direct)
+
+
+def test_emitter_writes_repeated_triples_once():
+    emitter = NTriplesEmitter()
+    subject, predicate = emitter.uri("https://example.org/s"), emitter.term("https://example.org/p")
+    for year in ["20", "20", "2021"]:
+        emitter.add((subject, predicate, emitter.literal(year)))
+
+    assert emitter.serialize().splitlines() == [f'{subject} {predicate} "20" .', f'{subject} {predicate} "2021" .']
+    assert emitter.triples == 2
@@ -0,0 +1,45 @@
+import sqlite3
+
+import pandas as pd
+
+from Code.UtilityFunctions.reverse_coordinate_search import ReverseGeocoder
+
+places = [
+    # kind, name, latitude, longitude, county, state, country
+    ("city", "Camden", 39.9259, -75.1196, None, "New Jersey", "United States"),  # admin2 code missing
+    ("city", "Philadelphia", 39.9524, -75.1636, "Philadelphia", "Pennsylvania", "United States"),
+    ("postcode", "19106", 39.9489, -75.1458, "Philadelphia", "Pennsylvania", "United States"),
+    ("postcode", "08102", 39.9500, -75.1200, "Camden", "New Jersey", "United States"),
+    ("neighbourhood", "Old City", 39.9522, -75.1432, None, None, None),
+    ("postcode", "99501", 61.2160, -149.8760, "Anchorage", "Alaska", "United States"),
+]
+
+
+def gazetteer(tmp_path, rows) -> str:
+    path = str(tmp_path / "gazetteer.sqlite")
+    connection = sqlite3.connect(path)
+    pd.DataFrame(rows, columns=["kind", "name", "latitude", "longitude", "county", "state", "country"]) \
+        .to_sql("places", connection, index=False)
+    connection.close()
+    return path
+
+
+def test_levels_are_not_taken_across_a_state_border(tmp_path):
+    # Without the Camden postcode, the nearest postcode of a point in Camden lies in Pennsylvania.
+    geocoder = ReverseGeocoder(gazetteer(tmp_path, [place for place in places if place[1] != "08102"]))
+    address = geocoder.reverse([39.9300], [-75.1250]).iloc[0]
+
+    assert (address["city"], address["state"], address["country"]) == ("Camden", "New Jersey", "United States")
+    assert address["county"] is None
+
+
+def test_levels_are_filled_from_a_postcode_in_the_same_state(tmp_path):
+    geocoder = ReverseGeocoder(gazetteer(tmp_path, places))
+    addresses = geocoder.reverse([39.9400, 39.9520, 61.2160, 0.0], [-75.1220, -75.1440, -149.8760, 0.0])
+
+    assert addresses.loc[0, ["city", "postcode", "county", "state"]].tolist() == ["Camden", "08102", "Camden", "New Jersey"]
+    assert addresses.loc[1, ["neighbourhood", "city", "county", "state"]].tolist() == ["Old City", "Philadelphia",
+                                                                                        "Philadelphia", "Pennsylvania"]
+    # No city near, so the levels come from the postcode.
+    assert addresses.loc[2, ["city", "county", "state"]].tolist() == [None, "Anchorage", "Alaska"]
+    assert addresses.loc[3].isna().all()
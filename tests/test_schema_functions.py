@@ -0,0 +1,24 @@
+import json
+import os
+import shutil
+
+from Code.UtilityFunctions.cache_functions import cache_path
+from Code.UtilityFunctions.schema_functions import load_predicate_table
+
+file_name = "yelp_academic_dataset_business.json"
+
+
+def test_predicate_table_of_another_cache_version_is_inferred_again(synthetic_yelp, tmp_path):
+    shutil.copy(os.path.join(synthetic_yelp, file_name), tmp_path / file_name)
+    expected = dict(load_predicate_table(str(tmp_path / file_name), str(tmp_path)).entries)
+
+    # A table saved by an earlier version of the code, for the same file.
+    table_path = cache_path(str(tmp_path), file_name.replace(".json", ".predicates.json"))
+    with open(table_path, mode="rt") as file:
+        saved = json.load(file)
+    saved["version"] -= 1
+    saved["entries"]["stars"] = ["https://schema.org/stale", "http://www.w3.org/2001/XMLSchema#string"]
+    with open(table_path, mode="wt") as file:
+        json.dump(saved, file)
+
+    assert dict(load_predicate_table(str(tmp_path / file_name), str(tmp_path)).entries) == expected
@@ -0,0 +1,61 @@
+import gzip
+import os
+
+import pytest
+from rdflib import Graph
+from rdflib.compare import isomorphic
+
+from Code.create_yelp_nt_files import create_nt_file, create_nt_file_sharded
+from Code.UtilityFunctions.shard_functions import newline_aligned_ranges, read_line_range, concatenate_parts
+
+
+@pytest.mark.parametrize("n_shards", [1, 2, 3, 7, 1000])
+def test_ranges_cover_every_line_once(n_shards, synthetic_yelp):
+    file_path = os.path.join(synthetic_yelp, "yelp_academic_dataset_review.json")
+    ranges = newline_aligned_ranges(file_path, n_shards)
+
+    assert ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(file_path)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    with open(file_path, mode="rb") as file:
+        lines = file.readlines()
+        sharded = [line for start, end in ranges for _, line in read_line_range(file, start, end)]
+    assert sharded == lines
+
+
+def test_concatenate_parts_replaces_destination(tmp_path):
+    parts = []
+    for number in range(3):
+        parts.append(str(tmp_path / f"part{number}.nt.gz"))
+        with gzip.open(parts[-1], mode="wt") as file:
+            file.write(f"<https://example.org/{number}> <https://example.org/p> \"{number}\" .\n")
+    destination = str(tmp_path / "all.nt.gz")
+    with gzip.open(destination, mode="wt") as file:
+        file.write("<https://example.org/old> <https://example.org/p> \"old\" .\n")
+
+    concatenate_parts(parts, destination, remove_parts=False)
+    concatenate_parts(parts, destination)
+
+    with gzip.open(destination, mode="rt") as file:
+        assert file.read().splitlines() == [f"<https://example.org/{number}> <https://example.org/p> \"{number}\" ." for number in range(3)]
+    assert not any(os.path.exists(part) for part in parts)
+
+
+def test_sharded_conversion_matches_single_process(synthetic_yelp, write_dir):
+    single_dir, sharded_dir = os.path.join(write_dir, "single"), os.path.join(write_dir, "sharded")
+    os.makedirs(single_dir)
+    os.makedirs(sharded_dir)
+    create_nt_file("yelp_academic_dataset_business.json", synthetic_yelp, single_dir)
+    for _ in range(2):  # A rerun replaces the concatenated file.
+        paths = create_nt_file_sharded("yelp_academic_dataset_business.json", synthetic_yelp, sharded_dir, workers=3,
+                                       concatenate=True)
+
+    single, sharded = Graph(), Graph()
+    with gzip.open(os.path.join(single_dir, "yelp_business.nt.gz"), mode="rt", encoding="utf-8") as file:
+        single_lines = file.read().splitlines()
+    with gzip.open(paths[0], mode="rt", encoding="utf-8") as file:
+        sharded_lines = file.read().splitlines()
+    single.parse(data="\n".join(single_lines), format="nt")
+    sharded.parse(data="\n".join(sharded_lines), format="nt")
+
+    assert isomorphic(single, sharded)
+    assert len(single_lines) == len(sharded_lines)
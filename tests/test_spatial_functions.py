@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from Code.UtilityFunctions.spatial_functions import SpatialIndex, haversine, nearest_candidates
+
+
+def brute_force_within(latitudes, longitudes, query_latitudes, query_longitudes, radius_km):
+    pairs = set()
+    for query, (latitude, longitude) in enumerate(zip(query_latitudes, query_longitudes)):
+        distances = haversine(latitude, longitude, latitudes, longitudes)
+        pairs.update((query, point) for point in np.flatnonzero(distances <= radius_km))
+    return pairs
+
+
+@pytest.mark.parametrize("radius_km", [5.0, 100.0, 2500.0])
+def test_within_matches_brute_force(radius_km):
+    rng = np.random.default_rng(0)
+    # Clustered points, and points near the poles and the antimeridian, where the grid wraps around.
+    latitudes = np.concatenate([rng.uniform(39, 41, 300), rng.uniform(-90, 90, 300), rng.uniform(85, 90, 50)])
+    longitudes = np.concatenate([rng.uniform(-76, -74, 300), rng.uniform(-180, 180, 300), rng.uniform(-180, 180, 50)])
+    longitudes[:20] = rng.choice([-179.99, 179.99], 20)
+    query_latitudes = np.concatenate([rng.uniform(39, 41, 100), rng.uniform(-90, 90, 100), [89.9, -89.9, 0.0, 0.0]])
+    query_longitudes = np.concatenate([rng.uniform(-76, -74, 100), rng.uniform(-180, 180, 100), [0.0, 0.0, 180.0, -180.0]])
+
+    index = SpatialIndex(latitudes, longitudes, radius_km)
+    queries, points, distances = index.within(query_latitudes, query_longitudes)
+
+    assert set(zip(queries.tolist(), points.tolist())) == brute_force_within(latitudes, longitudes, query_latitudes,
+                                                                             query_longitudes, radius_km)
+    assert np.allclose(distances, haversine(query_latitudes[queries], query_longitudes[queries],
+                                            latitudes[points], longitudes[points]))
+
+
+def test_nearest_takes_the_first_of_equal_points_and_reports_misses():
+    index = SpatialIndex([40.0, 40.0, 40.1, -40.0], [-75.0, -75.0, -75.0, 100.0], radius_km=50)
+    nearest, distances = index.nearest(np.array([40.0, 40.09, 0.0]), np.array([-75.0, -75.0, 0.0]))
+
+    assert nearest.tolist() == [0, 2, -1]
+    assert distances[0] == 0 and np.isinf(distances[2])
+
+
+def test_nearest_candidates_only_considers_own_candidates():
+    coordinates = {"Q1": [(40.0, -75.0)], "Q2": [(40.01, -75.0), (10.0, 10.0)], "Q3": []}
+    nearest = nearest_candidates([40.0, 10.0, 40.0], [-75.0, 10.0, -75.0], [["Q2"], ["Q1", "Q2"], ["Q3"]], coordinates,
+                                 radius_km=10)
+
+    assert nearest == ["Q2", "Q2", None]